@@ -0,0 +1,227 @@
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from event_time import combine_date_time, datetimes_to_seconds
+from ingest_pipeline import frame_to_records
+
+# Device identifier columns per source, keyed by join key
+DEVICE_COLUMNS = {
+    "imei": {"crd": "imei_a", "ipdr": "imei"},
+    "imsi": {"crd": "imsi_a", "ipdr": "imsi"},
+}
+
+VOICE_COLUMNS = ["a_party", "b_party", "date", "time", "duration", "call_type",
+                 "first_cell_id_a", "imei_a", "imsi_a"]
+
+DATA_COLUMNS = ["landline_msidn_mdn_leased_circuit_id", "imei", "imsi", "first_cell_id",
+                "destination_ip_address", "destination_port", "access_point_name",
+                "start_date_of_public_ip_allocation", "ist_start_time_of_public_ip_allocation",
+                "session_duration", "data_volume_up_link", "data_volume_down_link"]
+
+# IMEIs show up as 14 (no check digit), 15 or 16 (IMEISV) digits depending on the source
+IMEI_MATCH_DIGITS = 14
+
+# Device lookups match these columns on their own type (text on crd, bigint on ipdr)
+DEVICE_INDEX_DDL = [
+    f"CREATE INDEX IF NOT EXISTS idx_{_table}_{_column} ON {_table} ({_column}) WHERE {_column} IS NOT NULL"
+    for _sources in DEVICE_COLUMNS.values() for _table, _column in _sources.items()
+]
+
+DEFAULT_TOLERANCE_SECONDS = 300
+
+
+def normalize_device_ids(values: pd.Series, key: str) -> pd.Series:
+    """Canonical device key: digits only, IMEIs truncated to TAC + serial"""
+    text = values.astype(str).str.strip().str.replace(r"\.0$", "", regex=True).str.replace(r"\D", "", regex=True)
+    if key == "imei":
+        text = text.str[:IMEI_MATCH_DIGITS]
+    return text.where(values.notna() & (text.str.len() > 0))
+
+
+def imei_check_digit(body: str) -> str:
+    """Luhn check digit of a 14-digit IMEI body"""
+    total = 0
+    for position, digit in enumerate(reversed(body)):
+        value = int(digit) * (2 if position % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str((10 - total % 10) % 10)
+
+
+def device_id_forms(device_id: str, key: str) -> List[str]:
+    """
+    Every stored form of a device identifier, so lookups can be exact matches
+
+    An IMEI is stored as its 14 digits, with the Luhn check digit, or as an IMEISV
+    (the 14 digits and a two-digit software version), depending on the source.
+    """
+    digits = normalize_device_ids(pd.Series([device_id]), key).iloc[0]
+    if pd.isna(digits):
+        return []
+    forms = {digits, re.sub(r"\D", "", str(device_id))}
+    if key == "imei" and len(digits) == IMEI_MATCH_DIGITS:
+        forms.add(digits + imei_check_digit(digits))
+        forms.update(f"{digits}{version:02d}" for version in range(100))
+    return sorted(form for form in forms if form)
+
+
+class ActivityTimeline:
+    """
+    Sort-merge time-window join between voice (crd) and data (ipdr) activity per device
+
+    Both sides are sorted once by (device, timestamp) and packed into a single
+    int64 key, so every window bound is found with one searchsorted pass over
+    the sorted inputs instead of a nested-loop join.
+    """
+
+    def __init__(self, key: str = "imei", tolerance_seconds: int = DEFAULT_TOLERANCE_SECONDS, verbose=False):
+        if key not in DEVICE_COLUMNS:
+            raise ValueError(f"key must be one of: {', '.join(DEVICE_COLUMNS)}")
+        self.key = key
+        self.tolerance = int(tolerance_seconds)
+        self.verbose = verbose
+
+    def _prepare(self, records: List[Dict], source: str) -> pd.DataFrame:
+        df = pd.DataFrame(records)
+        columns = VOICE_COLUMNS if source == "crd" else DATA_COLUMNS
+        for column in columns:
+            if column not in df.columns:
+                df[column] = None
+
+        if source == "crd":
+            parsed = combine_date_time(df["date"], df["time"])
+        else:
+            parsed = combine_date_time(df["start_date_of_public_ip_allocation"], df["ist_start_time_of_public_ip_allocation"])
+
+        df["device"] = normalize_device_ids(df[DEVICE_COLUMNS[self.key][source]], self.key)
+        df["event_time"] = parsed
+        df["_ts"] = datetimes_to_seconds(parsed)
+        df = df[df["device"].notna() & (df["_ts"] >= 0)]
+        return df.sort_values(["device", "_ts"], kind="mergesort").reset_index(drop=True)
+
+    @staticmethod
+    def _packed(df: pd.DataFrame, devices: pd.Index) -> np.ndarray:
+        codes = devices.get_indexer(df["device"]).astype(np.int64)
+        return (codes << 32) + df["_ts"].values
+
+    def join(self, voice_records: List[Dict], data_records: List[Dict]) -> pd.DataFrame:
+        """Every (voice event, data session) pair on the same device within the tolerance"""
+        voice = self._prepare(voice_records, "crd")
+        data = self._prepare(data_records, "ipdr")
+        if voice.empty or data.empty:
+            return pd.DataFrame()
+
+        devices = pd.Index(pd.unique(pd.concat([voice["device"], data["device"]])))
+        voice_keys = self._packed(voice, devices)
+        data_keys = self._packed(data, devices)
+
+        # Device code lives in the high bits, so a window never crosses into another device
+        lo = np.searchsorted(data_keys, voice_keys - self.tolerance, side="left")
+        hi = np.searchsorted(data_keys, voice_keys + self.tolerance, side="right")
+        counts = hi - lo
+
+        voice_idx = np.repeat(np.arange(len(voice)), counts)
+        data_idx = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+        v = voice.iloc[voice_idx].reset_index(drop=True)
+        d = data.iloc[data_idx].reset_index(drop=True)
+        pairs = pd.DataFrame({
+            "device": v["device"],
+            "voice_time": v["event_time"],
+            "data_time": d["event_time"],
+            "offset_seconds": d["_ts"].values - v["_ts"].values,
+            "a_party": v["a_party"],
+            "b_party": v["b_party"],
+            "call_type": v["call_type"],
+            "call_duration": v["duration"],
+            "voice_cell": v["first_cell_id_a"],
+            "msisdn": d["landline_msidn_mdn_leased_circuit_id"],
+            "data_cell": d["first_cell_id"],
+            "destination_ip_address": d["destination_ip_address"],
+            "access_point_name": d["access_point_name"],
+        })
+
+        if self.verbose:
+            print(f"🔀 Joined {len(voice):,} voice and {len(data):,} data events into {len(pairs):,} pairs")
+        return pairs
+
+    def timeline(self, voice_records: List[Dict], data_records: List[Dict]) -> pd.DataFrame:
+        """Unified per-device timeline, each event tagged with its nearest event of the other kind"""
+        voice = self._prepare(voice_records, "crd")
+        data = self._prepare(data_records, "ipdr")
+
+        voice_events = pd.DataFrame({
+            "device": voice["device"], "event_time": voice["event_time"], "_ts": voice["_ts"],
+            "event_type": "voice", "party": voice["a_party"], "counterpart": voice["b_party"],
+            "detail": voice["call_type"], "cell_id": voice["first_cell_id_a"]
+        })
+        data_events = pd.DataFrame({
+            "device": data["device"], "event_time": data["event_time"], "_ts": data["_ts"],
+            "event_type": "data", "party": data["landline_msidn_mdn_leased_circuit_id"],
+            "counterpart": data["destination_ip_address"], "detail": data["access_point_name"],
+            "cell_id": data["first_cell_id"]
+        })
+
+        events = pd.concat([voice_events, data_events], ignore_index=True)
+        if events.empty:
+            return events
+
+        events = events.sort_values(["device", "_ts"], kind="mergesort").reset_index(drop=True)
+        events["nearest_other_seconds"] = np.nan
+
+        # Nearest event of the other kind on the same device - a linear merge over sorted inputs
+        for kind, other in (("voice", data_events), ("data", voice_events)):
+            mask = events["event_type"] == kind
+            if not mask.any() or other.empty:
+                continue
+            left = events.loc[mask, ["device", "_ts"]].reset_index().sort_values("_ts", kind="mergesort")
+            right = other[["device", "_ts"]].rename(columns={"_ts": "_other_ts"}).sort_values("_other_ts", kind="mergesort")
+            nearest = pd.merge_asof(left, right, left_on="_ts", right_on="_other_ts", by="device", direction="nearest")
+            events.loc[nearest["index"].values, "nearest_other_seconds"] = (nearest["_other_ts"] - nearest["_ts"]).values
+
+        events["correlated"] = events["nearest_other_seconds"].abs() <= self.tolerance
+        return events.drop(columns=["_ts"])
+
+    @staticmethod
+    def to_records(df: pd.DataFrame) -> List[Dict]:
+        """JSON-compatible records with timestamps rendered as ISO strings"""
+        df = df.copy()
+        for column in ["event_time", "voice_time", "data_time"]:
+            if column in df.columns:
+                df[column] = df[column].map(lambda v: v.isoformat() if pd.notna(v) else None)
+        return frame_to_records(df)
+
+    def load_from_database(self, supabase_handler, device_ids: List[str]) -> Tuple[bool, str, List[Dict], List[Dict]]:
+        """Fetch the crd and ipdr rows of the handler's active case for the given devices"""
+        ids = [str(d).strip() for d in device_ids if d]
+        if not ids:
+            return False, "No device identifiers supplied", [], []
+
+        crd_column = DEVICE_COLUMNS[self.key]["crd"]
+        ipdr_column = DEVICE_COLUMNS[self.key]["ipdr"]
+
+        # Exact matches on every 14/15/16-digit form, so the device indexes are used. The array is
+        # passed as an untyped literal, which PostgreSQL reads as an array of the column's own type.
+        forms = sorted({form for i in ids for form in device_id_forms(i, self.key)})
+        if not forms:
+            return False, "No valid device identifiers supplied", [], []
+        params = ("{" + ",".join(forms) + "}",)
+        # Raw SQL is not case-scoped automatically
+        case_filter = ""
+        if supabase_handler.active_case_id:
+            case_filter = " AND case_id = %s"
+            params += (supabase_handler.active_case_id,)
+
+        success, message, voice = supabase_handler.execute_raw_sql(
+            f"SELECT {', '.join(VOICE_COLUMNS)} FROM crd WHERE {crd_column} = ANY(%s){case_filter}", params)
+        if not success:
+            return False, message, [], []
+
+        success, message, data = supabase_handler.execute_raw_sql(
+            f"SELECT {', '.join(DATA_COLUMNS)} FROM ipdr WHERE {ipdr_column} = ANY(%s){case_filter}", params)
+        if not success:
+            return False, message, [], []
+
+        return True, f"Loaded {len(voice)} voice and {len(data)} data events", voice, data
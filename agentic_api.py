@@ -5,6 +5,7 @@ from typing import List, Optional, Dict, Any
 import json
 import openai
 import asyncio
+import time
 from datetime import datetime
 import logging
 import os
@@ -71,6 +72,7 @@ if NEO4J_AVAILABLE:
 class UserQuery(BaseModel):
     query: str
     conversation_id: Optional[str] = None
+    case_id: Optional[str] = None
 
 class ConverserResponse(BaseModel):
     status: str  # "awaiting_clarification" | "confirmed" | "rejected"
@@ -86,6 +88,7 @@ class QueryTranslationRequest(BaseModel):
 class SQLQueryResponse(BaseModel):
     queries: List[Dict[str, Any]]
     analysis_focus: str
+    case_id: Optional[str] = None
 
 class CypherQueryResponse(BaseModel):
     queries: List[Dict[str, Any]]
@@ -95,6 +98,7 @@ class ConsolidationRequest(BaseModel):
     sql_data: Dict[str, Any]
     cypher_data: Dict[str, Any]
     conversation_id: str
+    pattern_of_life: Optional[Dict[str, Any]] = None
 
 class ConsolidatedContext(BaseModel):
     query_context: str
@@ -257,21 +261,43 @@ Your expertise covers analyzing:
 **Your Database Schema (IMPORTANT: All table names are lowercase, use EXACT column names):**
 
 **crd** (Call Detail Records):
-- id (bigint), a_party (text), b_party (text), date (date), time (time), duration (integer), call_type (text), first_cell_id_a (text), last_cell_id_a (text), imei_a (text), imsi_a (text), first_cell_id_a_address (text), latitude (double precision), longitude (double precision)
+- id (bigint), a_party (text), b_party (text), date (date), time (time), duration (integer), call_type (text), first_cell_id_a (text), last_cell_id_a (text), imei_a (text), imsi_a (text), event_ts (timestamp), first_cell_key (integer), last_cell_key (integer), a_party_e164 (bigint), b_party_e164 (bigint), b_party_operator (text), b_party_circle (text)
 
 **ipdr** (Internet Protocol Detail Records):  
-- id (bigint), landline_msidn_mdn_leased_circuit_id (text), user_id (text), source_ip_address (text), source_port (integer), translated_ip_address (text), translated_port (integer), destination_ip_address (text), destination_port (integer), static_dynamic_ip_address_allocation (varchar), ist_start_time_of_public_ip_allocation (time), ist_end_time_of_public_ip_allocation (time), start_date_of_public_ip_allocation (date), end_date_of_public_ip_allocation (date), source_mac_id_address (bigint), imei (bigint), imsi (bigint), pgw_ip_address (inet), access_point_name (varchar), first_cell_id (varchar), last_cell_id (varchar), session_duration (integer), data_volume_up_link (bigint), data_volume_down_link (bigint), roaming_circle_indicator (varchar), roaming_circle (varchar), sim_type (varchar)
+- id (bigint), landline_msidn_mdn_leased_circuit_id (text), user_id (text), source_ip_address (text), source_port (integer), translated_ip_address (text), translated_port (integer), destination_ip_address (text), destination_port (integer), static_dynamic_ip_address_allocation (varchar), ist_start_time_of_public_ip_allocation (time), ist_end_time_of_public_ip_allocation (time), start_date_of_public_ip_allocation (date), end_date_of_public_ip_allocation (date), source_mac_id_address (bigint), imei (bigint), imsi (bigint), pgw_ip_address (inet), access_point_name (varchar), first_cell_id (varchar), last_cell_id (varchar), session_duration (integer), data_volume_up_link (bigint), data_volume_down_link (bigint), roaming_circle_indicator (varchar), roaming_circle (varchar), sim_type (varchar), source_ip_v4 (bigint), translated_ip_v4 (bigint), destination_ip_v4 (bigint), event_ts (timestamp), msisdn_e164 (bigint), destination_service (text), destination_asn (bigint)
+
+**ipdr_sessions** (Stitched IPDR data sessions - consecutive fragments merged per case, MSISDN, source IP, translated IP/port and APN):
+- id (bigint), msisdn (text), source_ip_address (text), translated_ip_address (text), translated_port (integer), access_point_name (text), imei (text), imsi (text), first_cell_id (text), last_cell_id (text), session_start (timestamp), session_end (timestamp), fragment_count (integer), session_duration (bigint), data_volume_up_link (bigint), data_volume_down_link (bigint)
+
+**party_summary** (One row per A-party and case, kept up to date as CDRs load):
+- party (text, E.164 number e.g. '919876543210' where the number normalizes), total_calls (bigint), total_duration (bigint), first_seen (timestamp), last_seen (timestamp), contacts (text[]), distinct_contacts (integer), cell_counts (jsonb), top_cells (jsonb array of {value, count}), imeis (text[]), imei_count (integer), imsis (text[]), imsi_count (integer)
+
+**contact_edges** (One row per directed a_party -> b_party pair and case, kept up to date as CDRs load):
+- a_party (text), b_party (text) - both E.164 numbers as in party_summary, call_count (bigint), total_duration (bigint), first_contact (timestamp), last_contact (timestamp), in_count (bigint), out_count (bigint)
+
+**cells** (One row per cell tower, shared by crd and tower_dumps through first_cell_key / last_cell_key):
+- cell_key (integer), cell_id (text), address (text), latitude (double precision), longitude (double precision)
 
 **subscriber** (User Information):
-- id (bigint), phone_number (text), alternative_mobile_no (text), subscriber_name (text), guardian_name (text), address (text), date_of_activation (date), type_of_connection (text), service_provider (text), phone5 (text)
+- id (bigint), phone_number (text), alternative_mobile_no (text), subscriber_name (text), guardian_name (text), address (text), date_of_activation (date), type_of_connection (text), service_provider (text), phone5 (text), phone_number_e164 (bigint), alternative_mobile_no_e164 (bigint)
 
 **tower_dumps** (Location Intelligence):
-- id (bigint), b_party (text), date (text), duration (text), call_type (text), first_cell_id_a (text), last_cell_id_a (text), first_cell_id_a_address (text), roaming_a (text), latitude (double precision), longitude (double precision), a_party (text), time (text), imei_a (text), imsi_a (text)
+- id (bigint), b_party (text), date (text), duration (text), call_type (text), first_cell_id_a (text), last_cell_id_a (text), roaming_a (text), a_party (text), time (text), imei_a (text), imsi_a (text), event_ts (timestamp), first_cell_key (integer), last_cell_key (integer), a_party_e164 (bigint), b_party_e164 (bigint), b_party_operator (text), b_party_circle (text)
 
 **IMPORTANT NOTES:**
 - For IPDR queries, use 'landline_msidn_mdn_leased_circuit_id' for phone numbers
+- To match a number across tables (crd, tower_dumps, ipdr, subscriber), join on the bigint *_e164 columns, e.g. JOIN subscriber s ON s.phone_number_e164 = crd.b_party_e164, never on the text columns; to find a number however it is written, filter the key: a_party_e164 = e164_key('+91 98765 43210') instead of LIKE or RIGHT()
+- For the operator or telecom circle of a contacted number, use b_party_operator / b_party_circle on crd and tower_dumps (NULL when the number series is unknown)
+- For questions about whole data sessions (how long / how much data), prefer ipdr_sessions over raw ipdr fragments
+- For a number's overall activity (how many calls, total talk time, how many contacts/IMEIs/IMSIs, first/last seen, most used cells), read its row from party_summary instead of aggregating crd; party, contacts and the contact_edges a_party/b_party hold the number's E.164 key as text, so match them with party = coalesce(e164_key('...')::text, '...')
+- For top contacts, read contact_edges WHERE a_party = coalesce(e164_key('...')::text, '...') ORDER BY call_count DESC; for mutual/reciprocal contacts join contact_edges to itself on e1.a_party = e2.b_party AND e1.b_party = e2.a_party - never GROUP BY a_party, b_party over crd
+- For per-cell counts GROUP BY the integer first_cell_key rather than the cell id text; for a cell's address or coordinates JOIN cells ON cells.cell_key = crd.first_cell_key (or tower_dumps.first_cell_key) and read cells.address / cells.latitude / cells.longitude - crd and tower_dumps do not carry them
+- For app or service usage in IPDR (WhatsApp, Telegram, VPN providers...), filter or group by destination_service (indexed), e.g. WHERE destination_service = 'WhatsApp', instead of matching destination IPs; destination_asn holds the network's AS number
+- For IPv4 subnet/range questions in IPDR, filter the indexed integer columns, e.g. destination_ip_v4 BETWEEN ('157.240.0.0'::inet - '0.0.0.0'::inet) AND ('157.240.255.255'::inet - '0.0.0.0'::inet), instead of LIKE on the text address
 - For duration in CRD, use 'duration' (integer in seconds), not 'call_duration'
 - Tower dumps has 'date' and 'time' as separate text fields
+- Never filter on case_id yourself - results are restricted to the active case automatically
+- For time-range questions on crd, tower_dumps or ipdr, filter the indexed event_ts column (combined date + time), e.g. event_ts >= '2024-01-05 10:00' AND event_ts < '2024-01-05 12:00', instead of comparing date/time text
 - Call types in tower_dumps: 'CALL-IN', 'CALL-OUT', 'SMS-IN', 'SMS-OUT'
 - Connection types in subscriber: 'PREPAID', 'POSTPAID'
 
@@ -284,7 +310,7 @@ Generate precise SQL queries that will uncover criminal patterns and evidence. F
 - Data consumption anomalies
 
 **CRITICAL REQUIREMENTS:**
-1. **ALWAYS use lowercase table names**: crd, ipdr, subscriber, tower_dumps
+1. **ALWAYS use lowercase table names**: cells, crd, contact_edges, ipdr, ipdr_sessions, party_summary, subscriber, tower_dumps
 2. **NEVER use capitalized table names** like CRD, IPDR, Subscriber, Tower_Dumps
 3. **Use EXACT column names** as specified in the schema above (e.g., 'duration' not 'call_duration')
 4. **For PostgREST compatibility:**
@@ -528,6 +554,12 @@ async def execute_sql_queries(sql_response: SQLQueryResponse):
         
         print(f"   ✅ Database connection successful! (PostgreSQL: {'✅' if supabase_handler.pg_connection else '❌'}, Supabase: {'✅' if supabase_available else '❌'})")
         
+        # Every query only sees the active case's rows
+        try:
+            supabase_handler.set_active_case(sql_response.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         # Execute queries using the batch execution method
         print(f"   ⚡ Starting batch query execution...")
         result = supabase_handler.execute_batch_investigation_queries(sql_response.queries)
@@ -557,6 +589,9 @@ async def execute_sql_queries(sql_response: SQLQueryResponse):
                 "timestamp": datetime.now().isoformat()
             }
             
+    except HTTPException:
+        raise
+        
     except ImportError as e:
         error_msg = f"Failed to import SupabaseHandler: {str(e)}"
         logger.error(f"❌ [REAL SQL] {error_msg}")
@@ -834,8 +869,16 @@ Analyze the combined evidence from SQL database queries and Neo4j network analys
 }
 ```
 
+**Reading SQL results:** `actual_data` is only a sample of the matching rows. When a result has a `population` block, base counts, time ranges and top contacts/cells/devices on it - it covers every matching row (`total_count`, per-column `distinct` counts and `top` values, `time_range` min/max).
+
+**Reading pattern-of-life data:** when present, `anomalies` are days or hours where a party's calls, SMS or data sessions deviated from that party's own baseline (`baseline` is its usual count, `score` a robust z-score, highest first); `matrices` are weekday x hour activity counts (rows Monday..Sunday, columns hours 0-23). Use them for timeline analysis and suspicious indicators.
+
 Create a comprehensive intelligence report that tells the complete story of what the evidence reveals. Think like a senior investigator - what would law enforcement need to know to act on this intelligence?"""
 
+    pattern_section = ""
+    if request.pattern_of_life:
+        pattern_section = f"\nPattern of Life: {json.dumps(request.pattern_of_life, indent=2)}\n"
+
     try:
         response = openai_client.chat.completions.create(
             model="gpt-4o",
@@ -845,7 +888,7 @@ Create a comprehensive intelligence report that tells the complete story of what
 SQL Data: {json.dumps(request.sql_data, indent=2)}
 
 Cypher Data: {json.dumps(request.cypher_data, indent=2)}
-
+{pattern_section}
 Please consolidate this investigation data into unified context. Respond in JSON format.
 """}
             ],
@@ -936,11 +979,39 @@ async def full_investigation_pipeline(request: UserQuery):
         print(f"   📊 SQL queries: {len(sql_result.queries)}")
         print(f"   🕸️ Cypher queries: {len(cypher_result.queries)}")
         
+        sql_result.case_id = request.case_id
         sql_data, cypher_data = await asyncio.gather(
             execute_sql_queries(sql_result),
             execute_cypher_queries(cypher_result)
         )
         
+        # Queries the cost gate or schema validator turned away get one rewrite with the feedback
+        rejected = sql_data.get("execution_summary", {}).get("rejected_queries", [])
+        if rejected:
+            print(f"   🚧 {len(rejected)} SQL quer{'y' if len(rejected) == 1 else 'ies'} could not run - asking for a rewrite")
+            feedback = "\n".join(
+                f"- {q['sql']}\n  Rejected: {q['reason']}"
+                + (f". Most expensive steps: {'; '.join(q['hotspots'])}" if q["hotspots"] else "")
+                for q in rejected
+            )
+            retry_request = QueryTranslationRequest(
+                refined_query=(
+                    f"{converser_result.refined_query}\n\n"
+                    f"These previous queries could not be run:\n{feedback}\n"
+                    f"Rewrite them using only the listed tables and columns, with tighter filters "
+                    f"(party numbers, event_ts ranges), an explicit LIMIT, and no joins without a join condition."
+                ),
+                conversation_id=converser_result.conversation_id
+            )
+            retry_result = await sql_translation_agent(retry_request)
+            retry_result.case_id = request.case_id
+            retry_data = await execute_sql_queries(retry_result)
+            for key, value in retry_data.get("data", {}).items():
+                sql_data.setdefault("data", {})[f"retry_{key}"] = value
+            sql_data["success"] = sql_data.get("success") or retry_data.get("success", False)
+            sql_data.setdefault("execution_summary", {})["retry_execution"] = retry_data.get("execution_summary", {})
+            sql_result.queries.extend(retry_result.queries)
+
         print(f"   ✅ Parallel execution completed")
         print(f"      📊 SQL execution: {'✅ Success' if sql_data.get('success') else '❌ Failed'}")
         print(f"      🕸️ Cypher execution: {'✅ Success' if cypher_data.get('success') else '❌ Failed'}")
@@ -974,6 +1045,453 @@ async def full_investigation_pipeline(request: UserQuery):
         logger.error(f"❌ [PIPELINE] Investigation pipeline error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Investigation pipeline failed: {str(e)}")
 
+# ================== IDENTITY RESOLUTION ==================
+
+@app.get("/api/identity/{identifier}")
+async def resolve_identity(identifier: str, kind: Optional[str] = None, case_id: Optional[str] = None):
+    """Return all numbers, IMEIs and IMSIs linked to a number, handset or SIM within a case (all data without one)"""
+
+    logger.info(f"🔗 [IDENTITY] Resolving cluster for: {identifier} in case {case_id or '(all data)'}")
+
+    try:
+        from identity_resolver import get_identity_resolver, IDENTIFIER_KINDS
+        from supabase_handler import SupabaseHandler
+
+        if kind and kind not in IDENTIFIER_KINDS:
+            raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(IDENTIFIER_KINDS)}")
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        resolver = get_identity_resolver(handler.active_case_id)
+
+        # The index lives in memory - (re)build it whenever crd/tower_dumps/ipdr changed,
+        # including loads made by the upload server process
+        refreshed = resolver.refresh_from_database(handler)
+        if refreshed:
+            success, message = refreshed
+            logger.info(f"{'✅' if success else '⚠️'} [IDENTITY] {message}")
+
+        cluster = resolver.get_cluster(identifier, kind)
+        if not cluster:
+            raise HTTPException(status_code=404, detail=f"No identity cluster found for {identifier}")
+
+        return {
+            "success": True,
+            "cluster": cluster,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [IDENTITY] Resolution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Identity resolution failed: {str(e)}")
+
+# ================== IPDR NAT ATTRIBUTION ==================
+
+class AttributionLookup(BaseModel):
+    ip: str
+    port: Optional[int] = None
+    timestamp: str
+
+class AttributionRequest(BaseModel):
+    lookups: List[AttributionLookup]
+    case_id: Optional[str] = None
+
+@app.post("/api/ipdr/attribute")
+async def attribute_public_ips(request: AttributionRequest):
+    """Resolve (public IP, port, timestamp) log lines to MSISDN, IMEI and cell"""
+
+    logger.info(f"📡 [NAT] Attributing {len(request.lookups)} log lines")
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from nat_attribution import NATAttributionEngine
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        lookups = [lookup.dict() for lookup in request.lookups]
+        engine = NATAttributionEngine()
+
+        # Only the allocation windows of the requested IPs are loaded
+        success, message = engine.load_from_database(handler, [l["ip"] for l in lookups])
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Failed to load IP allocations: {message}")
+
+        results = engine.attribute_records(lookups)
+        resolved = sum(1 for r in results if r.get("match_type"))
+
+        return {
+            "success": True,
+            "message": f"Attributed {resolved}/{len(results)} log lines",
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [NAT] Attribution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"NAT attribution failed: {str(e)}")
+
+# ================== DEVICE ACTIVITY TIMELINE ==================
+
+class TimelineRequest(BaseModel):
+    devices: List[str]
+    key: str = "imei"
+    tolerance_seconds: int = Field(default=300, ge=0, le=86400)
+    case_id: Optional[str] = None
+
+@app.post("/api/device/timeline")
+async def device_activity_timeline(request: TimelineRequest):
+    """Line up voice (crd) and data (ipdr) activity per device within a time tolerance"""
+
+    logger.info(f"🕒 [TIMELINE] Building timeline for {len(request.devices)} device(s) by {request.key}")
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from activity_timeline import ActivityTimeline
+
+        try:
+            timeline = ActivityTimeline(key=request.key, tolerance_seconds=request.tolerance_seconds)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        success, message, voice, data = timeline.load_from_database(handler, request.devices)
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Failed to load device activity: {message}")
+
+        events = timeline.timeline(voice, data)
+        pairs = timeline.join(voice, data)
+
+        return {
+            "success": True,
+            "message": f"{message}; {len(pairs)} voice/data pairs within {request.tolerance_seconds}s",
+            "timeline": timeline.to_records(events),
+            "correlated_pairs": timeline.to_records(pairs),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [TIMELINE] Timeline error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Device timeline failed: {str(e)}")
+
+# ================== APPROXIMATE TOWER ANALYTICS ==================
+
+class TowerApproximateRequest(BaseModel):
+    cell_ids: List[str]
+    start: datetime
+    end: datetime
+    metric: str = "distinct_numbers"
+    per_hour: bool = False
+    k: int = Field(default=10, ge=1, le=100)
+    case_id: Optional[str] = None
+
+@app.post("/api/tower/approximate")
+async def tower_approximate(request: TowerApproximateRequest):
+    """Approximate distinct numbers or top talkers per cell and time window from tower_dumps sketches"""
+
+    logger.info(f"📶 [SKETCH] {request.metric} for {len(request.cell_ids)} cell(s), {request.start} - {request.end}")
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from tower_sketches import TowerSketchQuery
+
+        if request.metric not in ("distinct_numbers", "top_talkers"):
+            raise HTTPException(status_code=400, detail="metric must be one of: distinct_numbers, top_talkers")
+        if request.end <= request.start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        started = time.perf_counter()
+        query = TowerSketchQuery(handler)
+        if request.metric == "distinct_numbers":
+            success, message, result = query.distinct_numbers(request.cell_ids, request.start, request.end, request.per_hour)
+        else:
+            success, message, result = query.top_talkers(request.cell_ids, request.start, request.end, request.k)
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Failed to read tower sketches: {message}")
+
+        return {
+            "success": True,
+            "message": message,
+            "approximate": True,
+            "result": result,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [SKETCH] Approximate query error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Approximate tower query failed: {str(e)}")
+
+class TowerMembershipRequest(BaseModel):
+    identifiers: List[str]
+    case_id: Optional[str] = None
+
+@app.post("/api/tower/membership")
+async def tower_membership(request: TowerMembershipRequest):
+    """Which tower dumps contain each number or IMEI - Bloom filters decide which dumps are searched"""
+
+    logger.info(f"🌸 [MEMBERSHIP] Locating {len(request.identifiers)} identifier(s) across tower dumps")
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from dump_filters import DumpFilterIndex
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        success, message, result = DumpFilterIndex().locate(handler, request.identifiers)
+        if not success:
+            raise HTTPException(status_code=400 if not result and message == "No identifiers given" else 500,
+                                detail=f"Tower dump membership failed: {message}")
+
+        return {
+            "success": True,
+            "message": message,
+            **result,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [MEMBERSHIP] Lookup error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Tower dump membership failed: {str(e)}")
+
+class IpServiceRequest(BaseModel):
+    addresses: List[str]
+
+@app.post("/api/ipdr/services")
+async def ipdr_services(request: IpServiceRequest):
+    """Which service / ASN each IP address belongs to, from the installed IP services dataset"""
+
+    logger.info(f"🛰️ [IP SERVICES] Attributing {len(request.addresses)} address(es)")
+
+    try:
+        import pandas as pd
+        from ip_services import get_ip_services
+
+        service_map = get_ip_services()
+        if service_map is None:
+            raise HTTPException(status_code=503, detail="No IP services dataset installed")
+
+        addresses = pd.Series(request.addresses, dtype=object)
+        services, asns = service_map.attribute_addresses(addresses)
+        return {
+            "success": True,
+            "message": f"Attributed {int(services.notna().sum())} of {len(addresses)} addresses",
+            "results": [{"address": address, "service": service, "asn": asn}
+                        for address, service, asn in zip(request.addresses, services.tolist(), asns.tolist())],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [IP SERVICES] Attribution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"IP service attribution failed: {str(e)}")
+
+class CidrSessionRequest(BaseModel):
+    cidr: str
+    direction: str = "destination"
+    case_id: Optional[str] = None
+    limit: int = Field(1000, ge=1, le=10000)
+
+@app.post("/api/ipdr/cidr")
+async def ipdr_sessions_in_cidr(request: CidrSessionRequest):
+    """IPDR records whose source, translated or destination address lies in a CIDR block (IPv4 or IPv6)"""
+
+    logger.info(f"🌐 [CIDR] {request.direction} addresses in {request.cidr}, case {request.case_id or '(all data)'}")
+
+    try:
+        from supabase_handler import SupabaseHandler
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        success, message, rows = handler.find_sessions_in_cidr(request.cidr, request.direction, request.limit)
+        if not success:
+            status = 400 if message.startswith(("Unknown address direction", "Invalid CIDR block")) else 500
+            raise HTTPException(status_code=status, detail=message)
+
+        return {
+            "success": True,
+            "message": message,
+            "row_count": len(rows),
+            "rows": rows,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [CIDR] Lookup error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"CIDR lookup failed: {str(e)}")
+
+# ================== PATTERN OF LIFE ==================
+
+class PatternOfLifeRequest(BaseModel):
+    case_id: Optional[str] = None
+    parties: Optional[List[str]] = None
+    limit: int = Field(100, ge=1, le=1000)
+
+@app.post("/api/pattern-of-life")
+async def pattern_of_life(request: PatternOfLifeRequest):
+    """
+    Unusual days and hours per party against its own baseline, with weekday x hour activity matrices
+    for the requested parties - the response can be passed to /api/consolidate as pattern_of_life
+    """
+
+    logger.info(f"🕰️ [PATTERN OF LIFE] Profiling case {request.case_id or '(all data)'}")
+
+    try:
+        import pandas as pd
+        from supabase_handler import SupabaseHandler
+        from pattern_of_life import get_pattern_of_life
+        from phone_numbers import e164_keys
+
+        handler = SupabaseHandler(verbose=False)
+        try:
+            handler.set_active_case(request.case_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        wanted = None
+        if request.parties:
+            # Profiles are keyed by E.164 number where the number could be normalized
+            requested = pd.Series(request.parties, dtype=object)
+            keys = e164_keys(requested)
+            wanted = {str(key) if pd.notna(key) else str(party).strip() for party, key in zip(requested, keys)}
+
+        started = time.perf_counter()
+        success, message, result = get_pattern_of_life().profile(handler, wanted)
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Failed to build pattern of life: {message}")
+
+        anomalies = result["anomalies"]
+        matrices = result["parties"] if wanted is not None else {}
+
+        return {
+            "success": True,
+            "message": message,
+            "start": result["start"],
+            "end": result["end"],
+            "parties_profiled": len(result["parties"]),
+            "anomaly_count": len(anomalies),
+            "anomalies": anomalies[:request.limit],
+            "matrices": matrices,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [PATTERN OF LIFE] Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Pattern of life failed: {str(e)}")
+
+# ================== INDEX ADVISOR ==================
+
+class IndexApplyRequest(BaseModel):
+    index_names: List[str]
+    concurrently: bool = True
+
+@app.get("/api/index-advisor/report")
+async def index_advisor_report():
+    """Indexes recommended for the recorded investigation workload, with estimated time saved"""
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from index_advisor import get_index_advisor
+
+        advisor = get_index_advisor()
+        success, message, recommendations = advisor.analyze(SupabaseHandler(verbose=False))
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Index analysis failed: {message}")
+
+        return {
+            "success": True,
+            "message": message,
+            "statements_recorded": advisor.statements_recorded,
+            "estimated_seconds_saved": round(sum(r["estimated_seconds_saved"] for r in recommendations
+                                                 if r["status"] == "recommended"), 3),
+            "recommendations": recommendations,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [INDEX ADVISOR] Report error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Index advisor report failed: {str(e)}")
+
+@app.post("/api/index-advisor/apply")
+async def index_advisor_apply(request: IndexApplyRequest):
+    """Build selected recommended indexes (CONCURRENTLY by default)"""
+
+    logger.info(f"🗄️ [INDEX ADVISOR] Building {len(request.index_names)} index(es)")
+
+    try:
+        from supabase_handler import SupabaseHandler
+        from index_advisor import get_index_advisor
+
+        handler = SupabaseHandler(verbose=False)
+        advisor = get_index_advisor()
+        success, message, recommendations = advisor.analyze(handler)
+        if not success:
+            raise HTTPException(status_code=500, detail=f"Index analysis failed: {message}")
+
+        by_name = {r["index_name"]: r for r in recommendations}
+        results = []
+        for name in request.index_names:
+            if name not in by_name:
+                results.append({"index_name": name, "success": False, "message": "Not among current recommendations"})
+                continue
+            built, build_message = advisor.create_index(handler, by_name[name], concurrently=request.concurrently)
+            results.append({"index_name": name, "success": built, "message": build_message})
+
+        return {
+            "success": all(r["success"] for r in results),
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ [INDEX ADVISOR] Build error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Index build failed: {str(e)}")
+
 # ================== HEALTH CHECK ==================
 
 @app.get("/api/health")
@@ -2,11 +2,11 @@ import os
 import shutil
 import tempfile
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import mimetypes
 import json
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
@@ -14,6 +14,7 @@ import uvicorn
 # Import the existing processing modules
 from pdf_chat import PDFChatBot
 from files import FileProcessor
+from case_scope import normalize_case_id
 
 app = FastAPI(title="Digital Evidence Platform API", version="1.0.0")
 
@@ -47,7 +48,7 @@ class FileProcessorAPI:
         
         return type_mapping.get(file_extension, 'unknown')
     
-    async def process_single_file(self, file_path: str, file_type: str):
+    async def process_single_file(self, file_path: str, file_type: str, case_id: Optional[str] = None):
         """Process a single file based on its type"""
         try:
             if file_type == 'pdf':
@@ -64,7 +65,7 @@ class FileProcessorAPI:
             elif file_type in ['csv', 'excel', 'word']:
                 # Process with files module and Supabase integration
                 processor = FileProcessor(verbose=False)
-                result = processor.process_file_with_supabase(file_path, file_type)
+                result = processor.process_file_with_supabase(file_path, file_type, case_id=case_id)
                 
                 if result:
                     if isinstance(result, dict) and 'status' in result:
@@ -126,13 +127,18 @@ async def health_check():
     return {"status": "healthy", "message": "API is running"}
 
 @app.post("/upload-files/")
-async def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
+async def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...), case_id: Optional[str] = Form(None)):
     """
-    Upload and process multiple files
+    Upload and process multiple files, optionally tagging their rows with a case id
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
     
+    try:
+        case_id = normalize_case_id(case_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     results = []
     processed_files = []
     
@@ -163,7 +169,7 @@ async def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile
             file_type = file_processor.detect_file_type(temp_file_path)
             
             # Process the file
-            result = await file_processor.process_single_file(temp_file_path, file_type)
+            result = await file_processor.process_single_file(temp_file_path, file_type, case_id)
             result["filename"] = file.filename
             result["size"] = str(os.path.getsize(temp_file_path))
             
@@ -197,13 +203,18 @@ async def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile
     }
 
 @app.post("/upload-single-file/")
-async def upload_single_file(file: UploadFile = File(...)):
+async def upload_single_file(file: UploadFile = File(...), case_id: Optional[str] = Form(None)):
     """
-    Upload and process a single file
+    Upload and process a single file, optionally tagging its rows with a case id
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
     
+    try:
+        case_id = normalize_case_id(case_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     # Check if file type is supported
     file_extension = Path(file.filename).suffix.lower()
     if file_extension not in file_processor.supported_extensions:
@@ -225,7 +236,7 @@ async def upload_single_file(file: UploadFile = File(...)):
         file_type = file_processor.detect_file_type(temp_file_path)
         
         # Process the file
-        result = await file_processor.process_single_file(temp_file_path, file_type)
+        result = await file_processor.process_single_file(temp_file_path, file_type, case_id)
         result["filename"] = file.filename
         result["size"] = str(os.path.getsize(temp_file_path))
         
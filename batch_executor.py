@@ -0,0 +1,131 @@
+import json
+from typing import Dict, List, Optional
+
+from config import QUERY_STATEMENT_TIMEOUT_MS
+
+BATCH_FUNCTION = "run_investigation_batch"
+
+# Runs an investigation's statements server-side in one call. Each statement is wrapped as a
+# subquery (so only read queries get through), timed, and isolated in its own subtransaction
+# so one failing query does not take the rest down. Never callable through the PostgREST API.
+#
+# statement_timeout is armed once per client statement, so changing it inside the function
+# would not interrupt anything: each statement's own timeout_ms budget is enforced here by
+# reading its rows through a cursor and abandoning it - as timed out - once it overruns.
+BATCH_FUNCTION_DDL = [
+    f"DROP FUNCTION IF EXISTS {BATCH_FUNCTION}(text[], boolean)",
+    f"""CREATE OR REPLACE FUNCTION {BATCH_FUNCTION}(statements text[], explain_only boolean DEFAULT false,
+                                                timeout_ms integer DEFAULT NULL)
+RETURNS TABLE (idx integer, result json, elapsed_ms double precision, error text, timed_out boolean)
+LANGUAGE plpgsql AS $$
+DECLARE
+    started timestamptz;
+    budget interval := timeout_ms * interval '1 millisecond';
+    rows_cursor refcursor;
+    row_json json;
+    collected json[];
+BEGIN
+    FOR i IN 1 .. coalesce(array_length(statements, 1), 0) LOOP
+        idx := i;
+        result := NULL;
+        error := NULL;
+        timed_out := false;
+        started := clock_timestamp();
+        BEGIN
+            IF explain_only THEN
+                EXECUTE 'EXPLAIN (FORMAT JSON) ' || statements[i] INTO result;
+            ELSE
+                collected := '{{}}';
+                rows_cursor := NULL;
+                OPEN rows_cursor FOR EXECUTE format('SELECT to_json(q) FROM (%s) q', statements[i]);
+                LOOP
+                    FETCH rows_cursor INTO row_json;
+                    EXIT WHEN NOT FOUND;
+                    collected := collected || row_json;
+                    IF budget IS NOT NULL AND clock_timestamp() - started > budget THEN
+                        timed_out := true;
+                        EXIT;
+                    END IF;
+                END LOOP;
+                CLOSE rows_cursor;
+                IF timed_out THEN
+                    error := format('statement timeout: exceeded %s ms', timeout_ms);
+                ELSE
+                    result := coalesce(array_to_json(collected), '[]'::json);
+                END IF;
+            END IF;
+        EXCEPTION WHEN OTHERS THEN
+            error := SQLERRM;
+            timed_out := SQLSTATE = '57014';
+        END;
+        elapsed_ms := extract(epoch FROM clock_timestamp() - started) * 1000;
+        RETURN NEXT;
+    END LOOP;
+END $$""",
+    f"REVOKE ALL ON FUNCTION {BATCH_FUNCTION}(text[], boolean, integer) FROM PUBLIC",
+    f"""DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        REVOKE ALL ON FUNCTION {BATCH_FUNCTION}(text[], boolean, integer) FROM anon;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'authenticated') THEN
+        REVOKE ALL ON FUNCTION {BATCH_FUNCTION}(text[], boolean, integer) FROM authenticated;
+    END IF;
+END $$""",
+]
+
+# The round trip as a whole only gets a backstop timeout, for a statement that overruns
+# before returning its first row; this much on top of the statements' own budgets
+BATCH_TIMEOUT_MARGIN_MS = 5000
+
+
+class BatchExecutor:
+    """
+    Send several read statements (or their EXPLAINs) to PostgreSQL in a single round trip
+
+    psycopg2 only returns the last result of a multi-statement execute, so the batch is
+    handed to run_investigation_batch, which returns one row per statement with its JSON
+    result, server-side elapsed time and error, if any.
+    """
+
+    def __init__(self, supabase_handler):
+        self.handler = supabase_handler
+        self._available: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            # The per-statement timeout argument came with the third parameter
+            success, _, rows = self.handler.execute_raw_sql(
+                "SELECT 1 FROM pg_proc WHERE proname = %s AND pronamespace = current_schema()::regnamespace "
+                "AND pronargs = 3", (BATCH_FUNCTION,))
+            self._available = success and bool(rows)
+        return self._available
+
+    def run(self, statements: List[str], explain_only: bool = False,
+            timeout_ms: Optional[int] = QUERY_STATEMENT_TIMEOUT_MS) -> Optional[List[Dict]]:
+        """
+        Each statement gets its own timeout_ms; one that overruns comes back with
+        timed_out set and the rest of the batch still runs.
+
+        Returns:
+            One {'result', 'elapsed_ms', 'error', 'timed_out'} per statement, in order, or None
+            when the batch itself could not run (function missing, backstop timeout, connection error)
+        """
+        if not statements or not self.available():
+            return None
+        statements = [s.strip().rstrip(";") for s in statements]
+        success, message, rows = self.handler.execute_raw_sql(
+            f"SELECT idx, result, elapsed_ms, error, timed_out FROM {BATCH_FUNCTION}(%s::text[], %s, %s) ORDER BY idx",
+            (statements, explain_only, timeout_ms or None),
+            timeout_ms=timeout_ms * len(statements) + BATCH_TIMEOUT_MARGIN_MS if timeout_ms else None)
+        if not success or len(rows) != len(statements):
+            print(f"   ⚠️ Batch round trip failed: {message}")
+            return None
+
+        results = []
+        for row in rows:
+            result = row["result"]
+            if isinstance(result, str):
+                result = json.loads(result)
+            results.append({"result": result, "elapsed_ms": row["elapsed_ms"], "error": row["error"],
+                            "timed_out": bool(row["timed_out"])})
+        return results
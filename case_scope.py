@@ -0,0 +1,83 @@
+import re
+from typing import List, Optional, Tuple
+
+from config import TABLE_SCHEMAS
+from event_time import EVENT_TIME_COLUMNS
+from party_summary import PARTY_SUMMARY_TABLE
+from contact_edges import CONTACT_EDGES_TABLE
+from session_stitcher import SESSIONS_TABLE
+
+CASE_COLUMN = "case_id"
+
+# Every evidence table loaded through FileProcessor carries the case it belongs to,
+# and so do the summaries derived from them
+CASE_SCOPED_TABLES = list(TABLE_SCHEMAS) + [SESSIONS_TABLE, PARTY_SUMMARY_TABLE, CONTACT_EDGES_TABLE]
+
+# Schema the real tables live in - the shadowing CTEs must reference them qualified
+DATA_SCHEMA = "public"
+
+_CASE_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_./-]{0,63}$")
+
+# Case-leading indexes: a case's rows are one contiguous index range, and for the
+# time-indexed tables the case's time window is a range inside it
+CASE_DDL = []
+for _table in TABLE_SCHEMAS:
+    CASE_DDL += [
+        f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS {CASE_COLUMN} text",
+        f"CREATE INDEX IF NOT EXISTS idx_{_table}_{CASE_COLUMN} ON {_table} ({CASE_COLUMN})",
+    ]
+for _table in EVENT_TIME_COLUMNS:
+    CASE_DDL.append(f"CREATE INDEX IF NOT EXISTS idx_{_table}_{CASE_COLUMN}_event_ts ON {_table} ({CASE_COLUMN}, event_ts)")
+
+
+def normalize_case_id(case_id: Optional[str]) -> Optional[str]:
+    """Validate a case identifier (letters, digits and _ . / - only); None or blank means no case"""
+    if case_id is None or not str(case_id).strip():
+        return None
+    case_id = str(case_id).strip()
+    if not _CASE_ID_PATTERN.match(case_id):
+        raise ValueError(f"Invalid case id: {case_id!r}")
+    return case_id
+
+
+def referenced_tables(sql_query: str) -> List[str]:
+    """Case-scoped tables mentioned anywhere in the query"""
+    return [t for t in CASE_SCOPED_TABLES if re.search(rf'\b{t}\b', sql_query, re.IGNORECASE)]
+
+
+def scope_sql_to_case(sql_query: str, case_id: str) -> Tuple[str, List[str]]:
+    """
+    Restrict a read query to one case without parsing it
+
+    Each referenced table is shadowed by a NOT MATERIALIZED CTE of the same name
+    that filters on case_id. Unqualified table names in the query (including in
+    its own CTEs and subqueries) then resolve to the filtered view, and because
+    the CTE is inlined the planner still pushes the other predicates down to the
+    case_id indexes and partitions.
+
+    Returns:
+        (scoped_sql, tables_scoped)
+    """
+    case_id = normalize_case_id(case_id)
+    body = sql_query.strip().rstrip(";")
+    if not case_id or not re.match(r"^\s*(select|with)\b", body, re.IGNORECASE):
+        return sql_query, []
+
+    # Qualified names would bypass the shadowing CTEs
+    body = re.sub(rf'\b{DATA_SCHEMA}\.("?)({"|".join(CASE_SCOPED_TABLES)})\b\1', r"\2", body, flags=re.IGNORECASE)
+
+    tables = referenced_tables(body)
+    if not tables:
+        return sql_query, []
+
+    literal = "'" + case_id.replace("'", "''") + "'"
+    shadows = ", ".join(
+        f"{table} AS NOT MATERIALIZED (SELECT * FROM {DATA_SCHEMA}.{table} WHERE {CASE_COLUMN} = {literal})"
+        for table in tables
+    )
+
+    existing = re.match(r"^\s*with\s+(recursive\s+)?", body, re.IGNORECASE)
+    if existing:
+        recursive = "RECURSIVE " if existing.group(1) else ""
+        return f"WITH {recursive}{shadows}, {body[existing.end():]}", tables
+    return f"WITH {shadows} {body}", tables
@@ -0,0 +1,196 @@
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import CELL_ATTRIBUTES_IN_DIMENSION_ONLY
+
+CELLS_TABLE = "cells"
+
+# Cell id columns encoded on each fact table, and the integer key column each one gets
+CELL_KEY_COLUMNS = {
+    "crd": {"first_cell_id_a": "first_cell_key", "last_cell_id_a": "last_cell_key"},
+    "tower_dumps": {"first_cell_id_a": "first_cell_key", "last_cell_id_a": "last_cell_key"},
+}
+
+# Per-row copies of the first cell's attributes; the dimension keeps them once per cell
+CELL_ATTRIBUTE_COLUMNS = {"first_cell_id_a_address": "address", "latitude": "latitude", "longitude": "longitude"}
+
+# Fact table columns left NULL once a row is keyed; queries must read them from cells
+DIMENSION_ONLY_COLUMNS = {table: set(CELL_ATTRIBUTE_COLUMNS) for table in CELL_KEY_COLUMNS} \
+    if CELL_ATTRIBUTES_IN_DIMENSION_ONLY else {}
+
+
+def dimension_only_hint(table: str, column: str) -> str:
+    """Why a dimension-only attribute cannot be read from its fact table, and what to write instead"""
+    table = table.lower()
+    key = CELL_KEY_COLUMNS[table]["first_cell_id_a"]
+    return (f"Column {column} on {table} is kept in {CELLS_TABLE} only - JOIN {CELLS_TABLE} "
+            f"ON {CELLS_TABLE}.cell_key = {table}.{key} and read {CELLS_TABLE}.{CELL_ATTRIBUTE_COLUMNS[column.lower()]}")
+
+
+CELLS_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {CELLS_TABLE} (
+        cell_key integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        cell_id text NOT NULL UNIQUE,
+        address text,
+        latitude double precision,
+        longitude double precision
+    )""",
+]
+for _table, _columns in CELL_KEY_COLUMNS.items():
+    for _key in _columns.values():
+        CELLS_DDL += [
+            f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS {_key} integer",
+            f"CREATE INDEX IF NOT EXISTS idx_{_table}_{_key} ON {_table} ({_key})",
+        ]
+
+# Older loads stored 0.0 for missing coordinates - (0, 0) is never a real cell site
+_KNOWN_COORDINATES = "CASE WHEN latitude = 0 AND longitude = 0 THEN NULL ELSE {} END"
+
+# Existing rows: register their cells (first cell rows carry the attributes), then key the rows
+CELLS_BACKFILL = []
+for _table, _columns in CELL_KEY_COLUMNS.items():
+    CELLS_BACKFILL.append(
+        f"INSERT INTO {CELLS_TABLE} (cell_id, address, latitude, longitude) "
+        f"SELECT DISTINCT ON (first_cell_id_a) first_cell_id_a, nullif(first_cell_id_a_address, 'None'), "
+        f"{_KNOWN_COORDINATES.format('latitude')}, {_KNOWN_COORDINATES.format('longitude')} "
+        f"FROM {_table} WHERE first_cell_id_a IS NOT NULL AND first_cell_key IS NULL "
+        f"ORDER BY first_cell_id_a, (first_cell_id_a_address IS NULL) "
+        f"ON CONFLICT (cell_id) DO NOTHING")
+    CELLS_BACKFILL.append(
+        f"INSERT INTO {CELLS_TABLE} (cell_id) SELECT DISTINCT last_cell_id_a FROM {_table} "
+        f"WHERE last_cell_id_a IS NOT NULL AND last_cell_key IS NULL ON CONFLICT (cell_id) DO NOTHING")
+    for _source, _key in _columns.items():
+        CELLS_BACKFILL.append(
+            f"UPDATE {_table} t SET {_key} = c.cell_key FROM {CELLS_TABLE} c "
+            f"WHERE t.{_key} IS NULL AND c.cell_id = t.{_source}")
+    # The space is only reclaimed once the table is rewritten (VACUUM FULL / repack)
+    if CELL_ATTRIBUTES_IN_DIMENSION_ONLY:
+        CELLS_BACKFILL.append(
+            f"UPDATE {_table} SET {', '.join(f'{column} = NULL' for column in CELL_ATTRIBUTE_COLUMNS)} "
+            f"WHERE first_cell_key IS NOT NULL AND "
+            f"({' OR '.join(f'{column} IS NOT NULL' for column in CELL_ATTRIBUTE_COLUMNS)})")
+
+CELLS_UPSERT = f"""INSERT INTO {CELLS_TABLE} (cell_id, address, latitude, longitude) VALUES %s
+ON CONFLICT (cell_id) DO UPDATE SET
+    address = coalesce({CELLS_TABLE}.address, EXCLUDED.address),
+    latitude = coalesce({CELLS_TABLE}.latitude, EXCLUDED.latitude),
+    longitude = coalesce({CELLS_TABLE}.longitude, EXCLUDED.longitude)
+WHERE {CELLS_TABLE}.address IS NULL OR {CELLS_TABLE}.latitude IS NULL OR {CELLS_TABLE}.longitude IS NULL"""
+
+
+def _cell_text(values: pd.Series) -> pd.Series:
+    text = values.astype(str).str.strip()
+    return text.where(values.notna() & (text != "") & (text.str.lower() != "nan"))
+
+
+def _number_or_none(value) -> Optional[float]:
+    number = pd.to_numeric(value, errors="coerce")
+    return None if pd.isna(number) else float(number)
+
+
+class CellDictionary:
+    """
+    cell_id -> cell_key mapping for the cells dimension, cached for the life of the process
+
+    Keys never change once assigned, so only cells this process has not seen yet
+    cost database round trips: one upsert for the batch's new cells and one
+    lookup of their keys.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, supabase_handler, cells: pd.DataFrame) -> Optional[Dict[str, int]]:
+        """
+        Keys for every cell_id in cells (columns cell_id, address, latitude, longitude),
+        registering new ones; None if the dimension cannot be reached
+        """
+        with self._lock:
+            missing = cells[~cells["cell_id"].isin(list(self.keys))]
+        if not missing.empty:
+            rows = [(row.cell_id,
+                     None if pd.isna(row.address) else str(row.address),
+                     _number_or_none(row.latitude), _number_or_none(row.longitude))
+                    for row in missing.itertuples(index=False)]
+            success, message, _ = supabase_handler.bulk_write(CELLS_UPSERT, rows)
+            if not success:
+                print(f"⚠️ Cell dictionary update failed: {message}")
+                return None
+            success, message, found = supabase_handler.execute_raw_sql(
+                f"SELECT cell_id, cell_key FROM {CELLS_TABLE} WHERE cell_id = ANY(%s)", (list(missing["cell_id"]),))
+            if not success:
+                print(f"⚠️ Cell dictionary lookup failed: {message}")
+                return None
+            with self._lock:
+                self.keys.update({row["cell_id"]: row["cell_key"] for row in found})
+        with self._lock:
+            return {cell_id: self.keys[cell_id] for cell_id in cells["cell_id"] if cell_id in self.keys}
+
+
+_cell_dictionary = None
+
+
+def get_cell_dictionary() -> CellDictionary:
+    """Process-wide dictionary shared by every ingest pipeline"""
+    global _cell_dictionary
+    if _cell_dictionary is None:
+        _cell_dictionary = CellDictionary()
+    return _cell_dictionary
+
+
+class CellEncodingStage:
+    """
+    Ingest stage that replaces repeated cell ids with integer keys into the cells dimension
+
+    With CELL_ATTRIBUTES_IN_DIMENSION_ONLY the per-row address and coordinates are
+    blanked once the cell is keyed - they live in cells. Cell id text is kept on
+    the rows. If the dimension is unavailable the batch passes through unchanged.
+    """
+
+    def __init__(self, table_name: str, supabase_handler):
+        self.table_name = table_name
+        self.handler = supabase_handler
+        self.columns: Dict[str, str] = CELL_KEY_COLUMNS[table_name]
+        self.__name__ = f"encode_cells[{table_name}]"
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        if not self.handler.pg_connection:
+            return df
+
+        ids = {source: _cell_text(df[source]) for source in self.columns if source in df.columns}
+        if not ids:
+            return df
+
+        # Attributes come from the first cell columns; last cells are registered by id only
+        frames: List[pd.DataFrame] = []
+        for source, values in ids.items():
+            frame = pd.DataFrame({"cell_id": values})
+            for column, attribute in CELL_ATTRIBUTE_COLUMNS.items():
+                frame[attribute] = df[column] if source == "first_cell_id_a" and column in df.columns else None
+            frames.append(frame)
+        cells = pd.concat(frames, ignore_index=True).dropna(subset=["cell_id"])
+        unknown = (pd.to_numeric(cells["latitude"], errors="coerce") == 0) \
+            & (pd.to_numeric(cells["longitude"], errors="coerce") == 0)
+        cells.loc[unknown, ["latitude", "longitude"]] = None
+        cells = cells.sort_values("address", na_position="last", kind="mergesort").drop_duplicates("cell_id")
+        if cells.empty:
+            return df
+
+        keys = get_cell_dictionary().encode(self.handler, cells)
+        if keys is None:
+            return df
+
+        for source, values in ids.items():
+            mapped = values.map(keys)
+            df[self.columns[source]] = np.where(mapped.notna(), mapped.astype("Int64").astype(object), None)
+
+        if CELL_ATTRIBUTES_IN_DIMENSION_ONLY and "first_cell_id_a" in ids:
+            keyed = df[self.columns["first_cell_id_a"]].notna()
+            for column in CELL_ATTRIBUTE_COLUMNS:
+                if column in df.columns:
+                    df.loc[keyed, column] = None
+        return df
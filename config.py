@@ -41,6 +41,69 @@ SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY')
 # Supabase client kept as fallback for compatibility
 # Direct PostgreSQL connection bypasses RLS restrictions and supports full SQL
 
+# Pre-flight gate for agent-generated SQL: EXPLAIN estimates above these are downgraded or rejected
+QUERY_MAX_TOTAL_COST = float(os.getenv('QUERY_MAX_TOTAL_COST', 5000000))
+QUERY_MAX_PLAN_ROWS = int(os.getenv('QUERY_MAX_PLAN_ROWS', 1000000))
+QUERY_DOWNGRADE_LIMIT = int(os.getenv('QUERY_DOWNGRADE_LIMIT', 1000))
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv('QUERY_STATEMENT_TIMEOUT_MS', 30000))
+
+# AST rewrite of agent SQL (needs sqlglot): LIMIT injection, SELECT * pruning, index-friendly predicates
+QUERY_REWRITE_ENABLED = os.getenv('QUERY_REWRITE_ENABLED', 'true').lower() == 'true'
+QUERY_REWRITE_ROW_LIMIT = int(os.getenv('QUERY_REWRITE_ROW_LIMIT', 500))
+
+# Investigation queries return population statistics (counts, time range, top values) plus a sample of rows
+POPULATION_STATS_ENABLED = os.getenv('POPULATION_STATS_ENABLED', 'true').lower() == 'true'
+POPULATION_SAMPLE_ROWS = int(os.getenv('POPULATION_SAMPLE_ROWS', 20))
+POPULATION_TOP_K = int(os.getenv('POPULATION_TOP_K', 5))
+
+# Generated SQL is checked against information_schema, cached for this many seconds
+SCHEMA_CACHE_SECONDS = int(os.getenv('SCHEMA_CACHE_SECONDS', 300))
+
+# Supabase (PostgREST) fallback: rows per ranged request, concurrent requests, and a cap for queries without LIMIT
+FALLBACK_PAGE_SIZE = int(os.getenv('FALLBACK_PAGE_SIZE', 1000))
+FALLBACK_WORKERS = int(os.getenv('FALLBACK_WORKERS', 4))
+FALLBACK_MAX_ROWS = int(os.getenv('FALLBACK_MAX_ROWS', 50000))
+
+# Investigation query results cached in memory until a table they read is written to
+QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', 'true').lower() == 'true'
+QUERY_CACHE_MAX_BYTES = int(os.getenv('QUERY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# party_summary keeps this many of each party's most used cells
+PARTY_SUMMARY_TOP_CELLS = int(os.getenv('PARTY_SUMMARY_TOP_CELLS', 5))
+
+# Per (cell, hour) tower_dumps sketches: HyperLogLog registers = 2^precision (~1.04/sqrt(2^p) error),
+# Count-Min width x depth counters (overcount <= e/width of the rows, w.p. 1 - e^-depth), heavy-hitter candidates kept
+SKETCH_HLL_PRECISION = int(os.getenv('SKETCH_HLL_PRECISION', 11))
+SKETCH_CMS_WIDTH = int(os.getenv('SKETCH_CMS_WIDTH', 272))
+SKETCH_CMS_DEPTH = int(os.getenv('SKETCH_CMS_DEPTH', 4))
+SKETCH_HEAVY_HITTERS = int(os.getenv('SKETCH_HEAVY_HITTERS', 20))
+
+# Target false-positive rate of the per-load tower dump Bloom filters (~9.6 bits per identifier at 1%)
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv('BLOOM_FALSE_POSITIVE_RATE', 0.01))
+
+# Phone numbers without a country code are national numbers of this country (E.164 keys, e.g. 91 + 10 digits)
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_COUNTRY_CODE', '91')
+NATIONAL_NUMBER_LENGTH = int(os.getenv('NATIONAL_NUMBER_LENGTH', 10))
+
+# MSISDN series CSV (prefix,operator,circle - prefixes of national numbers) used to tag b_party operator/circle
+NUMBER_SERIES_PATH = os.getenv('NUMBER_SERIES_PATH', 'data/number_series.csv')
+
+# IP block -> service/ASN CSV (network,service,asn) used to attribute IPDR destination addresses; reloaded when replaced
+IP_SERVICES_PATH = os.getenv('IP_SERVICES_PATH', 'data/ip_services.csv')
+
+# Pattern-of-life scoring: |robust z| that flags a day/hour, and the activity a party needs to be profiled / scored
+POL_ANOMALY_THRESHOLD = float(os.getenv('POL_ANOMALY_THRESHOLD', 3.5))
+POL_MIN_EVENTS = int(os.getenv('POL_MIN_EVENTS', 20))
+POL_MIN_DAYS = int(os.getenv('POL_MIN_DAYS', 7))
+# Days profiled: activity separated from the bulk of a case by a longer gap is ignored (stray timestamps),
+# and only the latest POL_MAX_DAYS days are kept
+POL_MAX_GAP_DAYS = int(os.getenv('POL_MAX_GAP_DAYS', 30))
+POL_MAX_DAYS = int(os.getenv('POL_MAX_DAYS', 366))
+
+# Keep cell address/coordinates only in the cells dimension (crd/tower_dumps rows carry just the integer cell keys).
+# On by default: with per-row copies kept as well, the keys would only add to the fact rows.
+CELL_ATTRIBUTES_IN_DIMENSION_ONLY = os.getenv('CELL_ATTRIBUTES_IN_DIMENSION_ONLY', 'true').lower() == 'true'
+
 # Table Schema Definitions for Auto-Detection (Based on EXACT database schemas you created)
 TABLE_SCHEMAS = {
     "bank_details": {
@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from event_time import record_times
+from party_summary import PLACEHOLDER_IDENTIFIERS, number_keys
+
+CONTACT_EDGES_TABLE = "contact_edges"
+
+EDGE_COLUMNS = ["case_id", "a_party", "b_party", "call_count", "total_duration",
+                "first_contact", "last_contact", "in_count", "out_count"]
+
+# Directed pairs as they appear in crd (a_party is the subscriber whose record it is);
+# the reverse index makes "who calls this number" and reciprocity lookups index scans too
+CONTACT_EDGES_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {CONTACT_EDGES_TABLE} (
+        case_id text NOT NULL DEFAULT '',
+        a_party text NOT NULL,
+        b_party text NOT NULL,
+        call_count bigint NOT NULL DEFAULT 0,
+        total_duration bigint NOT NULL DEFAULT 0,
+        first_contact timestamp,
+        last_contact timestamp,
+        in_count bigint NOT NULL DEFAULT 0,
+        out_count bigint NOT NULL DEFAULT 0,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (case_id, a_party, b_party)
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_{CONTACT_EDGES_TABLE}_a_party ON {CONTACT_EDGES_TABLE} (a_party, call_count DESC)",
+    f"CREATE INDEX IF NOT EXISTS idx_{CONTACT_EDGES_TABLE}_b_party ON {CONTACT_EDGES_TABLE} (b_party, a_party)",
+]
+
+CONTACT_EDGES_UPSERT = f"""INSERT INTO {CONTACT_EDGES_TABLE} ({', '.join(EDGE_COLUMNS)})
+SELECT case_id, a_party, b_party, call_count, total_duration, first_contact::timestamp, last_contact::timestamp,
+       in_count, out_count
+FROM (VALUES %s) AS batch ({', '.join(EDGE_COLUMNS)})
+ON CONFLICT (case_id, a_party, b_party) DO UPDATE SET
+    call_count = {CONTACT_EDGES_TABLE}.call_count + EXCLUDED.call_count,
+    total_duration = {CONTACT_EDGES_TABLE}.total_duration + EXCLUDED.total_duration,
+    first_contact = LEAST({CONTACT_EDGES_TABLE}.first_contact, EXCLUDED.first_contact),
+    last_contact = GREATEST({CONTACT_EDGES_TABLE}.last_contact, EXCLUDED.last_contact),
+    in_count = {CONTACT_EDGES_TABLE}.in_count + EXCLUDED.in_count,
+    out_count = {CONTACT_EDGES_TABLE}.out_count + EXCLUDED.out_count,
+    updated_at = now()"""
+
+# Edges built before numbers were keyed by E.164 number are dropped, so the backfill rebuilds them
+CONTACT_EDGES_REKEY = f"""DELETE FROM {CONTACT_EDGES_TABLE} WHERE EXISTS (
+    SELECT 1 FROM {CONTACT_EDGES_TABLE} e
+    WHERE e164_key(e.a_party)::text <> e.a_party OR e164_key(e.b_party)::text <> e.b_party)"""
+
+# One-off build from existing crd rows; only runs while the table is still empty
+CONTACT_EDGES_BACKFILL = f"""INSERT INTO {CONTACT_EDGES_TABLE} ({', '.join(EDGE_COLUMNS)})
+SELECT coalesce(case_id, ''), coalesce(a_party_e164::text, a_party::text), coalesce(b_party_e164::text, b_party::text),
+       count(*), coalesce(sum(duration), 0),
+       min(event_ts), max(event_ts),
+       count(*) FILTER (WHERE upper(call_type) LIKE '%IN'),
+       count(*) FILTER (WHERE upper(call_type) LIKE '%OUT')
+FROM crd
+WHERE a_party IS NOT NULL AND b_party IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM {CONTACT_EDGES_TABLE})
+GROUP BY 1, 2, 3"""
+
+# Edges to or from placeholder text ('None') stored by loads before missing numbers were kept NULL
+_PLACEHOLDERS_SQL = ", ".join(f"'{p}'" for p in PLACEHOLDER_IDENTIFIERS)
+CONTACT_EDGES_CLEANUP = [
+    f"DELETE FROM {CONTACT_EDGES_TABLE} WHERE lower(a_party) IN ({_PLACEHOLDERS_SQL}) "
+    f"OR lower(b_party) IN ({_PLACEHOLDERS_SQL})",
+]
+
+SOURCE_COLUMNS = ["case_id", "a_party", "b_party", "duration", "call_type"]
+
+
+class ContactEdgeBuilder:
+    """
+    Maintain contact_edges (one row per case and directed a_party -> b_party pair) from CDR loads
+
+    Like party_summary, each batch is grouped by pair in pandas and added to the
+    table with an upsert, so top-contact and mutual-contact questions read a few
+    edge rows instead of aggregating crd. Both ends are keyed by number_keys
+    (E.164 text where the number normalizes).
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def summarize(self, records: List[Dict]) -> pd.DataFrame:
+        """Partial edges (EDGE_COLUMNS) for one batch of crd records"""
+        df = pd.DataFrame(records)
+        for column in SOURCE_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+
+        direction = df["call_type"].astype(str).str.strip().str.upper().str.extract(r"(IN|OUT)$", expand=False)
+        batch = pd.DataFrame({
+            "case_id": df["case_id"].where(df["case_id"].notna(), "").astype(str),
+            "a_party": number_keys(df["a_party"]),
+            "b_party": number_keys(df["b_party"]),
+            "duration": pd.to_numeric(df["duration"], errors="coerce").fillna(0).astype(np.int64),
+            "seen": record_times(df, "crd"),
+            "incoming": (direction == "IN").astype(np.int64),
+            "outgoing": (direction == "OUT").astype(np.int64),
+        })
+        batch = batch[batch["a_party"].notna() & batch["b_party"].notna()]
+        if batch.empty:
+            return pd.DataFrame(columns=EDGE_COLUMNS)
+
+        edges = batch.groupby(["case_id", "a_party", "b_party"], sort=False).agg(
+            call_count=("duration", "size"),
+            total_duration=("duration", "sum"),
+            first_contact=("seen", "min"),
+            last_contact=("seen", "max"),
+            in_count=("incoming", "sum"),
+            out_count=("outgoing", "sum"),
+        ).reset_index()
+        return edges[EDGE_COLUMNS]
+
+    def merge(self, supabase_handler, records: List[Dict]) -> Tuple[bool, str]:
+        """Add one batch of crd records to contact_edges"""
+        edges = self.summarize(records)
+        if edges.empty:
+            return True, "No contact pairs to add"
+
+        values = [tuple(None if pd.isna(v) else (v.to_pydatetime() if isinstance(v, pd.Timestamp) else v)
+                        for v in row)
+                  for row in edges.astype(object).itertuples(index=False, name=None)]
+
+        success, message, _ = supabase_handler.bulk_write(CONTACT_EDGES_UPSERT, values)
+        if success and self.verbose:
+            print(f"🔀 Contact edges: merged {len(values):,} pairs from {len(records):,} calls")
+        return success, message
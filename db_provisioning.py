@@ -0,0 +1,300 @@
+from typing import List, Tuple
+
+from activity_timeline import DEVICE_INDEX_DDL
+from batch_executor import BATCH_FUNCTION_DDL
+from case_scope import CASE_DDL
+from event_time import EVENT_TIME_COLUMNS, EVENT_PARTY_COLUMNS
+from ip_index import IPDR_IP_COLUMNS, backfill_ipv6_columns
+from partitioning import PartitionManager, FUTURE_MONTHS
+from party_summary import PARTY_SUMMARY_DDL, PARTY_SUMMARY_BACKFILL, PARTY_SUMMARY_CLEANUP, PARTY_SUMMARY_REKEY, \
+    PLACEHOLDER_IDENTIFIERS
+from contact_edges import CONTACT_EDGES_DDL, CONTACT_EDGES_BACKFILL, CONTACT_EDGES_CLEANUP, CONTACT_EDGES_REKEY
+from tower_sketches import TOWER_SKETCHES_DDL, TowerSketchBuilder
+from dump_filters import TOWER_LOADS_DDL, TOWER_LOADS_BACKFILL, DumpFilterIndex
+from cell_dictionary import CELLS_DDL, CELLS_BACKFILL
+from phone_numbers import PHONE_NUMBER_DDL, PHONE_NUMBER_BACKFILL
+from number_series import NUMBER_SERIES_DDL, backfill_number_series, get_number_series
+from ip_services import IP_SERVICES_DDL, backfill_ip_services, get_ip_services
+from query_cache import VERSIONS_DDL, get_query_cache
+from session_stitcher import SessionStitcher
+
+# ================== PLACEHOLDER IDENTIFIERS ==================
+
+# Loads used to str() missing identifiers into 'None' / 'nan'; they are NULL now, and so are old rows
+PLACEHOLDER_COLUMNS = {
+    "crd": ["a_party", "b_party", "imei_a", "imsi_a"],
+    "tower_dumps": ["a_party", "b_party", "imei_a", "imsi_a"],
+    "ipdr": ["landline_msidn_mdn_leased_circuit_id", "user_id"],
+}
+
+PLACEHOLDER_CLEANUP = []
+for _table, _columns in PLACEHOLDER_COLUMNS.items():
+    for _column in _columns:
+        PLACEHOLDER_CLEANUP.append(
+            f"UPDATE {_table} SET {_column} = NULL WHERE lower({_column}::text) IN "
+            f"({', '.join(repr(p) for p in PLACEHOLDER_IDENTIFIERS)})")
+
+# ================== INTEGER IP COLUMNS (IPDR) ==================
+
+IPDR_INTEGER_IP_DDL = []
+for _prefix in IPDR_IP_COLUMNS.values():
+    IPDR_INTEGER_IP_DDL += [
+        f"ALTER TABLE ipdr ADD COLUMN IF NOT EXISTS {_prefix}_v4 bigint",
+        f"ALTER TABLE ipdr ADD COLUMN IF NOT EXISTS {_prefix}_v6_hi bigint",
+        f"ALTER TABLE ipdr ADD COLUMN IF NOT EXISTS {_prefix}_v6_lo bigint",
+        f"CREATE INDEX IF NOT EXISTS idx_ipdr_{_prefix}_v4 ON ipdr ({_prefix}_v4) WHERE {_prefix}_v4 IS NOT NULL",
+        f"CREATE INDEX IF NOT EXISTS idx_ipdr_{_prefix}_v6 ON ipdr ({_prefix}_v6_hi, {_prefix}_v6_lo) WHERE {_prefix}_v6_hi IS NOT NULL",
+    ]
+
+# Existing IPv4 rows can be backfilled server-side from the octets; the pattern only
+# admits 0-255 octets (leading zeros allowed, as encode_ipv4 does)
+_OCTET = "(25[0-5]|2[0-4][0-9]|[01]?[0-9]?[0-9])"
+IPDR_INTEGER_IP_BACKFILL = []
+for _column, _prefix in IPDR_IP_COLUMNS.items():
+    _octets = [f"split_part(btrim({_column}), '.', {i + 1})::bigint * {256 ** (3 - i)}" for i in range(4)]
+    IPDR_INTEGER_IP_BACKFILL.append(
+        f"UPDATE ipdr SET {_prefix}_v4 = {' + '.join(_octets)} "
+        f"WHERE {_prefix}_v4 IS NULL AND btrim({_column}) ~ '^{_OCTET}(\\.{_OCTET}){{3}}$'")
+
+# ================== STITCHED IPDR SESSIONS ==================
+
+IPDR_SESSIONS_DDL = [
+    """CREATE TABLE IF NOT EXISTS ipdr_sessions (
+        id bigserial PRIMARY KEY,
+        case_id text NOT NULL DEFAULT '',
+        msisdn text NOT NULL,
+        source_ip_address text,
+        translated_ip_address text,
+        translated_port integer,
+        access_point_name text,
+        imei text,
+        imsi text,
+        first_cell_id text,
+        last_cell_id text,
+        session_start timestamp NOT NULL,
+        session_end timestamp NOT NULL,
+        fragment_count integer NOT NULL,
+        session_duration bigint,
+        data_volume_up_link bigint,
+        data_volume_down_link bigint
+    )""",
+    "ALTER TABLE ipdr_sessions ADD COLUMN IF NOT EXISTS case_id text NOT NULL DEFAULT ''",
+    "CREATE INDEX IF NOT EXISTS idx_ipdr_sessions_msisdn_start ON ipdr_sessions (msisdn, session_start)",
+    # Stitching replaces one case's sessions of an MSISDN; case-scoped queries lead with case_id
+    "CREATE INDEX IF NOT EXISTS idx_ipdr_sessions_case_msisdn ON ipdr_sessions (case_id, msisdn, session_start)",
+    "CREATE INDEX IF NOT EXISTS idx_ipdr_sessions_translated ON ipdr_sessions (translated_ip_address, translated_port, session_start)",
+    # Stitching refreshes whole MSISDNs, so the raw table needs an MSISDN index too
+    "CREATE INDEX IF NOT EXISTS idx_ipdr_msisdn ON ipdr (landline_msidn_mdn_leased_circuit_id)",
+]
+
+# ================== EVENT TIMESTAMPS ==================
+
+# Loads are inserted in event_ts order, so a BRIN index stays tiny and still prunes
+# whole block ranges; the btree serves per-subscriber time ranges.
+EVENT_TS_DDL = []
+for _table, _party in EVENT_PARTY_COLUMNS.items():
+    EVENT_TS_DDL += [
+        f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS event_ts timestamp",
+        f"CREATE INDEX IF NOT EXISTS idx_{_table}_event_ts_brin ON {_table} USING brin (event_ts) WITH (pages_per_range = 32)",
+        f"CREATE INDEX IF NOT EXISTS idx_{_table}_{_party}_event_ts ON {_table} ({_party}, event_ts)",
+    ]
+
+
+def _event_ts_backfill(table: str, date_column: str, time_column: str) -> str:
+    """Server-side backfill for rows loaded before event_ts existed (ISO and dd/mm/yyyy dates only)"""
+    date_text = f"{date_column}::text"
+    time_text = f"{time_column}::text"
+    return (
+        f"UPDATE {table} SET event_ts = "
+        f"(CASE WHEN {date_text} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}' THEN substr({date_text}, 1, 10)::date "
+        f"WHEN {date_text} ~ '^[0-9]{{1,2}}[/.-][0-9]{{1,2}}[/.-][0-9]{{4}}$' THEN to_date({date_text}, 'DD/MM/YYYY') END) "
+        f"+ (CASE WHEN {time_text} ~ '^[0-9]{{1,2}}:[0-9]{{2}}(:[0-9]{{2}})?$' THEN {time_text}::time ELSE '00:00'::time END) "
+        f"WHERE event_ts IS NULL AND {date_column} IS NOT NULL"
+    )
+
+
+EVENT_TS_BACKFILL = [
+    _event_ts_backfill(table, date_column, time_column)
+    for table, (date_column, time_column) in EVENT_TIME_COLUMNS.items()
+]
+
+
+class SchemaProvisioner:
+    """Apply the derived columns, indexes and tables the ingest pipeline relies on"""
+
+    def __init__(self, supabase_handler, verbose=False):
+        self.handler = supabase_handler
+        self.verbose = verbose
+
+    def _apply(self, name: str, statements: List[str]) -> Tuple[bool, List[str]]:
+        errors = []
+        for statement in statements:
+            success, message, _ = self.handler.execute_raw_sql(statement)
+            if not success:
+                errors.append(f"{statement[:80]}... -> {message}")
+
+        if self.verbose:
+            status = "✅" if not errors else "⚠️"
+            print(f"{status} {name}: {len(statements) - len(errors)}/{len(statements)} statements applied")
+        return len(errors) == 0, errors
+
+    def provision_placeholder_cleanup(self) -> Tuple[bool, List[str]]:
+        """NULL out the 'None' text older loads stored for missing numbers, IMEIs and IMSIs"""
+        return self._apply("Placeholder identifiers", PLACEHOLDER_CLEANUP)
+
+    def provision_integer_ip_columns(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Add and index the integer-encoded IPDR address columns, encoding existing IPv4 and IPv6 rows"""
+        statements = IPDR_INTEGER_IP_DDL + (IPDR_INTEGER_IP_BACKFILL if backfill else [])
+        success, errors = self._apply("Integer IP columns", statements)
+        if success and backfill:
+            done, message = backfill_ipv6_columns(self.handler, verbose=self.verbose)
+            if self.verbose:
+                print(f"{'✅' if done else '⚠️'} {message}")
+            if not done:
+                errors.append(f"IPv6 column backfill -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_ip_services(self, backfill: bool = True, only_missing: bool = True) -> Tuple[bool, List[str]]:
+        """
+        Add the indexed destination_service / destination_asn IPDR columns and attribute existing rows
+        when an IP services dataset is installed (only_missing=False after updating the dataset)
+        """
+        success, errors = self._apply("IP service columns", IP_SERVICES_DDL)
+        service_map = get_ip_services()
+        if success and backfill and service_map is not None:
+            done, message = backfill_ip_services(self.handler, service_map, only_missing, verbose=self.verbose)
+            if self.verbose:
+                print(f"{'✅' if done else '⚠️'} {message}")
+            if not done:
+                errors.append(f"IP service backfill -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_phone_numbers(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Add the e164_key() function and indexed bigint E.164 keys next to every phone number column"""
+        statements = PHONE_NUMBER_DDL + (PHONE_NUMBER_BACKFILL if backfill else [])
+        return self._apply("Phone number keys", statements)
+
+    def provision_number_series(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Add b_party operator/circle columns, tagging existing rows when a number series file is installed"""
+        success, errors = self._apply("Number series columns", NUMBER_SERIES_DDL)
+        series = get_number_series()
+        if success and backfill and series is not None:
+            done, message = backfill_number_series(self.handler, series, verbose=self.verbose)
+            if self.verbose:
+                print(f"{'✅' if done else '⚠️'} {message}")
+            if not done:
+                errors.append(f"Number series backfill -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_ipdr_sessions(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """
+        Create the stitched-session table maintained after each IPDR load (after case scoping),
+        re-stitching per case the MSISDNs whose sessions were stitched across cases
+        """
+        success, errors = self._apply("IPDR sessions", IPDR_SESSIONS_DDL)
+        if success and backfill:
+            done, message = SessionStitcher(verbose=self.verbose).rescope_sessions(self.handler)
+            if self.verbose:
+                print(f"{'✅' if done else '⚠️'} {message}")
+            if not done:
+                errors.append(f"IPDR session re-stitching -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_event_timestamps(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Add event_ts with BRIN and (party, event_ts) btree indexes to crd, tower_dumps and ipdr"""
+        statements = EVENT_TS_DDL + (EVENT_TS_BACKFILL if backfill else [])
+        return self._apply("Event timestamps", statements)
+
+    def provision_device_indexes(self) -> Tuple[bool, List[str]]:
+        """Index the IMEI/IMSI columns of crd and ipdr for device timeline lookups"""
+        return self._apply("Device indexes", DEVICE_INDEX_DDL)
+
+    def provision_case_scoping(self) -> Tuple[bool, List[str]]:
+        """Add case_id and case-leading indexes to every evidence table"""
+        return self._apply("Case scoping", CASE_DDL)
+
+    def provision_party_summary(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Create party_summary, built from existing crd rows once and merged into after every CDR load"""
+        statements = PARTY_SUMMARY_DDL + ([PARTY_SUMMARY_REKEY, PARTY_SUMMARY_BACKFILL] + PARTY_SUMMARY_CLEANUP if backfill else [])
+        return self._apply("Party summary", statements)
+
+    def provision_contact_edges(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Create contact_edges, built from existing crd rows once and added to after every CDR load"""
+        statements = CONTACT_EDGES_DDL + ([CONTACT_EDGES_REKEY, CONTACT_EDGES_BACKFILL] + CONTACT_EDGES_CLEANUP if backfill else [])
+        return self._apply("Contact edges", statements)
+
+    def provision_tower_sketches(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Create tower_sketches (per cell-hour HyperLogLog / Count-Min) and sketch existing tower_dumps once"""
+        success, errors = self._apply("Tower sketches", TOWER_SKETCHES_DDL)
+        if success and backfill:
+            built, message = TowerSketchBuilder(verbose=self.verbose).backfill(self.handler)
+            if self.verbose:
+                print(f"{'✅' if built else '⚠️'} {message}")
+            if not built:
+                errors.append(f"Tower sketch backfill -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_tower_dump_filters(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Track tower dump loads (load_id on every row) and build a Bloom filter per load"""
+        success, errors = self._apply("Tower dump loads", TOWER_LOADS_DDL + (TOWER_LOADS_BACKFILL if backfill else []))
+        if success and backfill:
+            built, message = DumpFilterIndex(verbose=self.verbose).backfill(self.handler)
+            if self.verbose:
+                print(f"{'✅' if built else '⚠️'} {message}")
+            if not built:
+                errors.append(f"Tower dump filter backfill -> {message}")
+        return len(errors) == 0, errors
+
+    def provision_cell_dictionary(self, backfill: bool = True) -> Tuple[bool, List[str]]:
+        """Create the cells dimension and integer cell keys on crd and tower_dumps, keying existing rows"""
+        statements = CELLS_DDL + (CELLS_BACKFILL if backfill else [])
+        return self._apply("Cell dictionary", statements)
+
+    def provision_partitioning(self, months_ahead: int = FUTURE_MONTHS) -> Tuple[bool, List[str]]:
+        """Convert crd, tower_dumps and ipdr to monthly partitions on event_ts (needs event_ts first)"""
+        success, errors = PartitionManager(self.handler, verbose=self.verbose).provision(months_ahead)
+        if self.verbose:
+            print(f"{'✅' if success else '⚠️'} Monthly partitions: {len(errors)} error(s)")
+        return success, errors
+
+    def provision_batch_execution(self) -> Tuple[bool, List[str]]:
+        """Install run_investigation_batch, used to run an investigation's queries in one round trip"""
+        return self._apply("Batch execution", BATCH_FUNCTION_DDL)
+
+    def provision_cache_versions(self) -> Tuple[bool, List[str]]:
+        """Create table_versions and the write triggers that invalidate cached query results (after partitioning)"""
+        result = self._apply("Query cache versions", VERSIONS_DDL)
+        get_query_cache().versions_table_ready = None
+        return result
+
+    def provision_all(self) -> Tuple[bool, List[str]]:
+        """Run every provisioning step in dependency order"""
+        all_errors = []
+        steps = [self.provision_placeholder_cleanup, self.provision_integer_ip_columns, self.provision_phone_numbers,
+                 self.provision_number_series, self.provision_event_timestamps, self.provision_device_indexes,
+                 self.provision_case_scoping, self.provision_ipdr_sessions, self.provision_ip_services,
+                 self.provision_party_summary, self.provision_contact_edges, self.provision_tower_sketches,
+                 self.provision_tower_dump_filters, self.provision_cell_dictionary, self.provision_partitioning,
+                 self.provision_cache_versions, self.provision_batch_execution]
+        for step in steps:
+            _, errors = step()
+            all_errors.extend(errors)
+        return len(all_errors) == 0, all_errors
+
+
+def main():
+    """Provision the database schema from the command line"""
+    from supabase_handler import SupabaseHandler
+
+    provisioner = SchemaProvisioner(SupabaseHandler(verbose=True), verbose=True)
+    success, errors = provisioner.provision_all()
+    if success:
+        print("✅ Schema provisioning complete")
+    else:
+        print(f"❌ Schema provisioning finished with {len(errors)} error(s):")
+        for error in errors:
+            print(f"   • {error}")
+
+
+if __name__ == "__main__":
+    main()
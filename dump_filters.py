@@ -0,0 +1,256 @@
+import math
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import BLOOM_FALSE_POSITIVE_RATE
+from event_time import record_times
+from party_summary import identifier_text, number_keys
+from phone_numbers import e164_keys
+from tower_sketches import hash_numbers
+
+TOWER_LOADS_TABLE = "tower_dump_loads"
+
+# Identifiers a dump's filter answers for: numbers by their E.164 key text, IMEIs as text
+FILTER_COLUMNS = ["a_party", "b_party", "imei_a"]
+NUMBER_FILTER_COLUMNS = ["a_party", "b_party"]
+
+# Filters built with an older FILTER_VERSION hold other item spellings; they are searched unfiltered until rebuilt
+FILTER_VERSION = 2
+
+PRE_EXISTING_SOURCE = "pre-existing rows"
+
+# One row per loaded tower-dump file (or sheet); tower_dumps rows point back to it by load_id.
+# A load without a filter (still loading, failed, or not yet backfilled) is always searched.
+TOWER_LOADS_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {TOWER_LOADS_TABLE} (
+        load_id text PRIMARY KEY,
+        case_id text NOT NULL DEFAULT '',
+        source_name text,
+        loaded_at timestamptz NOT NULL DEFAULT now(),
+        row_count bigint,
+        first_event timestamp,
+        last_event timestamp,
+        item_count bigint,
+        bloom bytea,
+        bloom_bits integer,
+        bloom_hashes integer
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_{TOWER_LOADS_TABLE}_case_id ON {TOWER_LOADS_TABLE} (case_id)",
+    "ALTER TABLE tower_dumps ADD COLUMN IF NOT EXISTS load_id text",
+    "CREATE INDEX IF NOT EXISTS idx_tower_dumps_load_id ON tower_dumps (load_id)",
+    f"ALTER TABLE {TOWER_LOADS_TABLE} ADD COLUMN IF NOT EXISTS filter_version integer",
+]
+
+# Rows loaded before load tracking get one unfiltered load per case, built by DumpFilterIndex.backfill
+TOWER_LOADS_BACKFILL = [
+    f"""INSERT INTO {TOWER_LOADS_TABLE} (load_id, case_id, source_name)
+SELECT md5(random()::text || clock_timestamp()::text), case_id, '{PRE_EXISTING_SOURCE}'
+FROM (SELECT DISTINCT coalesce(case_id, '') AS case_id FROM tower_dumps WHERE load_id IS NULL) pending
+WHERE NOT EXISTS (SELECT 1 FROM {TOWER_LOADS_TABLE} l
+                  WHERE l.case_id = pending.case_id AND l.source_name = '{PRE_EXISTING_SOURCE}')""",
+    f"""UPDATE tower_dumps t SET load_id = l.load_id FROM {TOWER_LOADS_TABLE} l
+WHERE t.load_id IS NULL AND l.source_name = '{PRE_EXISTING_SOURCE}' AND l.case_id = coalesce(t.case_id, '')""",
+]
+
+BACKFILL_PAGE_SIZE = 50000
+
+
+class BloomFilter:
+    """Bit-array Bloom filter; k probe positions come from double hashing one stable 64-bit hash"""
+
+    def __init__(self, bits: int, hashes: int, array: Optional[np.ndarray] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = np.zeros(bits, dtype=bool) if array is None else array
+
+    @classmethod
+    def for_items(cls, item_count: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE) -> "BloomFilter":
+        """Size the filter for item_count items at the target false-positive rate"""
+        item_count = max(item_count, 1)
+        bits = max(64, math.ceil(-item_count * math.log(false_positive_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / item_count * math.log(2)))
+        return cls(bits, hashes)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, bits: int, hashes: int) -> "BloomFilter":
+        array = np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8), count=bits).astype(bool)
+        return cls(bits, hashes, array)
+
+    def to_bytes(self) -> bytes:
+        return np.packbits(self.array).tobytes()
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        first = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        second = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        probes = np.arange(self.hashes, dtype=np.int64)[:, None]
+        return (first[None, :] + probes * second[None, :]) % self.bits
+
+    def add(self, hashes: np.ndarray):
+        self.array[self._positions(hashes).ravel()] = True
+
+    def might_contain(self, hashes: np.ndarray) -> np.ndarray:
+        """Per hash: False means definitely absent, True means possibly present"""
+        return self.array[self._positions(hashes)].all(axis=0)
+
+
+def filter_items(df: pd.DataFrame) -> pd.Series:
+    """Distinct identifiers (number keys and IMEIs) in a batch of tower_dumps records"""
+    values = [number_keys(df[column]) if column in NUMBER_FILTER_COLUMNS else identifier_text(df[column])
+              for column in FILTER_COLUMNS if column in df.columns]
+    if not values:
+        return pd.Series([], dtype=object)
+    return pd.concat(values, ignore_index=True).dropna().drop_duplicates()
+
+
+class DumpFilterIndex:
+    """
+    Per-load Bloom filters over tower_dumps numbers and IMEIs
+
+    Every tower-dump file loaded gets a load_id, stamped on its rows, and a filter
+    stored in tower_dump_loads once the load succeeds. A membership lookup tests the
+    filters in memory and only queries the rows of loads that may hold the identifier.
+    """
+
+    def __init__(self, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE, verbose=False):
+        self.false_positive_rate = false_positive_rate
+        self.verbose = verbose
+
+    def register_load(self, supabase_handler, case_id: Optional[str], source_name: Optional[str]) -> Optional[str]:
+        """Record a new load and return its id, or None if load tracking is not provisioned"""
+        load_id = uuid.uuid4().hex
+        success, message, _ = supabase_handler.execute_raw_sql(
+            f"INSERT INTO {TOWER_LOADS_TABLE} (load_id, case_id, source_name) VALUES (%s, %s, %s)",
+            (load_id, case_id or "", source_name))
+        if not success:
+            if self.verbose:
+                print(f"⚠️ Tower dump load not registered: {message}")
+            return None
+        return load_id
+
+    def _store(self, supabase_handler, load_id: str, items: pd.Series, stats: Dict) -> Tuple[bool, str]:
+        bloom = BloomFilter.for_items(len(items), self.false_positive_rate)
+        if len(items):
+            bloom.add(hash_numbers(items))
+        success, message, _ = supabase_handler.execute_raw_sql(
+            f"UPDATE {TOWER_LOADS_TABLE} SET row_count = %s, item_count = %s, first_event = %s, last_event = %s, "
+            f"bloom = %s, bloom_bits = %s, bloom_hashes = %s, filter_version = %s WHERE load_id = %s",
+            (stats["row_count"], len(items), stats["first_event"], stats["last_event"],
+             bloom.to_bytes(), bloom.bits, bloom.hashes, FILTER_VERSION, load_id))
+        if success and self.verbose:
+            print(f"🌸 Tower dump filter: {len(items):,} identifiers in {bloom.bits // 8:,} bytes")
+        return success, message
+
+    def complete_load(self, supabase_handler, load_id: str, records: List[Dict]) -> Tuple[bool, str]:
+        """Store the filter for a finished load"""
+        df = pd.DataFrame(records)
+        times = record_times(df, "tower_dumps")
+        stats = {
+            "row_count": len(df),
+            "first_event": times.min().to_pydatetime() if times.notna().any() else None,
+            "last_event": times.max().to_pydatetime() if times.notna().any() else None,
+        }
+        return self._store(supabase_handler, load_id, filter_items(df), stats)
+
+    def backfill(self, supabase_handler, page_size: int = BACKFILL_PAGE_SIZE) -> Tuple[bool, str]:
+        """Build filters for loads that have none (pre-existing rows, interrupted loads) or an outdated one"""
+        # Recent loads may still be inserting - a filter built now would miss their later rows
+        success, message, loads = supabase_handler.execute_raw_sql(
+            f"SELECT load_id FROM {TOWER_LOADS_TABLE} WHERE (bloom IS NULL "
+            f"AND (source_name = %s OR loaded_at < now() - interval '1 hour')) "
+            f"OR (bloom IS NOT NULL AND filter_version IS DISTINCT FROM %s)", (PRE_EXISTING_SOURCE, FILTER_VERSION))
+        if not success:
+            return False, message
+
+        for load in loads:
+            success, message, stats = supabase_handler.execute_raw_sql(
+                "SELECT count(*) AS row_count, min(event_ts) AS first_event, max(event_ts) AS last_event "
+                "FROM tower_dumps WHERE load_id = %s", (load["load_id"],))
+            if not success:
+                return False, message
+
+            # Only the distinct identifiers are kept while paging through the load
+            items, last_id = pd.Series([], dtype=object), 0
+            while True:
+                success, message, rows = supabase_handler.execute_raw_sql(
+                    f"SELECT id, {', '.join(FILTER_COLUMNS)} FROM tower_dumps WHERE load_id = %s AND id > %s ORDER BY id LIMIT %s",
+                    (load["load_id"], last_id, page_size))
+                if not success:
+                    return False, message
+                if not rows:
+                    break
+                items = pd.concat([items, filter_items(pd.DataFrame(rows))], ignore_index=True).drop_duplicates()
+                last_id = rows[-1]["id"]
+
+            success, message = self._store(supabase_handler, load["load_id"], items, stats[0])
+            if not success:
+                return False, message
+        return True, f"Built filters for {len(loads)} tower dump load(s)"
+
+    def locate(self, supabase_handler, identifiers: List[str]) -> Tuple[bool, str, Dict]:
+        """
+        Which tower dumps contain each number/IMEI
+
+        Returns:
+            {'loads_total', 'loads_searched', 'results': [{'identifier', 'dumps': [{'load_id',
+             'source_name', 'rows', 'first_seen', 'last_seen'}], 'searched_without_match'}]}
+        """
+        requested = identifier_text(pd.Series(identifiers, dtype=object)).dropna()
+        if requested.empty:
+            return False, "No identifiers given", {}
+        # Numbers are looked up by E.164 key whichever way they were written; IMEIs and short codes as text
+        keys = pd.DataFrame({"identifier": number_keys(requested), "number": e164_keys(requested)}) \
+            .drop_duplicates("identifier").reset_index(drop=True)
+        wanted, numbers = keys["identifier"], keys["number"]
+
+        sql = f"SELECT load_id, source_name, bloom, bloom_bits, bloom_hashes, filter_version FROM {TOWER_LOADS_TABLE}"
+        params = ()
+        # Raw SQL is not case-scoped automatically
+        if supabase_handler.active_case_id:
+            sql += " WHERE case_id = %s"
+            params = (supabase_handler.active_case_id,)
+        success, message, loads = supabase_handler.execute_raw_sql(sql, params)
+        if not success:
+            return False, message, {}
+
+        hashes = hash_numbers(wanted)
+        candidates: Dict[str, List[str]] = {identifier: [] for identifier in wanted}
+        for load in loads:
+            if load["bloom"] is None or load["filter_version"] != FILTER_VERSION:
+                hits = np.ones(len(wanted), dtype=bool)
+            else:
+                hits = BloomFilter.from_bytes(load["bloom"], load["bloom_bits"], load["bloom_hashes"]).might_contain(hashes)
+            for identifier in wanted[hits]:
+                candidates[identifier].append(load["load_id"])
+
+        searched = sorted({load_id for load_ids in candidates.values() for load_id in load_ids})
+        found: Dict[Tuple[str, str], Dict] = {}
+        if searched:
+            success, message, rows = supabase_handler.execute_raw_sql(
+                "SELECT m.identifier, t.load_id, count(*) AS rows, min(t.event_ts) AS first_seen, max(t.event_ts) AS last_seen "
+                "FROM tower_dumps t JOIN unnest(%s::text[], %s::bigint[]) AS m(identifier, number_key) "
+                "ON t.a_party_e164 = m.number_key OR t.b_party_e164 = m.number_key OR t.imei_a::text = m.identifier "
+                "OR (m.number_key IS NULL AND (t.a_party::text = m.identifier OR t.b_party::text = m.identifier)) "
+                "WHERE t.load_id = ANY(%s) GROUP BY m.identifier, t.load_id",
+                (list(wanted), [None if pd.isna(key) else int(key) for key in numbers], searched))
+            if not success:
+                return False, message, {}
+            found = {(row["identifier"], row["load_id"]): row for row in rows}
+
+        sources = {load["load_id"]: load["source_name"] for load in loads}
+        results = []
+        for identifier, load_ids in candidates.items():
+            dumps = [{"load_id": load_id, "source_name": sources[load_id], "rows": found[(identifier, load_id)]["rows"],
+                      "first_seen": found[(identifier, load_id)]["first_seen"],
+                      "last_seen": found[(identifier, load_id)]["last_seen"]}
+                     for load_id in load_ids if (identifier, load_id) in found]
+            results.append({"identifier": identifier, "dumps": dumps,
+                            "searched_without_match": len(load_ids) - len(dumps)})
+
+        return True, f"Searched {len(searched)} of {len(loads)} tower dump loads", {
+            "loads_total": len(loads),
+            "loads_searched": len(searched),
+            "results": results,
+        }
@@ -0,0 +1,226 @@
+from datetime import date, datetime, time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Date and time columns combined into event_ts for each time-indexed table
+EVENT_TIME_COLUMNS = {
+    "crd": ("date", "time"),
+    "tower_dumps": ("date", "time"),
+    "ipdr": ("start_date_of_public_ip_allocation", "ist_start_time_of_public_ip_allocation"),
+}
+
+# Subscriber column paired with event_ts in each table's btree index
+EVENT_PARTY_COLUMNS = {
+    "crd": "a_party",
+    "tower_dumps": "a_party",
+    "ipdr": "landline_msidn_mdn_leased_circuit_id",
+}
+
+# Candidate formats tried when inferring a file's layout; day-first only, like the operator exports
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y",
+                "%d-%b-%Y", "%d-%b-%y", "%d %b %Y", "%Y%m%d", "%Y/%m/%d"]
+TIME_FORMATS = ["%H:%M:%S", "%H:%M", "%H:%M:%S.%f", "%I:%M:%S %p", "%I:%M %p", "%H%M%S"]
+
+FORMAT_SAMPLE_SIZE = 50
+
+# Timezone of the operator exports (and so of event_ts)
+LOCAL_TIMEZONE = "Asia/Kolkata"
+
+# Excel stores dates as days since 1899-12-30
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+
+def _to_datetime(text: pd.Series, **kwargs) -> pd.Series:
+    try:
+        return pd.to_datetime(text, errors="coerce", format="mixed", **kwargs)
+    except (TypeError, ValueError):
+        # pandas < 2.0 has no format="mixed"
+        return pd.to_datetime(text, errors="coerce", **kwargs)
+
+
+def parse_datetimes(values: pd.Series) -> pd.Series:
+    """
+    Parse ISO (yyyy-mm-dd) and Indian day-first (dd/mm/yyyy) timestamps in one column
+
+    The result is naive IST, which is what the operator exports and event_ts use.
+    Values carrying a UTC offset or Z are converted to IST; naive values are taken as IST.
+    """
+    text = values.astype(str).str.strip().where(values.notna())
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+
+    iso = text.str.match(r"^\d{4}-").fillna(False).astype(bool)
+    # A trailing Z or +hh:mm offset after a time of day
+    aware = text.str.contains(r"\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})$", regex=True)
+    aware = aware.fillna(False).astype(bool)
+    for mask, dayfirst in ((iso, False), (~iso & text.notna(), True)):
+        if (mask & aware).any():
+            converted = _to_datetime(text[mask & aware], dayfirst=dayfirst, utc=True).dt.tz_convert(LOCAL_TIMEZONE)
+            parsed[mask & aware] = converted.dt.tz_localize(None)
+        if (mask & ~aware).any():
+            parsed[mask & ~aware] = _to_datetime(text[mask & ~aware], dayfirst=dayfirst)
+    return parsed
+
+
+def _date_text(value) -> Optional[str]:
+    """Render one date cell as text, whatever type the reader or database produced"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        number = int(value)
+        if 19000101 <= number <= 21001231:
+            return f"{number // 10000:04d}-{number // 100 % 100:02d}-{number % 100:02d}"
+        if 10000 < number < 100000:
+            return (EXCEL_EPOCH + pd.Timedelta(days=number)).strftime("%Y-%m-%d")
+        return str(number)
+    text = str(value).strip()
+    # Dates read through a timestamp column carry a midnight time that would clash with the time column
+    if len(text) > 10 and text.endswith("00:00:00"):
+        text = text[:-8].rstrip(" T")
+    return text or None
+
+
+def _time_text(value) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "00:00:00"
+    if isinstance(value, datetime):
+        return value.strftime("%H:%M:%S")
+    if isinstance(value, time):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        value = value.to_pytimedelta()
+    if hasattr(value, "total_seconds"):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return str(value).strip() or "00:00:00"
+
+
+def date_time_text(dates: pd.Series, times: pd.Series) -> pd.Series:
+    """Join separate date and time columns into 'date time' strings (None where the date is missing)"""
+    # Plain text columns (the common CSV case) stay on vectorized string ops
+    if pd.api.types.infer_dtype(dates, skipna=True) in ("string", "empty"):
+        date_text = dates.str.strip().str.replace(r"[ T]00:00:00$", "", regex=True)
+        date_text = date_text.str.replace(r"^(\d{4})(\d{2})(\d{2})$", r"\1-\2-\3", regex=True)
+        date_text = date_text.where(date_text.str.len() > 0)
+    else:
+        date_text = pd.Series([_date_text(v) for v in dates.values], index=dates.index, dtype=object)
+
+    if pd.api.types.infer_dtype(times, skipna=True) in ("string", "empty"):
+        time_text = times.where(times.notna(), "00:00:00").astype(str).str.strip()
+    else:
+        time_text = pd.Series([_time_text(v) for v in times.values], index=times.index, dtype=object)
+
+    return (date_text + " " + time_text).where(date_text.notna(), None)
+
+
+def infer_datetime_format(text: pd.Series) -> Optional[str]:
+    """Find the single strftime format that parses a sample of the column, if there is one"""
+    sample = text.dropna().drop_duplicates().head(FORMAT_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+
+    for date_format in DATE_FORMATS:
+        for time_format in TIME_FORMATS:
+            candidate = f"{date_format} {time_format}"
+            if pd.to_datetime(sample, format=candidate, errors="coerce").notna().all():
+                return candidate
+    return None
+
+
+class CachedFormatParser:
+    """
+    Parse datetime columns with a format inferred once per file
+
+    The format is inferred from a small sample the first time a column is seen
+    and reused for every later batch, so whole columns go through a single
+    fixed-format to_datetime call. Values the format misses fall back to the
+    mixed-format parser.
+    """
+
+    def __init__(self):
+        self.formats: Dict[str, Optional[str]] = {}
+
+    def reset(self):
+        """Forget cached formats (call when a new file starts)"""
+        self.formats.clear()
+
+    def parse(self, key: str, text: pd.Series) -> pd.Series:
+        if key not in self.formats:
+            self.formats[key] = infer_datetime_format(text)
+
+        parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+        if self.formats[key]:
+            parsed = pd.to_datetime(text, format=self.formats[key], errors="coerce")
+
+        missed = parsed.isna() & text.notna()
+        if missed.any():
+            # A later sheet may use another layout - re-infer if the cached format mostly fails
+            if missed.sum() > text.notna().sum() // 2:
+                self.formats[key] = infer_datetime_format(text[missed])
+                if self.formats[key]:
+                    parsed[missed] = pd.to_datetime(text[missed], format=self.formats[key], errors="coerce")
+                    missed = parsed.isna() & text.notna()
+            if missed.any():
+                parsed[missed] = parse_datetimes(text[missed])
+        return parsed
+
+
+def combine_date_time(dates: pd.Series, times: pd.Series,
+                      parser: Optional[CachedFormatParser] = None, key: Optional[str] = None) -> pd.Series:
+    """Parse separate date and time columns into one datetime column (missing time means midnight)"""
+    combined = date_time_text(dates, times)
+    if parser is not None:
+        return parser.parse(key or f"{dates.name}|{times.name}", combined)
+    return parse_datetimes(combined)
+
+
+def record_times(df: pd.DataFrame, table_name: str) -> pd.Series:
+    """When each loaded record happened: event_ts if the ingest stage added it, else its date + time columns"""
+    if "event_ts" in df.columns:
+        return pd.to_datetime(df["event_ts"], errors="coerce")
+    date_column, time_column = EVENT_TIME_COLUMNS[table_name]
+    if date_column not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    times = df[time_column] if time_column in df.columns else pd.Series(None, index=df.index, dtype=object)
+    return combine_date_time(df[date_column], times)
+
+
+def datetimes_to_seconds(parsed: pd.Series) -> np.ndarray:
+    """Epoch seconds for a datetime column, -1 where the value is missing"""
+    seconds = parsed.values.astype("datetime64[s]").astype(np.int64)
+    return np.where(parsed.isna().values, -1, seconds)
+
+
+def to_epoch_seconds(dates: pd.Series, times: pd.Series) -> np.ndarray:
+    """Combine separate date and time columns into epoch seconds (-1 where unparseable)"""
+    return datetimes_to_seconds(combine_date_time(dates, times))
+
+
+class EventTimestampStage:
+    """Ingest stage that adds event_ts and orders the batch by it"""
+
+    def __init__(self, table_name: str, parser: Optional[CachedFormatParser] = None):
+        self.table_name = table_name
+        self.columns: Tuple[str, str] = EVENT_TIME_COLUMNS[table_name]
+        self.parser = parser or CachedFormatParser()
+        self.__name__ = f"add_event_ts[{table_name}]"
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        date_column, time_column = self.columns
+        if date_column not in df.columns:
+            return df
+
+        times = df[time_column] if time_column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        parsed = combine_date_time(df[date_column], times, self.parser, key=f"{self.table_name}.{date_column}")
+
+        # Insert in time order so each block of the heap covers a narrow time range (keeps BRIN tight)
+        order = np.argsort(parsed.values, kind="mergesort")
+        df = df.iloc[order].reset_index(drop=True)
+        parsed = parsed.iloc[order].reset_index(drop=True)
+
+        # ISO text keeps the batch JSON-serializable for the PostgREST insert path
+        df["event_ts"] = parsed.dt.strftime("%Y-%m-%dT%H:%M:%S").where(parsed.notna(), None)
+        return df
@@ -6,6 +6,7 @@ from datetime import datetime, date, time
 import numpy as np
 from schema_mapper import SchemaMapper
 from supabase_handler import SupabaseHandler
+from ingest_pipeline import IngestPipeline
 from typing import List, Dict
 
 class FileProcessor:
@@ -14,6 +15,7 @@ class FileProcessor:
         self.verbose = verbose
         self.schema_mapper = SchemaMapper()
         self.supabase_handler = SupabaseHandler(verbose=verbose)
+        self.ingest_pipeline = IngestPipeline(verbose=verbose, supabase_handler=self.supabase_handler)
         
     def _clean_data_for_json(self, data):
         """Clean data to ensure JSON serialization compatibility"""
@@ -194,10 +196,11 @@ class FileProcessor:
             print(f"Error processing Word file: {e}")
             return None
     
-    def process_file_with_supabase(self, file_path, file_type):
+    def process_file_with_supabase(self, file_path, file_type, case_id=None):
         """Process file and automatically insert into appropriate Supabase table"""
         # First extract the data
         data = self.process_file(file_path, file_type)
+        self.ingest_pipeline.start_file()
         
         if not data:
             print("❌ Failed to extract data from file")
@@ -215,20 +218,20 @@ class FileProcessor:
             
             for sheet_name, sheet_data in data.items():
                 print(f"\n--- Processing Sheet: {sheet_name} ---")
-                result = self._process_sheet_data(sheet_data, f"{file_path}_{sheet_name}")
+                result = self._process_sheet_data(sheet_data, f"{file_path}_{sheet_name}", case_id)
                 results[sheet_name] = result
             
             return results
         
         # Handle single data structure (CSV, single Excel sheet, Word tables)
         elif isinstance(data, list):
-            return self._process_sheet_data(data, file_path)
+            return self._process_sheet_data(data, file_path, case_id)
         
         else:
             print("❌ Unsupported data structure for database insertion")
             return data
     
-    def _process_sheet_data(self, data, source_name):
+    def _process_sheet_data(self, data, source_name, case_id=None):
         """Process a single sheet/table of data for Supabase insertion"""
         if not data or not isinstance(data, list):
             if self.verbose:
@@ -379,6 +382,9 @@ class FileProcessor:
         # Apply minimal data cleaning for JSON-to-database compatibility
         cleaned_data = self._clean_data_for_database(normalized_data, table_name)
         
+        # Add vectorized derived columns (integer IPs, etc.)
+        cleaned_data = self.ingest_pipeline.run(table_name, cleaned_data)
+        
         # DEBUG: Print sample data after cleaning for monitored tables
         if table_name in ['sms_header', 'tower_dumps']:
             print(f"\n🔍 DEBUG - Sample data after cleaning for {table_name}:")
@@ -388,7 +394,8 @@ class FileProcessor:
                     print(f"  {key}: {type(value).__name__} = {value}")
         
         # Insert data directly
-        success, message, count = self.supabase_handler.insert_data(table_name, cleaned_data)
+        success, message, count = self.supabase_handler.insert_data(table_name, cleaned_data, case_id=case_id,
+                                                                     source_name=Path(source_name).name)
         
         if success:
             print(f"✅ SUCCESS: {count} records inserted into '{table_name}' table")
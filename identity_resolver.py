@@ -0,0 +1,229 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from phone_numbers import e164_keys
+
+# (number, IMEI, IMSI) columns for every table that records a subscriber identity
+IDENTITY_COLUMNS = {
+    'crd': ('a_party', 'imei_a', 'imsi_a'),
+    'tower_dumps': ('a_party', 'imei_a', 'imsi_a'),
+    'ipdr': ('landline_msidn_mdn_leased_circuit_id', 'imei', 'imsi'),
+}
+
+IDENTIFIER_KINDS = ('number', 'imei', 'imsi')
+
+# Without table_versions a process cannot see other processes' loads; reload this often instead
+UNTRACKED_RELOAD_SECONDS = 300
+
+
+class IdentityResolver:
+    """
+    Union-find index over (number, IMEI, IMSI) co-occurrences
+
+    Every identifier seen in the same record is unioned into one cluster, so a
+    cluster holds all numbers, handsets and SIMs that were ever used together.
+    Each root keeps the member sets of its cluster, which makes a cluster
+    lookup a near-constant find() plus a dictionary read. An index covers one
+    case (case_id) or, with none, all data.
+    """
+
+    def __init__(self, case_id: Optional[str] = None):
+        self.case_id = case_id
+        self.parent: Dict[str, str] = {}
+        self.size: Dict[str, int] = {}
+        self.members: Dict[str, Dict[str, set]] = {}
+        self.loaded_from_database = False
+        self.loaded_versions: Optional[Dict[str, tuple]] = None
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(value) -> Optional[str]:
+        """Normalize an identifier value, returning None for blanks and placeholders"""
+        if value is None:
+            return None
+        if isinstance(value, float):
+            if value != value or not value.is_integer():  # NaN or fractional
+                return None
+            value = int(value)
+        text = str(value).strip()
+        if text.endswith('.0'):
+            text = text[:-2]
+        if not text or text.lower() in ('nan', 'none', 'null', '0'):
+            return None
+        return text
+
+    @classmethod
+    def _numbers(cls, values: pd.Series) -> List[Optional[str]]:
+        """Numbers as E.164 text, so +91 / 0-prefixed and bare national numbers meet; others as-is"""
+        keys = e164_keys(values)
+        return [str(key) if pd.notna(key) else cls._normalize(value) for key, value in zip(keys, values)]
+
+    @staticmethod
+    def _node(kind: str, value: str) -> str:
+        return f"{kind}:{value}"
+
+    def _add_node(self, node: str, kind: str, value: str):
+        if node not in self.parent:
+            self.parent[node] = node
+            self.size[node] = 1
+            self.members[node] = {k: set() for k in IDENTIFIER_KINDS}
+            self.members[node][kind].add(value)
+
+    def _find(self, node: str) -> str:
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def _union(self, a: str, b: str) -> bool:
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return False
+
+        # Union by size - merge the smaller member sets into the larger cluster
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        for kind in IDENTIFIER_KINDS:
+            self.members[root_a][kind].update(self.members[root_b][kind])
+        del self.members[root_b]
+        return True
+
+    def add_identity(self, number=None, imei=None, imsi=None) -> int:
+        """Link the identifiers of a single observation, returning the number of merges"""
+        number = self._numbers(pd.Series([number], dtype=object))[0]
+        return self._link(number, self._normalize(imei), self._normalize(imsi))
+
+    def _link(self, *values: Optional[str]) -> int:
+        """Union normalized (number, IMEI, IMSI) values"""
+        nodes = []
+        for kind, value in zip(IDENTIFIER_KINDS, values):
+            if value is not None:
+                node = self._node(kind, value)
+                self._add_node(node, kind, value)
+                nodes.append(node)
+
+        merges = 0
+        for other in nodes[1:]:
+            if self._union(nodes[0], other):
+                merges += 1
+        return merges
+
+    def add_records(self, table_name: str, records: List[Dict]) -> int:
+        """Incrementally index a batch of freshly loaded records"""
+        columns = IDENTITY_COLUMNS.get(table_name)
+        if not columns or not records:
+            return 0
+
+        number_col, imei_col, imsi_col = columns
+        numbers = self._numbers(pd.Series([record.get(number_col) for record in records], dtype=object))
+        merges = 0
+        with self._lock:
+            # Identical triples are common in CDRs - only union each one once
+            seen = set()
+            for number, record in zip(numbers, records):
+                triple = (number, self._normalize(record.get(imei_col)), self._normalize(record.get(imsi_col)))
+                if triple in seen:
+                    continue
+                seen.add(triple)
+                merges += self._link(*triple)
+        return merges
+
+    def rebuild_from_database(self, supabase_handler) -> Tuple[bool, str]:
+        """Replace the index with every distinct identity triple stored for the index's case"""
+        fresh = IdentityResolver(self.case_id)
+        versions = supabase_handler.table_versions(list(IDENTITY_COLUMNS))
+        total = 0
+        for table_name, (number_col, imei_col, imsi_col) in IDENTITY_COLUMNS.items():
+            sql = f"SELECT DISTINCT {number_col}, {imei_col}, {imsi_col} FROM {table_name}"
+            # Raw SQL is not case-scoped automatically
+            if self.case_id:
+                sql += " WHERE case_id = %s"
+            success, message, rows = supabase_handler.execute_raw_sql(sql, (self.case_id,) if self.case_id else None)
+            if not success:
+                return False, f"Failed to load identities from {table_name}: {message}"
+            total += len(rows)
+            fresh.add_records(table_name, rows)
+
+        with self._lock:
+            self.parent, self.size, self.members = fresh.parent, fresh.size, fresh.members
+            self.loaded_from_database = True
+            self.loaded_versions = versions
+            self.loaded_at = time.monotonic()
+        return True, f"Indexed {total} identity triples into {self.cluster_count()} clusters"
+
+    def refresh_from_database(self, supabase_handler) -> Optional[Tuple[bool, str]]:
+        """
+        Rebuild if rows were loaded since the last build - possibly by another process,
+        as seen through the table_versions counters. Returns None when already current.
+        """
+        if self.loaded_from_database:
+            versions = supabase_handler.table_versions(list(IDENTITY_COLUMNS))
+            if versions is not None and versions == self.loaded_versions:
+                return None
+            if versions is None and time.monotonic() - self.loaded_at < UNTRACKED_RELOAD_SECONDS:
+                return None
+        return self.rebuild_from_database(supabase_handler)
+
+    def get_cluster(self, identifier, kind: Optional[str] = None) -> Optional[Dict]:
+        """
+        Return every number, IMEI and IMSI linked to an identifier
+
+        Args:
+            identifier: Phone number, IMEI or IMSI
+            kind: One of 'number', 'imei', 'imsi'; all kinds are tried when omitted
+        """
+        value = self._normalize(identifier)
+        if value is None:
+            return None
+        number = self._numbers(pd.Series([identifier], dtype=object))[0]
+
+        kinds = [kind] if kind else list(IDENTIFIER_KINDS)
+        for candidate in kinds:
+            node = self._node(candidate, number if candidate == 'number' else value)
+            if node in self.parent:
+                with self._lock:
+                    root = self._find(node)
+                    cluster = self.members[root]
+                    return {
+                        "identifier": number if candidate == 'number' else value,
+                        "matched_as": candidate,
+                        "numbers": sorted(cluster['number']),
+                        "imeis": sorted(cluster['imei']),
+                        "imsis": sorted(cluster['imsi']),
+                        "cluster_size": self.size[root]
+                    }
+        return None
+
+    def cluster_count(self) -> int:
+        return len(self.members)
+
+
+_identity_resolvers: Dict[str, IdentityResolver] = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_identity_resolver(case_id: Optional[str] = None) -> IdentityResolver:
+    """Process-wide resolver of a case (all data without one), shared by the loaders and the investigation API"""
+    key = case_id or ""
+    with _resolvers_lock:
+        if key not in _identity_resolvers:
+            _identity_resolvers[key] = IdentityResolver(case_id or None)
+        return _identity_resolvers[key]
+
+
+def add_loaded_records(table_name: str, records: List[Dict], case_id: Optional[str] = None) -> int:
+    """Index freshly loaded records into the all-data resolver and, if one was built, their case's"""
+    resolvers = [get_identity_resolver()]
+    with _resolvers_lock:
+        if case_id and case_id in _identity_resolvers:
+            resolvers.append(_identity_resolvers[case_id])
+    return [resolver.add_records(table_name, records) for resolver in resolvers][0]
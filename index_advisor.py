@@ -0,0 +1,350 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import TABLE_SCHEMAS
+from case_scope import CASE_COLUMN
+from cell_dictionary import CELL_KEY_COLUMNS
+from event_time import EVENT_TIME_COLUMNS
+from ip_index import IPDR_IP_COLUMNS
+from ip_services import ASN_COLUMN, SERVICE_COLUMN
+from number_series import SERIES_COLUMNS
+from phone_numbers import PHONE_NUMBER_COLUMNS
+from schema_validator import get_schema_validator
+from session_stitcher import SESSION_COLUMNS
+
+# Below this many rows a sequential scan is as fast as any index
+MIN_TABLE_ROWS = 10000
+
+# Rough planner constants: an index fetch costs about random_page_cost per matched row
+RANDOM_PAGE_COST = 4.0
+RANGE_SELECTIVITY = 0.05
+MAX_KEY_COLUMNS = 3
+MAX_INCLUDE_COLUMNS = 4
+
+_TABLE_REF = re.compile(
+    r'\b(?:from|join)\s+(?:public\.)?"?(\w+)"?'
+    r'(?:\s+(?:as\s+)?(?!(?:where|join|on|left|right|inner|outer|full|cross|natural|using|group|order|limit|'
+    r'having|union|window|offset|fetch|for)\b)(\w+))?',
+    re.IGNORECASE)
+
+_PREDICATE = re.compile(
+    r'(?:\b(\w+)\.)?"?\b(\w+)"?\s*(=|<=|>=|<>|!=|<|>|\bnot\s+in\b|\bin\b|\bbetween\b|\bi?like\b|\bis\b)',
+    re.IGNORECASE)
+
+_SELECT_LIST = re.compile(r'^\s*select\s+(?:distinct\s+)?(.*?)\s+from\b', re.IGNORECASE | re.DOTALL)
+
+EQUALITY_OPERATORS = {"=", "in", "is"}
+RANGE_OPERATORS = {"<", ">", "<=", ">=", "between", "like"}
+
+
+def _table_columns() -> Dict[str, set]:
+    """
+    Known columns per table when the live catalog cannot be read: the configured
+    schemas plus the derived columns added at ingest
+    """
+    columns = {}
+    for table, schema in TABLE_SCHEMAS.items():
+        names = set(schema.get("required_columns", [])) | set(schema.get("column_types", {}))
+        columns[table] = {name.lower() for name in names} | {CASE_COLUMN}
+    for table in EVENT_TIME_COLUMNS:
+        columns[table].add("event_ts")
+    for prefix in IPDR_IP_COLUMNS.values():
+        columns["ipdr"] |= {f"{prefix}_v4", f"{prefix}_v6_hi", f"{prefix}_v6_lo"}
+    columns["ipdr"] |= {SERVICE_COLUMN, ASN_COLUMN}
+    for table, keys in PHONE_NUMBER_COLUMNS.items():
+        columns[table] |= set(keys.values())
+    for table, (_, operator, circle) in SERIES_COLUMNS.items():
+        columns[table] |= {operator, circle}
+    for table, keys in CELL_KEY_COLUMNS.items():
+        columns[table] |= set(keys.values())
+    columns["ipdr_sessions"] = set(SESSION_COLUMNS)
+    return columns
+
+
+TABLE_COLUMNS = _table_columns()
+
+
+def table_columns(supabase_handler=None) -> Dict[str, set]:
+    """Columns per table from the live catalog (cached by the schema validator), else TABLE_COLUMNS"""
+    if supabase_handler is not None:
+        live = get_schema_validator().catalog_columns(supabase_handler)
+        if live:
+            return live
+    return TABLE_COLUMNS
+
+
+def extract_predicates(sql_query: str, columns_by_table: Optional[Dict[str, set]] = None) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Map each referenced table to its equality, range and selected columns
+
+    Only bare column comparisons are collected - columns wrapped in functions
+    or casts cannot use a plain btree index anyway.
+    """
+    known = columns_by_table or TABLE_COLUMNS
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql_query):
+        table = table.lower()
+        if table in known:
+            aliases[table] = table
+            if alias:
+                aliases[alias.lower()] = table
+    tables = sorted(set(aliases.values()))
+    result = {t: {"equality": [], "range": [], "selected": []} for t in tables}
+
+    def owners(qualifier: Optional[str], column: str) -> List[str]:
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+            return [table] if table and column in known[table] else []
+        return [t for t in tables if column in known[t]]
+
+    for qualifier, column, operator in _PREDICATE.findall(sql_query):
+        column, operator = column.lower(), re.sub(r"\s+", " ", operator.lower())
+        if operator in EQUALITY_OPERATORS:
+            kind = "equality"
+        elif operator in RANGE_OPERATORS:
+            kind = "range"
+        else:
+            continue  # <>, NOT IN and ILIKE cannot use a plain btree
+        for table in owners(qualifier, column):
+            if column not in result[table][kind]:
+                result[table][kind].append(column)
+
+    select_list = _SELECT_LIST.match(sql_query)
+    if select_list and select_list.group(1).strip() != "*":
+        for item in select_list.group(1).split(","):
+            match = re.fullmatch(r'\s*(?:(\w+)\.)?"?(\w+)"?\s*(?:as\s+\w+)?\s*', item, re.IGNORECASE)
+            if not match:
+                continue
+            for table in owners(match.group(1), match.group(2).lower()):
+                result[table]["selected"].append(match.group(2).lower())
+
+    return result
+
+
+class IndexAdvisor:
+    """
+    Record the investigation workload and recommend indexes for it
+
+    Every executed statement is reduced to per-table (equality columns, range
+    column) shapes. Shapes are aggregated with the time their queries took,
+    then checked against existing indexes and column statistics to estimate
+    how much of that time an index would save.
+    """
+
+    def __init__(self):
+        self.workload: Dict[Tuple, Dict] = {}
+        self.statements_recorded = 0
+        self._lock = threading.Lock()
+
+    def record(self, sql_query: str, elapsed_seconds: float, row_count: int = 0, case_scoped: bool = False,
+               supabase_handler=None):
+        """Add one executed statement to the workload (columns come from the handler's live catalog)"""
+        known = table_columns(supabase_handler)
+        predicates = extract_predicates(sql_query, known)
+        with self._lock:
+            self.statements_recorded += 1
+            for table, columns in predicates.items():
+                equality = sorted(set(columns["equality"]))[:MAX_KEY_COLUMNS]
+                # Only tables that carry case_id are filtered on it by case scoping
+                if case_scoped and CASE_COLUMN in known.get(table, ()) and CASE_COLUMN not in equality:
+                    equality = [CASE_COLUMN] + equality
+                range_column = columns["range"][0] if columns["range"] else None
+                if not equality and not range_column:
+                    continue
+
+                key = (table, tuple(equality), range_column)
+                entry = self.workload.setdefault(key, {
+                    "count": 0, "total_seconds": 0.0, "rows": 0, "include": set(), "sample_sql": sql_query
+                })
+                entry["count"] += 1
+                entry["total_seconds"] += elapsed_seconds
+                entry["rows"] += row_count
+                entry["include"] |= set(columns["selected"]) - set(equality) - {range_column}
+
+    def reset(self):
+        with self._lock:
+            self.workload.clear()
+            self.statements_recorded = 0
+
+    @staticmethod
+    def _catalog(supabase_handler, tables: List[str]) -> Tuple[bool, str, Dict]:
+        """Existing indexes (with usage), column statistics and row counts for the given tables"""
+        success, message, indexes = supabase_handler.execute_raw_sql(
+            "SELECT t.relname AS table_name, i.relname AS index_name, am.amname AS method, "
+            "array_agg(a.attname::text ORDER BY k.ord) FILTER (WHERE k.ord <= x.indnkeyatts) AS columns, "
+            "s.idx_scan "
+            "FROM pg_index x JOIN pg_class t ON t.oid = x.indrelid JOIN pg_class i ON i.oid = x.indexrelid "
+            "JOIN pg_am am ON am.oid = i.relam "
+            "CROSS JOIN LATERAL unnest(x.indkey) WITH ORDINALITY AS k(attnum, ord) "
+            "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum "
+            "LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = x.indexrelid "
+            "WHERE t.relname = ANY(%s) AND t.relnamespace = current_schema()::regnamespace "
+            "GROUP BY t.relname, i.relname, am.amname, s.idx_scan", (tables,))
+        if not success:
+            return False, message, {}
+
+        success, message, stats = supabase_handler.execute_raw_sql(
+            "SELECT tablename AS table_name, attname AS column_name, n_distinct, null_frac, inherited "
+            "FROM pg_stats WHERE schemaname = current_schema() AND tablename = ANY(%s)", (tables,))
+        if not success:
+            return False, message, {}
+
+        # Partitioned parents report no rows of their own - sum their partitions
+        success, message, sizes = supabase_handler.execute_raw_sql(
+            "SELECT p.relname AS table_name, sum(GREATEST(c.reltuples, 0))::bigint AS row_estimate "
+            "FROM pg_class p LEFT JOIN pg_inherits h ON h.inhparent = p.oid "
+            "JOIN pg_class c ON c.oid = COALESCE(h.inhrelid, p.oid) "
+            "WHERE p.relname = ANY(%s) AND p.relnamespace = current_schema()::regnamespace "
+            "GROUP BY p.relname", (tables,))
+        if not success:
+            return False, message, {}
+
+        catalog = {t: {"indexes": [], "stats": {}, "rows": 0} for t in tables}
+        for row in indexes:
+            columns = row["columns"] if isinstance(row["columns"], list) else str(row["columns"]).strip("{}").split(",")
+            catalog[row["table_name"]]["indexes"].append({
+                "name": row["index_name"], "method": row["method"], "columns": columns, "scans": row["idx_scan"]
+            })
+        for row in sorted(stats, key=lambda r: not r["inherited"]):
+            catalog[row["table_name"]]["stats"].setdefault(row["column_name"], row)
+        for row in sizes:
+            catalog[row["table_name"]]["rows"] = int(row["row_estimate"] or 0)
+        return True, "ok", catalog
+
+    @staticmethod
+    def _distinct(stats: Dict, column: str, rows: int) -> float:
+        n_distinct = (stats.get(column) or {}).get("n_distinct")
+        if n_distinct is None:
+            return 200.0  # planner default when a column has no statistics
+        n_distinct = float(n_distinct)
+        return max(1.0, -n_distinct * rows if n_distinct < 0 else n_distinct)
+
+    def analyze(self, supabase_handler) -> Tuple[bool, str, List[Dict]]:
+        """Turn the recorded workload into index recommendations, most time saved first"""
+        with self._lock:
+            workload = {key: dict(entry, include=set(entry["include"])) for key, entry in self.workload.items()}
+        if not workload:
+            return True, "No statements recorded yet", []
+
+        tables = sorted({key[0] for key in workload})
+        success, message, catalog = self._catalog(supabase_handler, tables)
+        if not success:
+            return False, message, []
+
+        recommendations = []
+        for (table, equality, range_column), entry in workload.items():
+            info = catalog[table]
+            rows = info["rows"]
+
+            # Most selective equality columns lead the index
+            equality = sorted(equality, key=lambda c: -self._distinct(info["stats"], c, rows))
+            key_columns = list(equality) + ([range_column] if range_column else [])
+
+            selectivity = 1.0
+            for column in equality:
+                selectivity /= self._distinct(info["stats"], column, rows)
+            if range_column:
+                selectivity *= RANGE_SELECTIVITY
+
+            covered_by = None
+            for index in info["indexes"]:
+                if index["method"] != "btree":
+                    continue
+                leading = index["columns"][:len(equality)]
+                if set(leading) == set(equality) and (
+                        not range_column or index["columns"][len(equality):len(equality) + 1] == [range_column]):
+                    covered_by = index
+                    break
+
+            include = sorted(entry["include"])
+            if len(include) > MAX_INCLUDE_COLUMNS:
+                include = []
+
+            # Sequential scan reads every row once; the index reads matching rows at random-access cost
+            saved_fraction = max(0.0, 1.0 - RANDOM_PAGE_COST * selectivity)
+            if covered_by or rows < MIN_TABLE_ROWS:
+                saved_fraction = 0.0
+
+            name = f"idx_{table}_{'_'.join(key_columns)}"[:63]
+            ddl = f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(key_columns)})"
+            if include:
+                ddl += f" INCLUDE ({', '.join(include)})"
+
+            if covered_by:
+                status = f"covered by {covered_by['name']} ({covered_by['scans'] or 0} scans)"
+            elif rows < MIN_TABLE_ROWS:
+                status = "table too small to benefit"
+            else:
+                status = "recommended"
+
+            recommendations.append({
+                "table": table,
+                "index_name": name,
+                "columns": key_columns,
+                "include": include,
+                "ddl": ddl,
+                "status": status,
+                "query_count": entry["count"],
+                "observed_seconds": round(entry["total_seconds"], 3),
+                "estimated_selectivity": selectivity,
+                "table_rows": rows,
+                "estimated_seconds_saved": round(entry["total_seconds"] * saved_fraction, 3),
+                "sample_sql": entry["sample_sql"],
+            })
+
+        recommendations.sort(key=lambda r: -r["estimated_seconds_saved"])
+        recommended = sum(1 for r in recommendations if r["status"] == "recommended")
+        return True, f"{recommended} index(es) recommended from {self.statements_recorded} statements", recommendations
+
+    @staticmethod
+    def create_index(supabase_handler, recommendation: Dict, concurrently: bool = True) -> Tuple[bool, str]:
+        """
+        Build a recommended index
+
+        CONCURRENTLY avoids blocking writes but cannot run in a transaction or on a
+        partitioned parent, so partitioned tables get an invalid parent index built
+        ONLY on the parent, one concurrent build per partition, and an ATTACH for each.
+        """
+        table = recommendation["table"]
+        name = recommendation["index_name"]
+        definition = recommendation["ddl"].split(f" ON {table} ", 1)[1]
+
+        if not concurrently:
+            success, message, _ = supabase_handler.execute_raw_sql(recommendation["ddl"])
+            return success, message
+
+        if not supabase_handler.partitions.is_partitioned(table):
+            return supabase_handler.execute_autocommit(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+        success, message, partitions = supabase_handler.execute_raw_sql(
+            "SELECT c.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid "
+            "WHERE h.inhparent = to_regclass(%s)", (table,))
+        if not success:
+            return False, message
+
+        success, message = supabase_handler.execute_autocommit(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}")
+        if not success:
+            return False, message
+
+        for row in partitions:
+            child = row["relname"]
+            child_index = f"{name[:40]}_{child[-20:]}"[:63]
+            for statement in (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_index} ON {child} {definition}",
+                              f"ALTER INDEX {name} ATTACH PARTITION {child_index}"):
+                success, message = supabase_handler.execute_autocommit(statement)
+                if not success and "already" not in message:
+                    return False, f"{child}: {message}"
+
+        return True, f"Built {name} on {len(partitions)} partition(s)"
+
+
+_index_advisor = None
+
+
+def get_index_advisor() -> IndexAdvisor:
+    """Process-wide advisor fed by the investigation query executor"""
+    global _index_advisor
+    if _index_advisor is None:
+        _index_advisor = IndexAdvisor()
+    return _index_advisor
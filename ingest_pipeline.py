@@ -0,0 +1,65 @@
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from cell_dictionary import CellEncodingStage
+from event_time import CachedFormatParser, EventTimestampStage
+from ip_index import add_integer_ip_columns
+from ip_services import IpServiceStage
+from number_series import SERIES_COLUMNS, NumberSeriesStage, get_number_series
+from phone_numbers import PHONE_NUMBER_COLUMNS, PhoneNumberStage
+
+
+def frame_to_records(df: pd.DataFrame) -> List[Dict]:
+    """Convert a DataFrame back to JSON-compatible records (NaN/NA become None, numpy scalars become Python)"""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+class IngestPipeline:
+    """
+    Vectorized enrichment stages applied to a cleaned batch before insertion
+
+    Each stage takes and returns a DataFrame, so derived columns are computed
+    column-at-a-time instead of per record.
+    """
+
+    def __init__(self, verbose=False, supabase_handler=None):
+        self.verbose = verbose
+        self.datetime_parser = CachedFormatParser()
+        self.stages: Dict[str, List[Callable[[pd.DataFrame], pd.DataFrame]]] = {
+            "crd": [EventTimestampStage("crd", self.datetime_parser)],
+            "tower_dumps": [EventTimestampStage("tower_dumps", self.datetime_parser)],
+            "ipdr": [add_integer_ip_columns, IpServiceStage(), EventTimestampStage("ipdr", self.datetime_parser)],
+        }
+        for table_name in PHONE_NUMBER_COLUMNS:
+            self.stages.setdefault(table_name, []).insert(0, PhoneNumberStage(table_name))
+        # Operator/circle tagging is skipped when no series file is installed
+        series = get_number_series()
+        if series is not None:
+            for table_name in SERIES_COLUMNS:
+                self.stages[table_name].insert(1, NumberSeriesStage(table_name, series))
+        elif verbose:
+            print("ℹ️ No number series file - operator/circle enrichment disabled")
+        # Cell keys need the database to look up / assign them
+        if supabase_handler is not None:
+            for table_name in ("crd", "tower_dumps"):
+                self.stages[table_name].append(CellEncodingStage(table_name, supabase_handler))
+
+    def start_file(self):
+        """Reset per-file state such as inferred datetime formats"""
+        self.datetime_parser.reset()
+
+    def run(self, table_name: str, data: List[Dict]) -> List[Dict]:
+        """Apply every stage registered for the table"""
+        stages = self.stages.get(table_name, [])
+        if not stages or not data:
+            return data
+
+        # object dtype keeps the original Python values (no int -> float coercion on NULLs)
+        df = pd.DataFrame(data, dtype=object)
+        for stage in stages:
+            df = stage(df)
+            if self.verbose:
+                print(f"   🧩 Ingest stage '{stage.__name__}' applied to {len(df):,} {table_name} rows")
+
+        return frame_to_records(df)
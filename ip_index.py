@@ -0,0 +1,141 @@
+import ipaddress
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# IPDR address columns and the prefix of their integer-encoded companions
+IPDR_IP_COLUMNS = {
+    "source_ip_address": "source_ip",
+    "translated_ip_address": "translated_ip",
+    "destination_ip_address": "destination_ip",
+}
+
+# IPv6 halves are stored as signed bigint with the sign bit flipped (offset binary),
+# so that btree order on (hi, lo) matches numeric address order
+V6_BIAS = 1 << 63
+
+
+def _bias(value: int) -> int:
+    return value - V6_BIAS
+
+
+def encode_ipv4(values: pd.Series) -> pd.Series:
+    """Vectorized dotted-quad to uint32 conversion (stored as Int64, <NA> when not IPv4)"""
+    text = values.astype(str).str.strip()
+    is_v4 = text.str.fullmatch(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}").fillna(False).astype(bool)
+
+    result = pd.Series(pd.NA, index=values.index, dtype="Int64")
+    if not is_v4.any():
+        return result
+
+    octets = text[is_v4].str.split(".", expand=True).astype(np.int64).values
+    in_range = (octets <= 255).all(axis=1)
+    encoded = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    result[text.index[is_v4][in_range]] = encoded[in_range]
+    return result
+
+
+def encode_ipv6(values: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """Encode IPv6 addresses as biased (hi, lo) 64-bit halves, parsing each distinct value once"""
+    text = values.astype(str).str.strip()
+    hi = pd.Series(pd.NA, index=values.index, dtype="Int64")
+    lo = pd.Series(pd.NA, index=values.index, dtype="Int64")
+
+    candidates = text[text.str.contains(":", regex=False).fillna(False) & values.notna()]
+    if candidates.empty:
+        return hi, lo
+
+    halves = {}
+    for address in candidates.unique():
+        try:
+            value = int(ipaddress.IPv6Address(address))
+        except ValueError:
+            continue
+        halves[address] = (_bias(value >> 64), _bias(value & 0xFFFFFFFFFFFFFFFF))
+
+    mapped = candidates.map(halves).dropna()
+    hi[mapped.index] = [h for h, _ in mapped]
+    lo[mapped.index] = [l for _, l in mapped]
+    return hi, lo
+
+
+def add_integer_ip_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Add <prefix>_v4, <prefix>_v6_hi and <prefix>_v6_lo columns for every IPDR address column"""
+    for column, prefix in IPDR_IP_COLUMNS.items():
+        if column not in df.columns:
+            continue
+        df[f"{prefix}_v4"] = encode_ipv4(df[column])
+        df[f"{prefix}_v6_hi"], df[f"{prefix}_v6_lo"] = encode_ipv6(df[column])
+    return df
+
+
+def cidr_to_range(cidr: str) -> Dict:
+    """
+    Convert a CIDR block into the integer bounds of its encoded columns
+
+    Returns:
+        {'version': 4, 'low': int, 'high': int} for IPv4, or for IPv6
+        {'version': 6, 'low': (hi, lo), 'high': (hi, lo)} using the biased halves
+    """
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    low, high = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4:
+        return {"version": 4, "low": low, "high": high}
+
+    mask = 0xFFFFFFFFFFFFFFFF
+    return {
+        "version": 6,
+        "low": (_bias(low >> 64), _bias(low & mask)),
+        "high": (_bias(high >> 64), _bias(high & mask))
+    }
+
+
+def cidr_predicate(cidr: str, prefix: str = "destination_ip") -> Tuple[str, tuple]:
+    """Build an index-friendly range predicate (and bound params) over encoded IP columns"""
+    bounds = cidr_to_range(cidr)
+    if bounds["version"] == 4:
+        return f"{prefix}_v4 BETWEEN %s AND %s", (bounds["low"], bounds["high"])
+
+    return (f"({prefix}_v6_hi, {prefix}_v6_lo) BETWEEN (%s, %s) AND (%s, %s)",
+            (*bounds["low"], *bounds["high"]))
+
+
+BACKFILL_PAGE_SIZE = 50000
+
+
+def backfill_ipv6_columns(supabase_handler, page_size: int = BACKFILL_PAGE_SIZE, verbose=False) -> Tuple[bool, str]:
+    """
+    Encode the _v6_hi / _v6_lo columns of existing IPDR rows, paging by id
+
+    The IPv4 columns are backfilled in SQL; IPv6 halves do not fit inet arithmetic,
+    so they are encoded here with encode_ipv6.
+    """
+    pending = " OR ".join(f"(strpos({column}, ':') > 0 AND {prefix}_v6_hi IS NULL)"
+                          for column, prefix in IPDR_IP_COLUMNS.items())
+    assignments = ", ".join(f"{prefix}_v6_hi = coalesce(t.{prefix}_v6_hi, v.{prefix}_hi::bigint), "
+                            f"{prefix}_v6_lo = coalesce(t.{prefix}_v6_lo, v.{prefix}_lo::bigint)"
+                            for prefix in IPDR_IP_COLUMNS.values())
+    names = ", ".join(f"{prefix}_hi, {prefix}_lo" for prefix in IPDR_IP_COLUMNS.values())
+    updated, last_id = 0, 0
+    while True:
+        success, message, rows = supabase_handler.execute_raw_sql(
+            f"SELECT id, {', '.join(IPDR_IP_COLUMNS)} FROM ipdr WHERE id > %s AND ({pending}) ORDER BY id LIMIT %s",
+            (last_id, page_size))
+        if not success:
+            return False, message
+        if not rows:
+            break
+        page = pd.DataFrame(rows)
+        halves = [encode_ipv6(page[column]) for column in IPDR_IP_COLUMNS]
+        values = [(row_id, *(None if pd.isna(value) else int(value) for value in encoded))
+                  for row_id, *encoded in zip(page["id"], *(half for pair in halves for half in pair))]
+        success, message, _ = supabase_handler.bulk_write(
+            f"UPDATE ipdr t SET {assignments} FROM (VALUES %s) AS v (id, {names}) WHERE t.id = v.id", values)
+        if not success:
+            return False, message
+        updated += len(values)
+        last_id = rows[-1]["id"]
+        if verbose:
+            print(f"🌐 ipdr: IPv6 columns encoded on {updated:,} rows so far")
+    return True, f"Encoded IPv6 columns on {updated:,} existing IPDR rows"
@@ -0,0 +1,160 @@
+import ipaddress
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import IP_SERVICES_PATH
+from ip_index import cidr_to_range, encode_ipv4, encode_ipv6
+from range_lookup import RangeTable
+
+# IPDR address attributed, the encoded columns it is looked up by, and the columns it gets
+SERVICE_SOURCE = "destination_ip"
+SERVICE_COLUMN = "destination_service"
+ASN_COLUMN = "destination_asn"
+
+IP_SERVICES_DDL = [
+    f"ALTER TABLE ipdr ADD COLUMN IF NOT EXISTS {SERVICE_COLUMN} text",
+    f"ALTER TABLE ipdr ADD COLUMN IF NOT EXISTS {ASN_COLUMN} bigint",
+    # Serves per-app questions with and without the active case filter
+    f"CREATE INDEX IF NOT EXISTS idx_ipdr_{SERVICE_COLUMN} ON ipdr ({SERVICE_COLUMN}, case_id) "
+    f"WHERE {SERVICE_COLUMN} IS NOT NULL",
+]
+
+BACKFILL_PAGE_SIZE = 50000
+
+
+class IpServiceMap:
+    """
+    CIDR block -> (service, ASN) attribution over the integer-encoded IPDR addresses
+
+    IPv4 blocks are ranges of the _v4 column; IPv6 blocks of /64 or shorter are
+    ranges of the biased _v6_hi half (longer IPv6 prefixes are skipped). Blocks nest
+    or are disjoint, so the most specific block containing an address is the
+    innermost range of a RangeTable and whole columns resolve with searchsorted.
+    """
+
+    def __init__(self, dataset: pd.DataFrame):
+        """dataset: one row per block, with columns network (CIDR), service and optionally asn"""
+        bounds = {4: ([], [], []), 6: ([], [], [])}
+        services, asns = [], []
+        for network, service, asn in zip(dataset["network"], dataset["service"],
+                                         dataset["asn"] if "asn" in dataset.columns else [None] * len(dataset)):
+            try:
+                block = ipaddress.ip_network(str(network).strip(), strict=False)
+            except ValueError:
+                continue
+            if block.version == 6 and block.prefixlen > 64:
+                continue
+            limits = cidr_to_range(str(block))
+            low, high = (limits["low"], limits["high"]) if block.version == 4 else (limits["low"][0], limits["high"][0])
+            starts, ends, rows = bounds[block.version]
+            starts.append(low)
+            ends.append(high + 1)
+            rows.append(len(services))
+            services.append(None if pd.isna(service) else str(service).strip())
+            asn = pd.to_numeric(asn, errors="coerce")
+            asns.append(None if pd.isna(asn) else int(asn))
+
+        # A trailing None answers for "no block matched" (row -1)
+        self.services = np.array(services + [None], dtype=object)
+        self.asns = np.array(asns + [None], dtype=object)
+        self.tables = {version: (RangeTable(starts, ends), np.array(rows + [-1], dtype=np.int64))
+                       for version, (starts, ends, rows) in bounds.items()}
+
+    def _rows(self, version: int, values: pd.Series) -> np.ndarray:
+        table, rows = self.tables[version]
+        owners = table.lookup(values.to_numpy(dtype=np.int64, na_value=0))
+        owners[values.isna().to_numpy()] = -1
+        return rows[owners]
+
+    def attribute(self, v4: pd.Series, v6_hi: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """Service and ASN for each address, given its encoded _v4 / _v6_hi values (Int64)"""
+        rows = self._rows(4, v4)
+        rows = np.where(rows >= 0, rows, self._rows(6, v6_hi))
+        return pd.Series(self.services[rows], index=v4.index), pd.Series(self.asns[rows], index=v4.index)
+
+    def attribute_addresses(self, addresses: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """Service and ASN for textual IP addresses"""
+        hi, _ = encode_ipv6(addresses)
+        return self.attribute(encode_ipv4(addresses), hi)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "IpServiceMap":
+        return cls(pd.read_csv(path, dtype=str))
+
+    def __len__(self):
+        return len(self.services) - 1
+
+
+_ip_services = None
+_ip_services_mtime = None
+
+
+def get_ip_services(path: str = IP_SERVICES_PATH) -> Optional[IpServiceMap]:
+    """
+    Process-wide attribution map; None when the dataset file is not present
+
+    The dataset is updated offline by replacing the file, which is reloaded the next
+    time it is asked for after its modification time changes.
+    """
+    global _ip_services, _ip_services_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _ip_services
+    if _ip_services is None or mtime != _ip_services_mtime:
+        _ip_services, _ip_services_mtime = IpServiceMap.from_csv(path), mtime
+    return _ip_services
+
+
+class IpServiceStage:
+    """Ingest stage adding destination_service / destination_asn (after add_integer_ip_columns)"""
+
+    __name__ = "ip_services"
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        service_map = get_ip_services()
+        if service_map is None or f"{SERVICE_SOURCE}_v4" not in df.columns:
+            return df
+        df[SERVICE_COLUMN], df[ASN_COLUMN] = service_map.attribute(
+            df[f"{SERVICE_SOURCE}_v4"].astype("Int64"), df[f"{SERVICE_SOURCE}_v6_hi"].astype("Int64"))
+        return df
+
+
+def backfill_ip_services(supabase_handler, service_map: IpServiceMap, only_missing: bool = True,
+                         page_size: int = BACKFILL_PAGE_SIZE, verbose=False) -> Tuple[bool, str]:
+    """
+    Attribute existing IPDR rows, paging by id
+
+    only_missing=False re-attributes every row, for use after the dataset is updated;
+    rows whose attribution is unchanged are not rewritten.
+    """
+    v4, v6_hi = f"{SERVICE_SOURCE}_v4", f"{SERVICE_SOURCE}_v6_hi"
+    pending = f" AND {SERVICE_COLUMN} IS NULL" if only_missing else ""
+    updated, last_id = 0, 0
+    while True:
+        success, message, rows = supabase_handler.execute_raw_sql(
+            f"SELECT id, {v4}, {v6_hi} FROM ipdr WHERE id > %s{pending} "
+            f"AND ({v4} IS NOT NULL OR {v6_hi} IS NOT NULL) ORDER BY id LIMIT %s", (last_id, page_size))
+        if not success:
+            return False, message
+        if not rows:
+            break
+        page = pd.DataFrame(rows)
+        services, asns = service_map.attribute(page[v4].astype("Int64"), page[v6_hi].astype("Int64"))
+        keep = services.notna() if only_missing else pd.Series(True, index=page.index)
+        values = list(zip(page["id"][keep].tolist(), services[keep].tolist(), asns[keep].tolist()))
+        success, message, _ = supabase_handler.bulk_write(
+            f"UPDATE ipdr t SET {SERVICE_COLUMN} = v.service, {ASN_COLUMN} = v.asn::bigint "
+            f"FROM (VALUES %s) AS v (id, service, asn) WHERE t.id = v.id "
+            f"AND (t.{SERVICE_COLUMN} IS DISTINCT FROM v.service OR t.{ASN_COLUMN} IS DISTINCT FROM v.asn::bigint)",
+            values)
+        if not success:
+            return False, message
+        updated += len(values)
+        last_id = rows[-1]["id"]
+        if verbose:
+            print(f"🛰️ ipdr: {updated:,} rows attributed so far")
+    return True, f"Attributed {updated:,} existing IPDR rows"
@@ -0,0 +1,252 @@
+import sys
+import json
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from event_time import parse_datetimes, datetimes_to_seconds, to_epoch_seconds
+
+# Columns needed to rebuild public IP allocation windows from the ipdr table
+ALLOCATION_COLUMNS = [
+    "landline_msidn_mdn_leased_circuit_id", "imei", "imsi", "first_cell_id",
+    "translated_ip_address", "translated_port",
+    "start_date_of_public_ip_allocation", "ist_start_time_of_public_ip_allocation",
+    "end_date_of_public_ip_allocation", "ist_end_time_of_public_ip_allocation"
+]
+
+# Header names accepted for platform-provided log lines
+LOG_COLUMN_ALIASES = {
+    "ip": ["ip", "public_ip", "ip_address", "translated_ip_address", "source_ip"],
+    "port": ["port", "public_port", "translated_port", "source_port"],
+    "timestamp": ["timestamp", "datetime", "time", "date_time", "event_time"]
+}
+
+OPEN_ENDED = np.iinfo(np.int64).max
+NO_PORT = -1
+
+
+def _clean_port(ports: pd.Series) -> np.ndarray:
+    return pd.to_numeric(ports, errors="coerce").fillna(NO_PORT).astype(np.int64).values
+
+
+class _IntervalIndex:
+    """
+    Sorted start/end arrays for many keys packed into one searchable array
+
+    Rows are sorted by (key, start) and encoded as key_code << 32 | start, so a
+    single searchsorted resolves a whole batch of (key, timestamp) lookups.
+    """
+
+    def __init__(self, keys: pd.Series, starts: np.ndarray, ends: np.ndarray):
+        codes, uniques = pd.factorize(keys)
+        self.key_index = pd.Index(uniques)
+
+        order = np.lexsort((starts, codes))
+        self.rows = order
+        self.codes = codes[order].astype(np.int64)
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.composite = (self.codes << 32) + self.starts
+
+        # Running max of end per key - tells whether an earlier, longer window can still cover T
+        self.cover = pd.Series(self.ends).groupby(self.codes).cummax().values
+
+    def lookup(self, keys: pd.Series, timestamps: np.ndarray) -> np.ndarray:
+        """Return the matching allocation row for every lookup, or -1"""
+        if len(self.rows) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        q_codes = self.key_index.get_indexer(keys).astype(np.int64)
+        pos = np.searchsorted(self.composite, (q_codes << 32) + timestamps, side="right") - 1
+        safe = np.clip(pos, 0, None)
+
+        valid = (q_codes >= 0) & (timestamps >= 0) & (pos >= 0) & (self.codes[safe] == q_codes)
+        hit = valid & (self.ends[safe] >= timestamps)
+
+        # Overlapping windows are rare - walk back only where one may still match
+        for i in np.flatnonzero(valid & ~hit & (self.cover[safe] >= timestamps)):
+            j = pos[i] - 1
+            while j >= 0 and self.codes[j] == q_codes[i]:
+                if self.ends[j] >= timestamps[i]:
+                    safe[i] = j
+                    hit[i] = True
+                    break
+                j -= 1
+
+        return np.where(hit, self.rows[safe], -1)
+
+
+class NATAttributionEngine:
+    """Resolve (public IP, port, timestamp) tuples to the subscriber holding the allocation"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.allocations = pd.DataFrame(columns=ALLOCATION_COLUMNS)
+        self._by_ip_port = None
+        self._by_ip = None
+
+    def load_allocations(self, records: List[Dict]) -> int:
+        """Build the interval indexes from ipdr records"""
+        df = pd.DataFrame(records)
+        for column in ALLOCATION_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+
+        df = df[df["translated_ip_address"].notna()].reset_index(drop=True)
+        df["translated_ip_address"] = df["translated_ip_address"].astype(str).str.strip()
+
+        starts = to_epoch_seconds(df["start_date_of_public_ip_allocation"], df["ist_start_time_of_public_ip_allocation"])
+        ends = to_epoch_seconds(df["end_date_of_public_ip_allocation"], df["ist_end_time_of_public_ip_allocation"])
+
+        # Missing end means the allocation is still open; an end before the start crossed midnight
+        ends = np.where(ends < 0, OPEN_ENDED, ends)
+        ends = np.where(ends < starts, ends + 86400, ends)
+
+        keep = starts >= 0
+        df = df[keep].reset_index(drop=True)
+        starts, ends = starts[keep], ends[keep]
+        ports = _clean_port(df["translated_port"])
+
+        df["allocation_start"] = starts
+        df["allocation_end"] = ends
+        self.allocations = df
+
+        self._by_ip_port = _IntervalIndex(df["translated_ip_address"] + "|" + ports.astype(str), starts, ends)
+        self._by_ip = _IntervalIndex(df["translated_ip_address"], starts, ends)
+
+        if self.verbose:
+            print(f"📡 Indexed {len(df):,} public IP allocation windows")
+        return len(df)
+
+    def load_from_database(self, supabase_handler, ips: Optional[List[str]] = None) -> Tuple[bool, str]:
+        """Load allocation windows from ipdr (the handler's active case), optionally only for the given public IPs"""
+        sql = f"SELECT {', '.join(ALLOCATION_COLUMNS)} FROM ipdr WHERE translated_ip_address IS NOT NULL"
+        params = []
+        if ips:
+            sql += " AND translated_ip_address = ANY(%s)"
+            params.append(list(set(ips)))
+        # Raw SQL is not case-scoped automatically
+        if supabase_handler.active_case_id:
+            sql += " AND case_id = %s"
+            params.append(supabase_handler.active_case_id)
+
+        success, message, rows = supabase_handler.execute_raw_sql(sql, tuple(params) or None)
+        if not success:
+            return False, message
+
+        count = self.load_allocations(rows)
+        return True, f"Loaded {count} allocation windows"
+
+    def attribute(self, lookups: pd.DataFrame) -> pd.DataFrame:
+        """
+        Attribute a batch of lookups
+
+        Args:
+            lookups: DataFrame with 'ip', 'port' (optional) and 'timestamp' columns
+                (timestamps with a UTC offset or Z are converted to IST; naive ones are taken as IST)
+
+        Returns:
+            The lookups with msisdn, imei, imsi, cell and allocation window columns added
+        """
+        result = lookups.copy().reset_index(drop=True)
+        if self._by_ip is None:
+            raise ValueError("No allocation windows loaded")
+
+        ips = result["ip"].astype(str).str.strip()
+        ports = _clean_port(result["port"]) if "port" in result.columns else np.full(len(result), NO_PORT)
+        timestamps = datetimes_to_seconds(parse_datetimes(result["timestamp"]))
+
+        # Exact IP+port first, then whole-IP allocations without a port, then IP-only for portless lookups
+        matches = self._by_ip_port.lookup(ips + "|" + ports.astype(str), timestamps)
+        match_type = np.where(matches >= 0, "ip_port", None)
+
+        pending = (matches < 0) & (ports != NO_PORT)
+        if pending.any():
+            portless = self._by_ip_port.lookup(ips[pending] + "|" + str(NO_PORT), timestamps[pending])
+            matches[pending] = portless
+            match_type[pending] = np.where(portless >= 0, "ip_static", None)
+
+        pending = (matches < 0) & (ports == NO_PORT)
+        if pending.any():
+            ip_only = self._by_ip.lookup(ips[pending], timestamps[pending])
+            matches[pending] = ip_only
+            match_type[pending] = np.where(ip_only >= 0, "ip_only", None)
+
+        matched = self.allocations.reindex(matches)
+        result["msisdn"] = matched["landline_msidn_mdn_leased_circuit_id"].values
+        result["imei"] = matched["imei"].values
+        result["imsi"] = matched["imsi"].values
+        result["cell_id"] = matched["first_cell_id"].values
+        result["allocation_start"] = pd.to_datetime(matched["allocation_start"].values, unit="s", errors="coerce")
+        result["allocation_end"] = pd.to_datetime(
+            matched["allocation_end"].where(matched["allocation_end"] != OPEN_ENDED).values, unit="s", errors="coerce")
+        result["match_type"] = match_type
+        return result
+
+    def attribute_records(self, lookups: List[Dict]) -> List[Dict]:
+        """Attribute a list of {'ip', 'port', 'timestamp'} dictionaries"""
+        attributed = self.attribute(pd.DataFrame(lookups))
+        for column in ["allocation_start", "allocation_end"]:
+            attributed[column] = attributed[column].map(lambda v: v.isoformat() if pd.notna(v) else None)
+        attributed = attributed.astype(object).where(attributed.notna(), None)
+        return attributed.to_dict("records")
+
+    @staticmethod
+    def read_log_csv(file_path) -> pd.DataFrame:
+        """Read platform log lines and map their headers onto ip/port/timestamp"""
+        df = pd.read_csv(file_path, dtype=str)
+        normalized = {col.strip().lower().replace(" ", "_"): col for col in df.columns}
+
+        renames = {}
+        for target, aliases in LOG_COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in normalized:
+                    renames[normalized[alias]] = target
+                    break
+
+        df = df.rename(columns=renames)
+        missing = [col for col in ("ip", "timestamp") if col not in df.columns]
+        if missing:
+            raise ValueError(f"Log file is missing required columns: {', '.join(missing)}")
+        return df
+
+    def attribute_csv(self, input_path, output_path=None, supabase_handler=None) -> pd.DataFrame:
+        """Attribute every log line in a CSV, loading only the allocations for IPs it mentions"""
+        lookups = self.read_log_csv(input_path)
+
+        if supabase_handler is not None:
+            success, message = self.load_from_database(supabase_handler, lookups["ip"].dropna().str.strip().tolist())
+            if not success:
+                raise RuntimeError(message)
+
+        result = self.attribute(lookups)
+        if output_path:
+            result.to_csv(output_path, index=False)
+
+        if self.verbose:
+            resolved = int(result["match_type"].notna().sum())
+            print(f"✅ Attributed {resolved:,}/{len(result):,} log lines")
+        return result
+
+
+def main():
+    """Attribute a CSV of platform log lines from the command line"""
+    if len(sys.argv) < 2:
+        print("Usage: python nat_attribution.py <log_lines.csv> [output.csv]")
+        return
+
+    from supabase_handler import SupabaseHandler
+
+    input_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else str(Path(input_path).with_name(Path(input_path).stem + "_attributed.csv"))
+
+    engine = NATAttributionEngine(verbose=True)
+    result = engine.attribute_csv(input_path, output_path, supabase_handler=SupabaseHandler(verbose=True))
+    print(json.dumps(result.head(5).astype(str).to_dict("records"), indent=2))
+    print(f"📄 Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
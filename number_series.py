@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import DEFAULT_COUNTRY_CODE, NATIONAL_NUMBER_LENGTH, NUMBER_SERIES_PATH
+from phone_numbers import PHONE_NUMBER_COLUMNS, e164_keys
+from range_lookup import RangeTable
+
+# Number column enriched per table and the columns it gets
+SERIES_COLUMNS = {
+    "crd": ("b_party", "b_party_operator", "b_party_circle"),
+    "tower_dumps": ("b_party", "b_party_operator", "b_party_circle"),
+}
+
+NUMBER_SERIES_DDL = []
+for _table, (_source, _operator, _circle) in SERIES_COLUMNS.items():
+    NUMBER_SERIES_DDL += [
+        f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS {_operator} text",
+        f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS {_circle} text",
+    ]
+
+BACKFILL_PAGE_SIZE = 50000
+
+
+class NumberSeries:
+    """
+    MSISDN series -> (operator, circle) lookup over E.164 number keys
+
+    Every series prefix covers a contiguous range of full-length national numbers,
+    so the longest matching prefix is the innermost range in a RangeTable.
+    """
+
+    def __init__(self, series: pd.DataFrame, country_code: str = DEFAULT_COUNTRY_CODE,
+                 national_length: int = NATIONAL_NUMBER_LENGTH):
+        """series: one row per national-number prefix, with columns prefix, operator, circle"""
+        self.country_code = country_code
+        self.national_length = national_length
+
+        prefixes = series["prefix"].astype(str).str.replace(r"\D", "", regex=True)
+        series = series.assign(prefix=prefixes)
+        series = series[(prefixes.str.len() > 0) & (prefixes.str.len() <= national_length)]
+        series = series.drop_duplicates("prefix", keep="last")
+
+        self.operators = np.array(series["operator"].fillna("").astype(str).tolist() + [None], dtype=object)
+        self.circles = np.array(series["circle"].fillna("").astype(str).tolist() + [None], dtype=object)
+        bounds = [self._range(prefix) for prefix in series["prefix"]]
+        self.ranges = RangeTable([start for start, _ in bounds], [end for _, end in bounds])
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        scale = 10 ** (self.national_length - len(prefix))
+        base = int(self.country_code) * 10 ** self.national_length
+        return base + int(prefix) * scale, base + (int(prefix) + 1) * scale
+
+    def lookup(self, keys: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """Operator and circle for each E.164 key (Int64); None where no series matches"""
+        owners = self.ranges.lookup(keys.to_numpy(dtype=np.int64, na_value=-1))
+        return (pd.Series(self.operators[owners], index=keys.index),
+                pd.Series(self.circles[owners], index=keys.index))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "NumberSeries":
+        return cls(pd.read_csv(path, dtype=str))
+
+    def __len__(self):
+        return len(self.operators) - 1
+
+
+_number_series = None
+
+
+def get_number_series(path: str = NUMBER_SERIES_PATH) -> Optional[NumberSeries]:
+    """Process-wide series table, loaded once; None when the series file is not present"""
+    global _number_series
+    if _number_series is None and Path(path).is_file():
+        _number_series = NumberSeries.from_csv(path)
+    return _number_series
+
+
+class NumberSeriesStage:
+    """Ingest stage adding operator and circle columns for a table's number column"""
+
+    def __init__(self, table_name: str, series: NumberSeries):
+        self.series = series
+        self.source, self.operator, self.circle = SERIES_COLUMNS[table_name]
+        # Reuse the key the phone number stage already computed
+        self.key = PHONE_NUMBER_COLUMNS.get(table_name, {}).get(self.source)
+        self.__name__ = f"number_series[{table_name}]"
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.source not in df.columns:
+            return df
+        keys = df[self.key].astype("Int64") if self.key in df.columns else e164_keys(df[self.source])
+        df[self.operator], df[self.circle] = self.series.lookup(keys)
+        return df
+
+
+def backfill_number_series(supabase_handler, series: NumberSeries, page_size: int = BACKFILL_PAGE_SIZE,
+                           verbose=False) -> Tuple[bool, str]:
+    """Set operator/circle on existing rows, paging through each table by id"""
+    updated = 0
+    for table_name, (source, operator, circle) in SERIES_COLUMNS.items():
+        key = PHONE_NUMBER_COLUMNS[table_name][source]
+        last_id = 0
+        while True:
+            success, message, rows = supabase_handler.execute_raw_sql(
+                f"SELECT id, {key} FROM {table_name} WHERE id > %s AND {operator} IS NULL "
+                f"AND {key} IS NOT NULL ORDER BY id LIMIT %s", (last_id, page_size))
+            if not success:
+                return False, message
+            if not rows:
+                break
+            page = pd.DataFrame(rows)
+            operators, circles = series.lookup(page[key].astype("Int64"))
+            matched = operators.notna()
+            values = list(zip(page["id"][matched].tolist(), operators[matched].tolist(), circles[matched].tolist()))
+            success, message, _ = supabase_handler.bulk_write(
+                f"UPDATE {table_name} t SET {operator} = v.operator, {circle} = v.circle "
+                f"FROM (VALUES %s) AS v (id, operator, circle) WHERE t.id = v.id", values)
+            if not success:
+                return False, message
+            updated += len(values)
+            last_id = rows[-1]["id"]
+            if verbose:
+                print(f"📶 {table_name}: operator/circle set on {updated:,} rows so far")
+    return True, f"Set operator/circle on {updated:,} existing rows"
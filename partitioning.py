@@ -0,0 +1,268 @@
+import re
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from event_time import EVENT_TIME_COLUMNS
+
+# Evidence tables range-partitioned by month on event_ts
+PARTITIONED_TABLES = list(EVENT_TIME_COLUMNS)
+
+# Months created ahead of today so live loads never land in the default partition
+FUTURE_MONTHS = 3
+
+_PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+_UNIQUE_INDEX = re.compile(r"^CREATE UNIQUE INDEX (\S+) ON (\S+) USING (\w+) \((.*)\)$")
+
+
+def partitioned_index(indexdef: str) -> str:
+    """
+    The definition to recreate an index with on the partitioned table
+
+    Unique indexes (the primary key included) must contain the partition key, so
+    event_ts is appended to their columns: the id primary key becomes (id, event_ts).
+    """
+    match = _UNIQUE_INDEX.match(indexdef)
+    if not match:
+        return indexdef
+    name, table, method, columns = match.groups()
+    if "event_ts" not in [column.strip() for column in columns.split(",")]:
+        columns += ", event_ts"
+    return f"CREATE UNIQUE INDEX {name} ON {table} USING {method} ({columns})"
+
+
+def partition_id_index(partition: str) -> str:
+    """
+    Unique id within one partition
+
+    With event_ts in the parent's key, this is what still rejects a repeated id -
+    rows without an event_ts all share the default partition.
+    """
+    return f"CREATE UNIQUE INDEX IF NOT EXISTS {partition}_id_key ON {partition} (id)"
+
+
+def month_start(value) -> date:
+    """First day of the month for a date, datetime or 'YYYY-MM...' string"""
+    if isinstance(value, str):
+        return date(int(value[:4]), int(value[5:7]), 1)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+class PartitionManager:
+    """
+    Convert evidence tables to monthly range partitions on event_ts and keep them topped up
+
+    Rows without an event_ts, or for months without a partition yet, fall into
+    <table>_default. Creating a month later moves its rows out of the default
+    partition before attaching, so partitions can be added at any time.
+    """
+
+    def __init__(self, supabase_handler, verbose=False):
+        self.handler = supabase_handler
+        self.verbose = verbose
+        self._partitioned: Dict[str, bool] = {}
+        self._months: Dict[str, Set[date]] = {}
+
+    def is_partitioned(self, table: str) -> bool:
+        if table not in self._partitioned:
+            success, _, rows = self.handler.execute_raw_sql(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+            self._partitioned[table] = success and bool(rows)
+        return self._partitioned[table]
+
+    def existing_months(self, table: str) -> Set[date]:
+        if table not in self._months:
+            success, _, rows = self.handler.execute_raw_sql(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s)", (table,))
+            months = set()
+            for row in rows if success else []:
+                match = _PARTITION_NAME.search(row["relname"])
+                if match:
+                    months.add(date(int(match.group(1)), int(match.group(2)), 1))
+            self._months[table] = months
+        return self._months[table]
+
+    def _partition_statements(self, table: str, month: date) -> List[Tuple[str, Optional[tuple]]]:
+        """Create one month, moving any rows already parked in the default partition"""
+        name = partition_name(table, month)
+        bounds = (month, add_months(month, 1))
+        return [
+            (f"CREATE TABLE IF NOT EXISTS {name} (LIKE {table} INCLUDING DEFAULTS)", None),
+            (partition_id_index(name), None),
+            (f"WITH moved AS (DELETE FROM {table}_default WHERE event_ts >= %s AND event_ts < %s RETURNING *) "
+             f"INSERT INTO {name} SELECT * FROM moved", bounds),
+            (f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds),
+        ]
+
+    def ensure_months(self, table: str, months: Iterable[date]) -> Tuple[bool, str]:
+        """Create any missing monthly partitions"""
+        missing = sorted(set(months) - self.existing_months(table))
+        if not missing:
+            return True, "All partitions present"
+
+        for month in missing:
+            success, message = self.handler.execute_transaction(self._partition_statements(table, month))
+            if not success:
+                return False, f"{partition_name(table, month)}: {message}"
+            self._months[table].add(month)
+
+        if self.verbose:
+            print(f"🗂️ Created {len(missing)} partition(s) for {table}: {', '.join(partition_name(table, m) for m in missing)}")
+        return True, f"Created {len(missing)} partition(s)"
+
+    def ensure_for_records(self, table: str, data: List[Dict]) -> Tuple[bool, str]:
+        """Make sure every month a batch touches has its own partition before inserting"""
+        if table not in PARTITIONED_TABLES or not self.is_partitioned(table):
+            return True, "Table not partitioned"
+
+        months = set()
+        for record in data:
+            value = record.get("event_ts")
+            if value:
+                months.add(month_start(value))
+        return self.ensure_months(table, months)
+
+    def ensure_future(self, table: str, months_ahead: int = FUTURE_MONTHS) -> Tuple[bool, str]:
+        current = month_start(date.today())
+        return self.ensure_months(table, [add_months(current, i) for i in range(months_ahead + 1)])
+
+    def _conversion_statements(self, table: str) -> Tuple[bool, str, List[Tuple[str, Optional[tuple]]]]:
+        """Build the single transaction that swaps a plain table for a partitioned one"""
+        legacy = f"{table}_unpartitioned"
+
+        success, message, indexes = self.handler.execute_raw_sql(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s", (table,))
+        if not success:
+            return False, message, []
+        success, message, grants = self.handler.execute_raw_sql(
+            "SELECT grantee, privilege_type FROM information_schema.role_table_grants "
+            "WHERE table_schema = current_schema() AND table_name = %s", (table,))
+        if not success:
+            return False, message, []
+        success, message, policies = self.handler.execute_raw_sql(
+            "SELECT policyname, permissive, roles, cmd, qual, with_check FROM pg_policies "
+            "WHERE schemaname = current_schema() AND tablename = %s", (table,))
+        if not success:
+            return False, message, []
+        success, message, meta = self.handler.execute_raw_sql(
+            "SELECT pg_get_serial_sequence(%s, 'id') AS sequence, "
+            "(SELECT a.attidentity FROM pg_attribute a WHERE a.attrelid = to_regclass(%s) AND a.attname = 'id') AS identity, "
+            "(SELECT c.relrowsecurity FROM pg_class c WHERE c.oid = to_regclass(%s)) AS rls",
+            (table, table, table))
+        if not success or not meta:
+            return False, message, []
+        meta = meta[0]
+        # Identity columns get a fresh sequence from INCLUDING IDENTITY; serial sequences are re-owned
+        serial_sequence = meta["sequence"] if meta["sequence"] and not meta["identity"] else None
+
+        statements = [
+            (f"ALTER TABLE {table} RENAME TO {legacy}", None),
+            (f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE (event_ts)", None),
+            (f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT", None),
+            (partition_id_index(f"{table}_default"), None),
+        ]
+
+        # One partition per month that actually holds rows; ensure_future adds the months ahead
+        statements.append((
+            f"DO $$ DECLARE m date; BEGIN "
+            f"FOR m IN SELECT DISTINCT date_trunc('month', event_ts)::date FROM {legacy} WHERE event_ts IS NOT NULL LOOP "
+            f"EXECUTE format('CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)', "
+            f"'{table}_p' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date); "
+            f"EXECUTE format('CREATE UNIQUE INDEX %I ON %I (id)', "
+            f"'{table}_p' || to_char(m, 'YYYY_MM') || '_id_key', '{table}_p' || to_char(m, 'YYYY_MM')); "
+            f"END LOOP; END $$", None))
+        statements.append((f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {legacy}", None))
+
+        # Serial sequences are owned by the old column and would be dropped with it
+        if serial_sequence:
+            statements.append((f"ALTER SEQUENCE {serial_sequence} OWNED BY NONE", None))
+
+        # Index names are schema-wide, so the old table (and its indexes) must go before they are recreated
+        statements.append((f"DROP TABLE {legacy}", None))
+        if serial_sequence:
+            statements.append((f"ALTER SEQUENCE {serial_sequence} OWNED BY {table}.id", None))
+        if meta["sequence"]:
+            statements.append((
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT max(id) FROM {table}), 1))", None))
+
+        # The primary key and other unique indexes are recreated with event_ts appended
+        for index in indexes:
+            statements.append((partitioned_index(index["indexdef"]), None))
+
+        for grant in grants:
+            grantee = grant["grantee"] if grant["grantee"] == "PUBLIC" else f'"{grant["grantee"]}"'
+            statements.append((f'GRANT {grant["privilege_type"]} ON {table} TO {grantee}', None))
+
+        if meta["rls"]:
+            statements.append((f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY", None))
+        for policy in policies:
+            roles = policy["roles"] if isinstance(policy["roles"], list) else str(policy["roles"]).strip("{}").split(",")
+            sql = (f'CREATE POLICY "{policy["policyname"]}" ON {table} AS {policy["permissive"]} '
+                   f'FOR {policy["cmd"]} TO {", ".join(roles)}')
+            if policy["qual"]:
+                sql += f" USING ({policy['qual']})"
+            if policy["with_check"]:
+                sql += f" WITH CHECK ({policy['with_check']})"
+            statements.append((sql, None))
+
+        return True, "ok", statements
+
+    def convert_table(self, table: str) -> Tuple[bool, str]:
+        """Rebuild a table as monthly partitions on event_ts, atomically"""
+        if self.is_partitioned(table):
+            return True, f"{table} is already partitioned"
+
+        success, message, statements = self._conversion_statements(table)
+        if not success:
+            return False, message
+
+        success, message = self.handler.execute_transaction(statements)
+        if not success:
+            return False, f"{table}: {message}"
+
+        self._partitioned.pop(table, None)
+        self._months.pop(table, None)
+        if self.verbose:
+            print(f"🗂️ Converted {table} to monthly partitions on event_ts")
+        return True, f"{table} converted"
+
+    def ensure_keys(self, table: str) -> Tuple[bool, str]:
+        """
+        Give a table partitioned before the key was kept its unique (id, event_ts) index
+        and per-partition unique ids (the conversion used to recreate the key as a plain index)
+        """
+        if not self.is_partitioned(table):
+            return True, "Table not partitioned"
+        success, message, rows = self.handler.execute_raw_sql(
+            "SELECT 1 FROM pg_index WHERE indrelid = to_regclass(%s) AND indisunique", (table,))
+        if not success:
+            return False, message
+
+        partitions = [partition_name(table, month) for month in sorted(self.existing_months(table))]
+        statements = [(partition_id_index(name), None) for name in partitions + [f"{table}_default"]]
+        if not rows:
+            statements.append((f"CREATE UNIQUE INDEX {table}_id_event_ts_key ON {table} (id, event_ts)", None))
+        success, message = self.handler.execute_transaction(statements)
+        return success, message if success else f"{table}: {message}"
+
+    def provision(self, months_ahead: int = FUTURE_MONTHS) -> Tuple[bool, List[str]]:
+        """Convert every evidence table and create the upcoming months"""
+        errors = []
+        for table in PARTITIONED_TABLES:
+            for step in (lambda: self.convert_table(table), lambda: self.ensure_keys(table),
+                         lambda: self.ensure_future(table, months_ahead)):
+                success, message = step()
+                if not success:
+                    errors.append(message)
+                    break
+        return len(errors) == 0, errors
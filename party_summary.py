@@ -0,0 +1,207 @@
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import PARTY_SUMMARY_TOP_CELLS
+from event_time import record_times
+from phone_numbers import e164_keys
+
+PARTY_SUMMARY_TABLE = "party_summary"
+
+# Text older loads stored for missing identifiers (str(None), str(nan)); never a real number or IMEI
+PLACEHOLDER_IDENTIFIERS = ("none", "null", "nan")
+_PLACEHOLDERS_SQL = ", ".join(f"'{p}'" for p in PLACEHOLDER_IDENTIFIERS)
+
+SUMMARY_COLUMNS = ["case_id", "party", "total_calls", "total_duration", "first_seen", "last_seen",
+                   "contacts", "cell_counts", "imeis", "imsis"]
+
+# Merge helpers are IMMUTABLE so the derived columns below can be generated from them
+PARTY_SUMMARY_DDL = [
+    """CREATE OR REPLACE FUNCTION summary_merge_counts(a jsonb, b jsonb) RETURNS jsonb
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(jsonb_object_agg(key, total), '{}'::jsonb) FROM (
+        SELECT key, sum(value::bigint) AS total FROM (
+            SELECT * FROM jsonb_each_text(coalesce(a, '{}'::jsonb))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(coalesce(b, '{}'::jsonb))
+        ) counts GROUP BY key
+    ) totals
+$$""",
+    """CREATE OR REPLACE FUNCTION summary_top_counts(counts jsonb, k integer) RETURNS jsonb
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(jsonb_agg(jsonb_build_object('value', key, 'count', value::bigint)
+                              ORDER BY value::bigint DESC, key), '[]'::jsonb)
+    FROM (SELECT key, value FROM jsonb_each_text(coalesce(counts, '{}'::jsonb))
+          ORDER BY value::bigint DESC, key LIMIT k) top
+$$""",
+    """CREATE OR REPLACE FUNCTION summary_merge_distinct(a text[], b text[]) RETURNS text[]
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(array_agg(DISTINCT v ORDER BY v), '{}'::text[])
+    FROM unnest(coalesce(a, '{}'::text[]) || coalesce(b, '{}'::text[])) v WHERE v IS NOT NULL
+$$""",
+    f"""CREATE TABLE IF NOT EXISTS {PARTY_SUMMARY_TABLE} (
+        case_id text NOT NULL DEFAULT '',
+        party text NOT NULL,
+        total_calls bigint NOT NULL DEFAULT 0,
+        total_duration bigint NOT NULL DEFAULT 0,
+        first_seen timestamp,
+        last_seen timestamp,
+        contacts text[] NOT NULL DEFAULT '{{}}',
+        distinct_contacts integer GENERATED ALWAYS AS (cardinality(contacts)) STORED,
+        cell_counts jsonb NOT NULL DEFAULT '{{}}',
+        top_cells jsonb GENERATED ALWAYS AS (summary_top_counts(cell_counts, {PARTY_SUMMARY_TOP_CELLS})) STORED,
+        imeis text[] NOT NULL DEFAULT '{{}}',
+        imei_count integer GENERATED ALWAYS AS (cardinality(imeis)) STORED,
+        imsis text[] NOT NULL DEFAULT '{{}}',
+        imsi_count integer GENERATED ALWAYS AS (cardinality(imsis)) STORED,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (case_id, party)
+    )""",
+    # Profile lookups without an active case go by party alone
+    f"CREATE INDEX IF NOT EXISTS idx_{PARTY_SUMMARY_TABLE}_party ON {PARTY_SUMMARY_TABLE} (party)",
+]
+
+# Additive merge: counts add up, sets union, the time range widens
+PARTY_SUMMARY_UPSERT = f"""INSERT INTO {PARTY_SUMMARY_TABLE} ({', '.join(SUMMARY_COLUMNS)})
+SELECT case_id, party, total_calls, total_duration, first_seen::timestamp, last_seen::timestamp,
+       contacts::text[], cell_counts::jsonb, imeis::text[], imsis::text[]
+FROM (VALUES %s) AS batch ({', '.join(SUMMARY_COLUMNS)})
+ON CONFLICT (case_id, party) DO UPDATE SET
+    total_calls = {PARTY_SUMMARY_TABLE}.total_calls + EXCLUDED.total_calls,
+    total_duration = {PARTY_SUMMARY_TABLE}.total_duration + EXCLUDED.total_duration,
+    first_seen = LEAST({PARTY_SUMMARY_TABLE}.first_seen, EXCLUDED.first_seen),
+    last_seen = GREATEST({PARTY_SUMMARY_TABLE}.last_seen, EXCLUDED.last_seen),
+    contacts = summary_merge_distinct({PARTY_SUMMARY_TABLE}.contacts, EXCLUDED.contacts),
+    cell_counts = summary_merge_counts({PARTY_SUMMARY_TABLE}.cell_counts, EXCLUDED.cell_counts),
+    imeis = summary_merge_distinct({PARTY_SUMMARY_TABLE}.imeis, EXCLUDED.imeis),
+    imsis = summary_merge_distinct({PARTY_SUMMARY_TABLE}.imsis, EXCLUDED.imsis),
+    updated_at = now()"""
+
+# Summaries built before parties were keyed by E.164 number are dropped, so the backfill rebuilds them
+PARTY_SUMMARY_REKEY = f"""DELETE FROM {PARTY_SUMMARY_TABLE} WHERE EXISTS (
+    SELECT 1 FROM {PARTY_SUMMARY_TABLE} p
+    WHERE e164_key(p.party)::text <> p.party
+       OR EXISTS (SELECT 1 FROM unnest(p.contacts) v WHERE e164_key(v)::text <> v))"""
+
+# One-off build from existing crd rows; only runs while the summary is still empty
+PARTY_SUMMARY_BACKFILL = f"""WITH calls AS (
+    SELECT coalesce(case_id, '') AS case_id, coalesce(a_party_e164::text, a_party::text) AS party,
+           coalesce(b_party_e164::text, b_party::text) AS contact,
+           duration, event_ts, first_cell_id_a AS cell, imei_a::text AS imei, imsi_a::text AS imsi
+    FROM crd WHERE a_party IS NOT NULL
+), cells AS (
+    SELECT case_id, party, jsonb_object_agg(cell, n) AS cell_counts
+    FROM (SELECT case_id, party, cell, count(*) AS n FROM calls WHERE cell IS NOT NULL GROUP BY 1, 2, 3) c
+    GROUP BY 1, 2
+)
+INSERT INTO {PARTY_SUMMARY_TABLE} ({', '.join(SUMMARY_COLUMNS)})
+SELECT calls.case_id, calls.party, count(*), coalesce(sum(duration), 0), min(event_ts), max(event_ts),
+       coalesce(array_agg(DISTINCT contact ORDER BY contact) FILTER (WHERE contact IS NOT NULL), '{{}}'),
+       coalesce(max(cells.cell_counts::text)::jsonb, '{{}}'),
+       coalesce(array_agg(DISTINCT imei ORDER BY imei) FILTER (WHERE imei IS NOT NULL), '{{}}'),
+       coalesce(array_agg(DISTINCT imsi ORDER BY imsi) FILTER (WHERE imsi IS NOT NULL), '{{}}')
+FROM calls LEFT JOIN cells USING (case_id, party)
+WHERE NOT EXISTS (SELECT 1 FROM {PARTY_SUMMARY_TABLE})
+GROUP BY calls.case_id, calls.party"""
+
+# Drops the 'None' parties and contacts/IMEIs/IMSIs built from placeholder text before loads stopped storing it
+PARTY_SUMMARY_CLEANUP = [
+    f"DELETE FROM {PARTY_SUMMARY_TABLE} WHERE lower(party) IN ({_PLACEHOLDERS_SQL})",
+    f"""UPDATE {PARTY_SUMMARY_TABLE} SET
+    contacts = ARRAY(SELECT v FROM unnest(contacts) v WHERE lower(v) NOT IN ({_PLACEHOLDERS_SQL}) ORDER BY v),
+    imeis = ARRAY(SELECT v FROM unnest(imeis) v WHERE lower(v) NOT IN ({_PLACEHOLDERS_SQL}) ORDER BY v),
+    imsis = ARRAY(SELECT v FROM unnest(imsis) v WHERE lower(v) NOT IN ({_PLACEHOLDERS_SQL}) ORDER BY v)
+WHERE EXISTS (SELECT 1 FROM unnest(contacts || imeis || imsis) v WHERE lower(v) IN ({_PLACEHOLDERS_SQL}))""",
+]
+
+SOURCE_COLUMNS = ["case_id", "a_party", "b_party", "duration", "first_cell_id_a", "imei_a", "imsi_a"]
+
+
+def identifier_text(values: pd.Series) -> pd.Series:
+    """Numbers/IMEIs as text, without the '.0' a float column leaves behind; blanks and placeholders become NaN"""
+    text = values.astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
+    return text.where(values.notna() & (text != "") & ~text.str.lower().isin(PLACEHOLDER_IDENTIFIERS))
+
+
+def number_keys(values: pd.Series) -> pd.Series:
+    """Numbers as E.164 text (the *_e164 key), so +91 / 0-prefixed and bare forms meet; others as identifier_text"""
+    keys = e164_keys(values)
+    return keys.astype(str).where(keys.notna(), identifier_text(values))
+
+
+class PartySummarizer:
+    """
+    Maintain party_summary (one row per case and A-party) from CDR loads
+
+    Parties and contacts are keyed by number_keys, the same E.164 text the *_e164
+    columns hold, so every spelling of a number lands on one row.
+
+    Each loaded batch is reduced with vectorized group-bys to one partial summary per
+    party, which is merged into the table with an additive upsert - rows already in
+    crd are never re-read.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def summarize(self, records: List[Dict]) -> pd.DataFrame:
+        """Partial summaries (SUMMARY_COLUMNS) for one batch of crd records"""
+        df = pd.DataFrame(records)
+        for column in SOURCE_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+
+        seen = record_times(df, "crd")
+        batch = pd.DataFrame({
+            "case_id": df["case_id"].where(df["case_id"].notna(), "").astype(str),
+            "party": number_keys(df["a_party"]),
+            "contact": number_keys(df["b_party"]),
+            "duration": pd.to_numeric(df["duration"], errors="coerce").fillna(0).astype(np.int64),
+            "seen": seen,
+            "cell": df["first_cell_id_a"].astype(str).str.strip().where(df["first_cell_id_a"].notna()),
+            "imei": identifier_text(df["imei_a"]),
+            "imsi": identifier_text(df["imsi_a"]),
+        })
+        batch = batch[batch["party"].notna()]
+        if batch.empty:
+            return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+        keys = ["case_id", "party"]
+        grouped = batch.groupby(keys, sort=False)
+        summary = grouped.agg(
+            total_calls=("party", "size"),
+            total_duration=("duration", "sum"),
+            first_seen=("seen", "min"),
+            last_seen=("seen", "max"),
+        )
+        for column, target in (("contact", "contacts"), ("imei", "imeis"), ("imsi", "imsis")):
+            distinct = batch.dropna(subset=[column]).drop_duplicates(keys + [column])
+            summary[target] = distinct.groupby(keys)[column].agg(sorted)
+
+        cells = batch.dropna(subset=["cell"]).groupby(keys + ["cell"]).size()
+        summary["cell_counts"] = cells.groupby(level=keys).agg(
+            lambda counts: json.dumps({cell: int(n) for cell, n in zip(counts.index.get_level_values("cell"), counts)}))
+
+        summary = summary.reset_index()
+        for column in ("contacts", "imeis", "imsis"):
+            summary[column] = summary[column].apply(lambda v: v if isinstance(v, list) else [])
+        summary["cell_counts"] = summary["cell_counts"].fillna("{}")
+        return summary[SUMMARY_COLUMNS]
+
+    def merge(self, supabase_handler, records: List[Dict]) -> Tuple[bool, str]:
+        """Fold one batch of crd records into party_summary"""
+        summary = self.summarize(records)
+        if summary.empty:
+            return True, "No parties to summarize"
+
+        values = [tuple(None if v is pd.NaT or (not isinstance(v, list) and pd.isna(v))
+                        else (v.to_pydatetime() if isinstance(v, pd.Timestamp) else v)
+                        for v in row)
+                  for row in summary.astype(object).itertuples(index=False, name=None)]
+
+        success, message, _ = supabase_handler.bulk_write(PARTY_SUMMARY_UPSERT, values)
+        if success and self.verbose:
+            print(f"📇 Party summary: merged {len(values):,} parties from {len(records):,} calls")
+        return success, message
@@ -0,0 +1,243 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import POL_ANOMALY_THRESHOLD, POL_MAX_DAYS, POL_MAX_GAP_DAYS, POL_MIN_DAYS, POL_MIN_EVENTS
+
+ACTIVITY_KINDS = ["calls", "sms", "data"]
+
+# Tables the profiles are derived from; a write to either invalidates a case's cached profile
+SOURCE_TABLES = ["crd", "ipdr"]
+
+# Events per party, day and hour. Parties are identified by E.164 key where one exists,
+# so a subscriber's CDRs and IPDR sessions land on the same profile.
+ACTIVITY_SQL = """SELECT party, kind, day, hour, count(*) AS events FROM (
+    SELECT coalesce(a_party_e164::text, a_party::text) AS party,
+           CASE WHEN upper(call_type) LIKE 'SMS%%' THEN 'sms' ELSE 'calls' END AS kind,
+           event_ts::date AS day, extract(hour FROM event_ts)::int AS hour
+    FROM crd WHERE event_ts IS NOT NULL AND a_party IS NOT NULL{case_filter}
+    UNION ALL
+    SELECT coalesce(msisdn_e164::text, landline_msidn_mdn_leased_circuit_id::text), 'data',
+           event_ts::date, extract(hour FROM event_ts)::int
+    FROM ipdr WHERE event_ts IS NOT NULL AND landline_msidn_mdn_leased_circuit_id IS NOT NULL{case_filter}
+) events{party_filter} GROUP BY 1, 2, 3, 4"""
+
+# Parties scored together are laid out as a dense (party, day, hour) block of at most this many cells
+SCORING_CHUNK_CELLS = 4_000_000
+
+# MAD of normally distributed data is 0.6745 sigma; mean absolute deviation is 0.7979 sigma
+MAD_SCALE = 1.4826
+MEAN_AD_SCALE = 1.2533
+
+
+def deviation_scores(values: np.ndarray, axis: int, method: str = "mad",
+                     counts: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (scores, baselines) of every value against the others along an axis; NaN values are ignored
+
+    "mad" is the robust modified z-score around the median, with the spread taken as the
+    larger of the MAD and mean absolute deviation estimates so that activity which is
+    zero on most days does not collapse it; "zscore" uses the mean and standard deviation. For event counts the spread is never taken below the
+    Poisson noise of the baseline, nor below one event.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if method == "zscore":
+            baseline = np.nanmean(values, axis=axis, keepdims=True)
+            spread = np.nanstd(values, axis=axis, keepdims=True)
+        else:
+            baseline = np.nanmedian(values, axis=axis, keepdims=True)
+            deviation = np.abs(values - baseline)
+            spread = np.maximum(MAD_SCALE * np.nanmedian(deviation, axis=axis, keepdims=True),
+                                MEAN_AD_SCALE * np.nanmean(deviation, axis=axis, keepdims=True))
+        if counts:
+            spread = np.maximum(spread, np.sqrt(np.maximum(baseline, 1.0)))
+        scores = np.where(spread > 0, (values - baseline) / spread, 0.0)
+    return np.nan_to_num(scores), np.broadcast_to(baseline, values.shape)
+
+
+class PatternOfLife:
+    """
+    Per-party 7x24 activity matrices (calls, SMS, data sessions) and anomaly scoring for a case
+
+    Counts are aggregated per party/day/hour in the database. The weekday x hour
+    matrices are summed straight from those rows with numpy.bincount; for scoring, the
+    parties are laid out as (party, day, hour) blocks of at most SCORING_CHUNK_CELLS
+    cells, so memory does not grow with parties x days. A day (its total) or an hour
+    (against the same hour on the party's other days) is flagged when it deviates from
+    the party's own baseline by POL_ANOMALY_THRESHOLD. Days outside the case's main
+    span of activity (see POL_MAX_GAP_DAYS / POL_MAX_DAYS) are left out. Whole-case
+    profiles are cached per case until crd or ipdr is written to.
+    """
+
+    def __init__(self, threshold: float = POL_ANOMALY_THRESHOLD, min_events: int = POL_MIN_EVENTS,
+                 min_days: int = POL_MIN_DAYS, method: str = "mad", verbose=False):
+        self.threshold = threshold
+        self.min_events = min_events
+        self.min_days = min_days
+        self.method = method
+        self.verbose = verbose
+        self._profiles: Dict[str, Tuple[Dict[str, tuple], Dict]] = {}
+        self._lock = threading.Lock()
+
+    def profile(self, supabase_handler, parties: Optional[Iterable[str]] = None) -> Tuple[bool, str, Dict]:
+        """
+        Matrices and anomalies for the handler's active case (or all data without one)
+
+        parties (profile keys - E.164 numbers where the number normalizes) limits the
+        profile to those parties; only their activity is read unless the whole case is
+        already cached.
+        """
+        case_id = supabase_handler.active_case_id or ""
+        versions = supabase_handler.table_versions(SOURCE_TABLES)
+        wanted = sorted(set(parties)) if parties is not None else None
+        with self._lock:
+            cached = self._profiles.get(case_id)
+        if cached is not None and versions is not None and cached[0] == versions:
+            return True, "Served from pattern-of-life cache", self._subset(cached[1], wanted)
+
+        # Raw SQL is not case-scoped automatically
+        sql = ACTIVITY_SQL.format(case_filter=" AND case_id = %(case_id)s" if case_id else "",
+                                  party_filter=" WHERE party = ANY(%(parties)s)" if wanted is not None else "")
+        success, message, rows = supabase_handler.execute_raw_sql(sql, {"case_id": case_id, "parties": wanted})
+        if not success:
+            return False, message, {}
+
+        result = self.build(pd.DataFrame(rows, columns=["party", "kind", "day", "hour", "events"]))
+        if versions is not None and wanted is None:
+            with self._lock:
+                self._profiles[case_id] = (versions, result)
+        return True, f"Profiled {len(result['parties'])} parties, {len(result['anomalies'])} anomalies", result
+
+    @staticmethod
+    def _subset(result: Dict, parties: Optional[List[str]]) -> Dict:
+        if parties is None:
+            return result
+        wanted = set(parties)
+        return {**result,
+                "parties": {party: result["parties"][party] for party in parties if party in result["parties"]},
+                "anomalies": [flag for flag in result["anomalies"] if flag["party"] in wanted]}
+
+    @staticmethod
+    def active_window(days: np.ndarray, events: np.ndarray, max_gap: int = POL_MAX_GAP_DAYS,
+                      max_days: int = POL_MAX_DAYS) -> Tuple[np.datetime64, np.datetime64]:
+        """
+        (first, last) day of the run of activity holding the most events
+
+        Days more than max_gap days from their neighbours start a new run, so a handful of
+        records with a stray timestamp do not stretch the profile; the run is then cut to
+        its latest max_days days.
+        """
+        distinct, codes = np.unique(days, return_inverse=True)
+        weights = np.bincount(codes, weights=events)
+        runs = np.concatenate([[0], np.cumsum(np.diff(distinct).astype(np.int64) > max_gap)])
+        run = int(np.argmax(np.bincount(runs, weights=weights)))
+        first, last = distinct[runs == run][[0, -1]]
+        return max(first, last - np.timedelta64(max_days - 1, "D")), last
+
+    def build(self, activity: pd.DataFrame) -> Dict:
+        """Profiles from (party, kind, day, hour, events) rows"""
+        activity = activity[activity["kind"].isin(ACTIVITY_KINDS)]
+        totals = activity.groupby("party")["events"].sum()
+        activity = activity[activity["party"].isin(totals.index[totals >= self.min_events])]
+        if activity.empty:
+            return {"start": None, "end": None, "parties": {}, "anomalies": []}
+
+        days = pd.to_datetime(activity["day"]).to_numpy(dtype="datetime64[D]")
+        events = activity["events"].to_numpy(dtype=np.float64)
+        first_day, last_day = self.active_window(days, events)
+        inside = (days >= first_day) & (days <= last_day)
+        activity, days, events = activity[inside], days[inside], events[inside]
+
+        parties, party_codes = np.unique(activity["party"].to_numpy(dtype=str), return_inverse=True)
+        day_codes = (days - first_day).astype(np.int64)
+        day_count = int((last_day - first_day).astype(np.int64)) + 1
+        hours = activity["hour"].to_numpy(dtype=np.int64)
+        kinds = activity["kind"].to_numpy(dtype=str)
+        weekdays = (pd.Timestamp(first_day).weekday() + day_codes) % 7
+
+        # A party's baseline only covers the days from its first to its last activity
+        first_active = np.full(len(parties), day_count)
+        last_active = np.full(len(parties), -1)
+        np.minimum.at(first_active, party_codes, day_codes)
+        np.maximum.at(last_active, party_codes, day_codes)
+        scored = np.flatnonzero((last_active - first_active + 1) >= self.min_days)
+        day_index = np.arange(day_count)
+        chunk = max(1, SCORING_CHUNK_CELLS // (day_count * 24))
+
+        matrices = {}
+        anomalies: List[Dict] = []
+        for kind in ACTIVITY_KINDS:
+            mask = kinds == kind
+            # Weekday (Monday = 0) x hour, straight from the sparse rows
+            flat = (party_codes[mask] * 7 + weekdays[mask]) * 24 + hours[mask]
+            matrices[kind] = np.bincount(flat, weights=events[mask], minlength=len(parties) * 7 * 24) \
+                .reshape(len(parties), 7, 24)
+
+            # Rows of the kind ordered by party, so each block of scored parties is a slice
+            order = np.flatnonzero(mask)[np.argsort(party_codes[mask], kind="stable")]
+            ordered_parties = party_codes[order]
+            for offset in range(0, len(scored), chunk):
+                block = scored[offset:offset + chunk]
+                low, high = np.searchsorted(ordered_parties, [block[0], block[-1] + 1])
+                rows = order[low:high]
+                rows = rows[np.isin(party_codes[rows], block)]
+                if not len(rows):
+                    continue
+                slot = np.searchsorted(block, party_codes[rows])
+                flat = (slot * day_count + day_codes[rows]) * 24 + hours[rows]
+                counts = np.bincount(flat, weights=events[rows], minlength=len(block) * day_count * 24) \
+                    .reshape(len(block), day_count, 24).astype(np.float32)
+                in_span = (day_index >= first_active[block, None]) & (day_index <= last_active[block, None])
+
+                # The count floor keeps a single stray call in an otherwise silent hour from scoring
+                daily = np.where(in_span, counts.sum(axis=2), np.float32(np.nan))
+                scores, baselines = deviation_scores(daily, axis=1, method=self.method, counts=True)
+                anomalies += self._flags(kind, parties[block], first_day, scores, baselines, daily)
+
+                hourly = np.where(in_span[:, :, None], counts, np.float32(np.nan))
+                scores, baselines = deviation_scores(hourly, axis=1, method=self.method, counts=True)
+                anomalies += self._flags(kind, parties[block], first_day, scores, baselines, hourly)
+
+        anomalies.sort(key=lambda flag: -abs(flag["score"]))
+        return {
+            "start": str(first_day),
+            "end": str(last_day),
+            "parties": {party: {"total_events": int(sum(matrices[kind][row].sum() for kind in ACTIVITY_KINDS)),
+                                **{kind: matrices[kind][row].astype(int).tolist() for kind in ACTIVITY_KINDS}}
+                        for row, party in enumerate(parties)},
+            "anomalies": anomalies,
+        }
+
+    def _flags(self, kind: str, parties: np.ndarray, first_day, scores: np.ndarray, baselines: np.ndarray,
+               values: np.ndarray) -> List[Dict]:
+        """Anomaly records for every value scoring beyond the threshold (daily: party x day, hourly: x hour)"""
+        found = np.argwhere(np.abs(scores) >= self.threshold)
+        flags = []
+        for index in map(tuple, found):
+            day = first_day + np.timedelta64(int(index[1]), "D")
+            flags.append({
+                "party": str(parties[index[0]]),
+                "kind": kind,
+                "level": "hour" if len(index) == 3 else "day",
+                "date": str(day),
+                "weekday": pd.Timestamp(day).day_name(),
+                "hour": int(index[2]) if len(index) == 3 else None,
+                "events": int(values[index]),
+                "baseline": round(float(baselines[index]), 2),
+                "score": round(float(scores[index]), 2),
+                "direction": "above" if scores[index] > 0 else "below",
+            })
+        return flags
+
+
+_pattern_of_life = None
+
+
+def get_pattern_of_life() -> PatternOfLife:
+    """Process-wide instance, so cached case profiles are shared across requests"""
+    global _pattern_of_life
+    if _pattern_of_life is None:
+        _pattern_of_life = PatternOfLife()
+    return _pattern_of_life
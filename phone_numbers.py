@@ -0,0 +1,88 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from config import DEFAULT_COUNTRY_CODE, NATIONAL_NUMBER_LENGTH
+
+# Phone number columns per table and the bigint E.164 key stored next to each
+PHONE_NUMBER_COLUMNS = {
+    "crd": {"a_party": "a_party_e164", "b_party": "b_party_e164"},
+    "tower_dumps": {"a_party": "a_party_e164", "b_party": "b_party_e164"},
+    "ipdr": {"landline_msidn_mdn_leased_circuit_id": "msisdn_e164"},
+    "subscriber": {"phone_number": "phone_number_e164", "alternative_mobile_no": "alternative_mobile_no_e164"},
+    "true_caller": {"number": "number_e164"},
+}
+
+# E.164 numbers have at most 15 digits, so the key always fits a bigint
+E164_MIN_DIGITS = 8
+E164_MAX_DIGITS = 15
+
+# SQL twin of e164_keys, for the backfill and for looking numbers up: WHERE a_party_e164 = e164_key('098765 43210')
+E164_FUNCTION_DDL = f"""CREATE OR REPLACE FUNCTION e164_key(raw text, country text DEFAULT '{DEFAULT_COUNTRY_CODE}',
+                                    national_length integer DEFAULT {NATIONAL_NUMBER_LENGTH}) RETURNS bigint
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN international THEN
+            CASE WHEN length(digits) BETWEEN {E164_MIN_DIGITS} AND {E164_MAX_DIGITS} THEN digits::bigint END
+        WHEN length(ltrim(digits, '0')) = national_length THEN (country || ltrim(digits, '0'))::bigint
+        WHEN length(ltrim(digits, '0')) = national_length + length(country)
+             AND left(ltrim(digits, '0'), length(country)) = country THEN ltrim(digits, '0')::bigint
+    END
+    FROM (SELECT regexp_replace(btrim(raw), '\\.0+$', '') AS number) t,
+    LATERAL (SELECT number LIKE '+%' OR number LIKE '00%' AS international,
+                    regexp_replace(CASE WHEN number LIKE '00%' THEN substr(number, 3) ELSE number END,
+                                   '\\D', '', 'g') AS digits) d
+$$"""
+
+PHONE_NUMBER_DDL = [E164_FUNCTION_DDL]
+PHONE_NUMBER_BACKFILL = []
+for _table, _columns in PHONE_NUMBER_COLUMNS.items():
+    for _source, _key in _columns.items():
+        PHONE_NUMBER_DDL += [
+            f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS {_key} bigint",
+            f"CREATE INDEX IF NOT EXISTS idx_{_table}_{_key} ON {_table} ({_key}) WHERE {_key} IS NOT NULL",
+        ]
+        PHONE_NUMBER_BACKFILL.append(
+            f"UPDATE {_table} SET {_key} = e164_key({_source}::text) WHERE {_key} IS NULL AND {_source} IS NOT NULL")
+
+
+def e164_keys(values: pd.Series, country_code: str = DEFAULT_COUNTRY_CODE,
+              national_length: int = NATIONAL_NUMBER_LENGTH) -> pd.Series:
+    """
+    Canonical E.164 number (without '+') for each value, as Int64
+
+    '+91 98765-43210', '0091 9876543210', '09876543210', '919876543210', 9876543210 and
+    9876543210.0 all give 919876543210. Short codes, sender ids and other values that
+    are not a full number give <NA>.
+    """
+    text = values.astype(str).str.strip().str.replace(r"\.0+$", "", regex=True)
+    international = text.str.startswith("+") | text.str.startswith("00")
+    digits = text.str.replace(r"\D", "", regex=True)
+    digits = digits.where(~text.str.startswith("00"), digits.str[2:])
+    national = digits.str.lstrip("0")
+
+    canonical = np.select(
+        [international & digits.str.len().between(E164_MIN_DIGITS, E164_MAX_DIGITS),
+         ~international & (national.str.len() == national_length),
+         ~international & (national.str.len() == national_length + len(country_code))
+         & national.str.startswith(country_code)],
+        [digits, country_code + national, national],
+        default="",
+    )
+    canonical = pd.Series(canonical, index=values.index).where(values.notna(), "")
+    return pd.to_numeric(canonical.replace("", np.nan), errors="coerce").astype("Int64")
+
+
+class PhoneNumberStage:
+    """Ingest stage adding the <column>_e164 key for every phone number column of a table"""
+
+    def __init__(self, table_name: str):
+        self.columns: Dict[str, str] = PHONE_NUMBER_COLUMNS[table_name]
+        self.__name__ = f"e164_keys[{table_name}]"
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        for source, key in self.columns.items():
+            if source in df.columns:
+                df[key] = e164_keys(df[source])
+        return df
@@ -0,0 +1,82 @@
+import re
+from typing import Dict, List, Optional
+
+from config import POPULATION_SAMPLE_ROWS, POPULATION_TOP_K
+
+# Columns worth a distinct count and top values whenever a result carries them
+POPULATION_KEY_COLUMNS = [
+    "a_party", "b_party", "landline_msidn_mdn_leased_circuit_id", "phone_number",
+    "imei_a", "imsi_a", "imei", "imsi",
+    "first_cell_id_a", "last_cell_id_a", "first_cell_id",
+    "call_type", "destination_ip_address", "destination_port", "access_point_name",
+]
+
+# Columns whose min/max bound the result in time (ISO text compares in time order)
+POPULATION_TIME_COLUMNS = ["event_ts", "date", "start_date_of_public_ip_allocation"]
+
+_READ_QUERY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+def _text_array(values: List[str]) -> str:
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]::text[]"
+
+
+def wrap_with_population_stats(sql_query: str, top_k: int = POPULATION_TOP_K,
+                               sample_rows: int = POPULATION_SAMPLE_ROWS) -> Optional[str]:
+    """
+    Wrap a read query so one round trip returns statistics over its whole result
+
+    The query is materialized once server-side; rows are folded through
+    jsonb_each_text so any result shape works without knowing its columns.
+    Returns None for anything that is not a SELECT/WITH.
+
+    The single returned row has total_count, column_stats ({column: {distinct,
+    non_null, top: [{value, count}]}}), time_range ({column: {min, max}}) and
+    sample (the first sample_rows rows).
+    """
+    if not _READ_QUERY.match(sql_query):
+        return None
+    body = sql_query.strip().rstrip(";")
+
+    return f"""WITH population AS MATERIALIZED ({body}),
+key_values AS (
+    SELECT e.key, e.value FROM population p CROSS JOIN LATERAL jsonb_each_text(to_jsonb(p)) e
+    WHERE e.key = ANY({_text_array(POPULATION_KEY_COLUMNS)}) AND e.value IS NOT NULL
+),
+value_counts AS (
+    SELECT key, value, count(*) AS n,
+           row_number() OVER (PARTITION BY key ORDER BY count(*) DESC, value) AS rank
+    FROM key_values GROUP BY key, value
+),
+column_stats AS (
+    SELECT key, json_build_object(
+        'distinct', count(*),
+        'non_null', sum(n),
+        'top', json_agg(json_build_object('value', value, 'count', n) ORDER BY rank) FILTER (WHERE rank <= {int(top_k)})
+    ) AS stats
+    FROM value_counts GROUP BY key
+),
+time_range AS (
+    SELECT e.key, json_build_object('min', min(e.value), 'max', max(e.value)) AS bounds
+    FROM population p CROSS JOIN LATERAL jsonb_each_text(to_jsonb(p)) e
+    WHERE e.key = ANY({_text_array(POPULATION_TIME_COLUMNS)}) AND e.value IS NOT NULL
+    GROUP BY e.key
+)
+SELECT
+    (SELECT count(*) FROM population) AS total_count,
+    (SELECT json_object_agg(key, stats) FROM column_stats) AS column_stats,
+    (SELECT json_object_agg(key, bounds) FROM time_range) AS time_range,
+    (SELECT json_agg(s) FROM (SELECT * FROM population LIMIT {int(sample_rows)}) s) AS sample"""
+
+
+def unpack_population(rows: List[Dict]) -> Optional[Dict]:
+    """Turn the wrapper's single row into a stats dict, or None if this is not its output"""
+    if len(rows) != 1 or "total_count" not in rows[0] or "sample" not in rows[0]:
+        return None
+    row = rows[0]
+    return {
+        "total_count": int(row["total_count"] or 0),
+        "column_stats": row["column_stats"] or {},
+        "time_range": row["time_range"] or {},
+        "sample": row["sample"] or [],
+    }
@@ -0,0 +1,207 @@
+from typing import List, Optional, Tuple
+
+from cell_dictionary import DIMENSION_ONLY_COLUMNS, dimension_only_hint
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+# SQL comparison -> PostgREST operator, and the operator to use when the literal is on the left
+_OPERATORS = {
+    "EQ": ("eq", "eq"), "NEQ": ("neq", "neq"),
+    "GT": ("gt", "lt"), "GTE": ("gte", "lte"), "LT": ("lt", "gt"), "LTE": ("lte", "gte"),
+    "Like": ("like", None), "ILike": ("ilike", None),
+}
+
+# Characters PostgREST treats as syntax inside in.(...) lists and or=(...) trees
+_RESERVED = set(',.:()" ')
+
+
+class UntranslatableQuery(ValueError):
+    """The query uses something PostgREST cannot express without changing its result"""
+
+
+def parse_select(sql_query: str):
+    """Parse a single-table SELECT, or raise UntranslatableQuery explaining why it cannot go through PostgREST"""
+    if not SQLGLOT_AVAILABLE:
+        raise UntranslatableQuery("sqlglot is not installed")
+    try:
+        tree = sqlglot.parse_one(sql_query.strip().rstrip(";"), read="postgres")
+    except Exception as e:
+        raise UntranslatableQuery(f"could not parse SQL: {str(e)}")
+
+    if not isinstance(tree, exp.Select):
+        raise UntranslatableQuery("only plain SELECT statements are supported")
+    for clause in ("joins", "group", "having", "distinct", "with", "windows"):
+        if tree.args.get(clause):
+            raise UntranslatableQuery(f"{clause.upper()} is not supported")
+    source = tree.args.get("from_") or tree.args.get("from")
+    if source is None or not isinstance(source.this, exp.Table):
+        raise UntranslatableQuery("FROM must name a single table")
+    if any(isinstance(e, exp.AggFunc) for e in tree.find_all(exp.AggFunc)):
+        raise UntranslatableQuery("aggregate functions are not supported")
+    if len(list(tree.find_all(exp.Select))) > 1:
+        raise UntranslatableQuery("subqueries are not supported")
+    # PostgREST would return the NULL per-row copies
+    retired = DIMENSION_ONLY_COLUMNS.get(source.this.name.lower(), set())
+    for column in tree.find_all(exp.Column):
+        if column.name.lower() in retired:
+            raise UntranslatableQuery(dimension_only_hint(source.this.name, column.name))
+    return tree
+
+
+def source_table(tree) -> str:
+    return (tree.args.get("from_") or tree.args.get("from")).this.name
+
+
+def _column(node) -> Optional[str]:
+    return node.name if isinstance(node, exp.Column) and not isinstance(node.this, exp.Star) else None
+
+
+def _literal(node):
+    """Python value of a literal (casts of literals included), or raise"""
+    if isinstance(node, exp.Cast):
+        node = node.this
+    if isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal):
+        return -_literal(node.this)
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        number = float(node.this)
+        return int(number) if number.is_integer() and "." not in node.this else number
+    if isinstance(node, exp.Boolean):
+        return node.this
+    if isinstance(node, exp.Null):
+        return None
+    raise UntranslatableQuery(f"unsupported value: {node.sql(dialect='postgres')}")
+
+
+def _text(value, quote: bool = False) -> str:
+    if value is True or value is False:
+        text = str(value).lower()
+    else:
+        text = str(value)
+    if quote and any(c in _RESERVED for c in text):
+        text = '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return text
+
+
+def _predicate(node, quote: bool) -> List[Tuple[str, str, str]]:
+    """One SQL predicate as (column, operator, criteria) triples that must all hold"""
+    negate = False
+    while isinstance(node, (exp.Not, exp.Paren)):
+        negate ^= isinstance(node, exp.Not)
+        node = node.this
+    # Newer sqlglot folds IS NOT / NOT LIKE into the node itself
+    negate ^= bool(node.args.get("negate"))
+    prefix = "not." if negate else ""
+
+    if isinstance(node, exp.Is):
+        column = _column(node.this)
+        value = _literal(node.expression)
+        if column is None:
+            raise UntranslatableQuery(f"unsupported predicate: {node.sql(dialect='postgres')}")
+        return [(column, f"{prefix}is", _text("null" if value is None else value))]
+
+    if isinstance(node, exp.In):
+        column = _column(node.this)
+        if column is None or node.args.get("query"):
+            raise UntranslatableQuery(f"unsupported predicate: {node.sql(dialect='postgres')}")
+        values = ",".join(_text(_literal(v), quote=True) for v in node.expressions)
+        return [(column, f"{prefix}in", f"({values})")]
+
+    if isinstance(node, exp.Between) and not negate:
+        column = _column(node.this)
+        if column is None:
+            raise UntranslatableQuery(f"unsupported predicate: {node.sql(dialect='postgres')}")
+        return [(column, "gte", _text(_literal(node.args["low"]), quote)),
+                (column, "lte", _text(_literal(node.args["high"]), quote))]
+
+    operator = _OPERATORS.get(type(node).__name__)
+    if operator:
+        column, other, op = _column(node.this), node.expression, operator[0]
+        if column is None and operator[1]:
+            column, other, op = _column(node.expression), node.this, operator[1]
+        if column is not None:
+            return [(column, f"{prefix}{op}", _text(_literal(other), quote))]
+
+    raise UntranslatableQuery(f"unsupported predicate: {node.sql(dialect='postgres')}")
+
+
+def _logic_tree(node) -> str:
+    """An AND/OR tree in PostgREST's or=(...) syntax"""
+    if isinstance(node, exp.Paren):
+        return _logic_tree(node.this)
+    if isinstance(node, (exp.And, exp.Or)):
+        keyword = "and" if isinstance(node, exp.And) else "or"
+        parts = [_logic_tree(part) for part in node.flatten()]
+        return f"{keyword}({','.join(parts)})"
+    triples = _predicate(node, quote=True)
+    parts = [f"{column}.{operator}.{criteria}" for column, operator, criteria in triples]
+    return parts[0] if len(parts) == 1 else f"and({','.join(parts)})"
+
+
+def translate_filters(tree) -> List[Tuple[Optional[str], str, str]]:
+    """
+    WHERE clause as PostgREST filters: (column, operator, criteria) per ANDed term,
+    and (None, 'or', tree) for each OR group
+    """
+    where = tree.args.get("where")
+    if where is None:
+        return []
+    condition = where.this
+    while isinstance(condition, exp.Paren):
+        condition = condition.this
+    terms = list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+
+    filters = []
+    for term in terms:
+        while isinstance(term, exp.Paren):
+            term = term.this
+        if isinstance(term, exp.Or):
+            filters.append((None, "or", _logic_tree(term)[len("or("):-1]))
+        else:
+            filters.extend(_predicate(term, quote=False))
+    return filters
+
+
+def translate_columns(tree) -> str:
+    """SELECT list as a PostgREST select string (alias:column for AS)"""
+    columns = []
+    for expression in tree.expressions:
+        if isinstance(expression, exp.Star) or (isinstance(expression, exp.Column) and isinstance(expression.this, exp.Star)):
+            return "*"
+        alias = expression.alias if isinstance(expression, exp.Alias) else None
+        column = _column(expression.this if alias else expression)
+        if column is None:
+            raise UntranslatableQuery(f"unsupported select expression: {expression.sql(dialect='postgres')}")
+        columns.append(f"{alias}:{column}" if alias and alias != column else column)
+    return ",".join(columns)
+
+
+def translate_order(tree) -> List[Tuple[str, bool]]:
+    """ORDER BY as (column, descending) pairs; output aliases resolve to their columns"""
+    order = tree.args.get("order")
+    if order is None:
+        return []
+    aliases = {e.alias: _column(e.this) for e in tree.expressions if isinstance(e, exp.Alias)}
+    pairs = []
+    for ordered in order.expressions:
+        column = _column(ordered.this)
+        column = aliases.get(column) or column
+        if column is None:
+            raise UntranslatableQuery(f"unsupported ORDER BY: {ordered.sql(dialect='postgres')}")
+        pairs.append((column, bool(ordered.args.get("desc"))))
+    return pairs
+
+
+def translate_limit(tree) -> Tuple[Optional[int], int]:
+    """(limit or None for all rows, offset)"""
+    limit = tree.args.get("limit")
+    offset = tree.args.get("offset")
+    limit_value = int(_literal(limit.expression)) if limit is not None else None
+    offset_value = int(_literal(offset.expression)) if offset is not None else 0
+    return limit_value, offset_value
@@ -0,0 +1,185 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import TABLE_SCHEMAS, QUERY_CACHE_MAX_BYTES
+from party_summary import PARTY_SUMMARY_TABLE
+from contact_edges import CONTACT_EDGES_TABLE
+from cell_dictionary import CELLS_TABLE
+from session_stitcher import SESSIONS_TABLE
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+VERSIONS_TABLE = "table_versions"
+
+# Tables whose writes bump a version; only queries reading nothing else are cached
+VERSIONED_TABLES = list(TABLE_SCHEMAS) + [SESSIONS_TABLE, PARTY_SUMMARY_TABLE, CONTACT_EDGES_TABLE, CELLS_TABLE]
+
+# Statement-level triggers catch every writer (loaders, PostgREST, manual SQL), not just this process
+VERSIONS_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now()
+)""",
+    f"""CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO {VERSIONS_TABLE} (table_name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = {VERSIONS_TABLE}.version + 1, updated_at = now();
+    RETURN NULL;
+END $$""",
+]
+
+
+def version_trigger_ddl(table: str) -> List[str]:
+    return [
+        f"DROP TRIGGER IF EXISTS trg_{table}_version ON {table}",
+        f"CREATE TRIGGER trg_{table}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()",
+    ]
+
+
+for _table in VERSIONED_TABLES:
+    VERSIONS_DDL += version_trigger_ddl(_table)
+
+_VOLATILE = tuple(getattr(exp, name) for name in
+                  ("Rand", "CurrentTimestamp", "CurrentDate", "CurrentTime", "Anonymous") if hasattr(exp, name)) \
+    if SQLGLOT_AVAILABLE else ()
+
+_WRITE_TARGET = re.compile(r"\b(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?)\s+(?:public\.)?\"?(\w+)",
+                           re.IGNORECASE)
+
+
+def written_tables(sql_query: str) -> List[str]:
+    """Versioned tables a write statement targets"""
+    return [t for t in _WRITE_TARGET.findall(sql_query) if t in VERSIONED_TABLES]
+
+
+def normalize_sql(sql_query: str) -> str:
+    """Canonical text for cache keys: whitespace and keyword case outside literals do not matter"""
+    body = sql_query.strip().rstrip(";")
+    if SQLGLOT_AVAILABLE:
+        try:
+            return sqlglot.parse_one(body, read="postgres").sql(dialect="postgres")
+        except Exception:
+            pass
+    return re.sub(r"\s+", " ", body)
+
+
+def cacheable_tables(sql_query: str) -> Optional[List[str]]:
+    """
+    Tables a read query depends on, or None if it cannot be cached safely
+    (not a plain read, or it reads something without a version counter)
+    """
+    if not SQLGLOT_AVAILABLE:
+        return None
+    try:
+        tree = sqlglot.parse_one(sql_query.strip().rstrip(";"), read="postgres")
+    except Exception:
+        return None
+    if not isinstance(tree, (exp.Select, exp.Union)) or any(
+            isinstance(node, (exp.Insert, exp.Update, exp.Delete)) for node in tree.walk()):
+        return None
+
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = set()
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if name in ctes and not table.db:
+            continue
+        if name not in VERSIONED_TABLES or (table.db and table.db.lower() != "public"):
+            return None
+        tables.add(name)
+    # Volatile functions would make a cached answer wrong even with unchanged tables; functions
+    # sqlglot does not model (clock_timestamp(), gen_random_uuid(), ...) are treated as volatile too
+    if any(isinstance(node, _VOLATILE) for node in tree.walk()):
+        return None
+    return sorted(tables) or None
+
+
+class QueryResultCache:
+    """
+    Process-wide LRU of query results, bounded by the approximate JSON size of the rows
+
+    Each entry remembers the versions of the tables it read. A lookup is a hit only if
+    those versions are unchanged, so a write anywhere (seen through the database's
+    table_versions counters, or this process's own counters) invalidates it.
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.local_versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        # Whether table_versions exists; without it nothing proves a cached result is current
+        self.versions_table_ready: Optional[bool] = None
+        self._entries: "OrderedDict[str, Tuple[object, Dict[str, tuple], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sql_query: str, params=None, case_id: Optional[str] = None) -> str:
+        return json.dumps([normalize_sql(sql_query), params, case_id], default=str)
+
+    def bump(self, table: str):
+        """Invalidate every cached result that read this table (called after writes)"""
+        with self._lock:
+            self.local_versions[table] = self.local_versions.get(table, 0) + 1
+
+    def versions(self, tables: List[str], database_versions: Dict[str, int]) -> Dict[str, tuple]:
+        return {t: (self.local_versions.get(t, 0), database_versions.get(t, 0)) for t in tables}
+
+    def get(self, key: str, versions: Dict[str, tuple]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != versions:
+                self.misses += 1
+                if entry is not None:
+                    self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value, versions: Dict[str, tuple]):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (value, versions, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
+
+
+_query_cache = None
+
+
+def get_query_cache() -> QueryResultCache:
+    """Process-wide cache shared by every SupabaseHandler"""
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryResultCache()
+    return _query_cache
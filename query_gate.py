@@ -0,0 +1,108 @@
+import json
+import re
+from typing import Dict, List, Optional
+
+from config import QUERY_MAX_TOTAL_COST, QUERY_MAX_PLAN_ROWS, QUERY_DOWNGRADE_LIMIT
+
+_READ_QUERY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_HAS_LIMIT = re.compile(r"\blimit\s+\d+\s*(offset\s+\d+\s*)?$", re.IGNORECASE)
+
+HOTSPOT_COUNT = 3
+
+
+def _plan_nodes(plan: Dict) -> List[Dict]:
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def _describe(node: Dict) -> str:
+    description = node.get("Node Type", "?")
+    if node.get("Relation Name"):
+        description += f" on {node['Relation Name']}"
+    if node.get("Node Type") == "Nested Loop" and not node.get("Join Filter") and not any(
+            child.get("Index Cond") for child in node.get("Plans", [])):
+        description += " (no join condition)"
+    return f"{description}: ~{int(node.get('Plan Rows', 0)):,} rows, cost {node.get('Total Cost', 0):,.0f}"
+
+
+class QueryCostGate:
+    """
+    Pre-flight check for agent-generated SQL using EXPLAIN (FORMAT JSON)
+
+    Queries within the cost and row limits pass unchanged. Queries over the row
+    limit without a LIMIT of their own are re-planned with one; anything still
+    over the limits is rejected with the plan's most expensive nodes so the SQL
+    agent can be asked for a tighter query.
+    """
+
+    def __init__(self, supabase_handler, max_cost: float = QUERY_MAX_TOTAL_COST,
+                 max_rows: int = QUERY_MAX_PLAN_ROWS, downgrade_limit: int = QUERY_DOWNGRADE_LIMIT):
+        self.handler = supabase_handler
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.downgrade_limit = downgrade_limit
+
+    @staticmethod
+    def plan_from_explain(output) -> Dict:
+        """Root plan node from EXPLAIN (FORMAT JSON) output"""
+        if isinstance(output, str):
+            output = json.loads(output)
+        return output[0]["Plan"]
+
+    def _explain(self, sql_query: str) -> Dict:
+        success, message, rows = self.handler.execute_raw_sql(f"EXPLAIN (FORMAT JSON) {sql_query}")
+        if not success or not rows:
+            raise ValueError(message)
+        return self.plan_from_explain(rows[0]["QUERY PLAN"])
+
+    def _within_limits(self, plan: Dict) -> bool:
+        return plan["Total Cost"] <= self.max_cost and plan["Plan Rows"] <= self.max_rows
+
+    def review(self, sql_query: str, plan: Optional[Dict] = None) -> Dict:
+        """
+        Args:
+            plan: root plan node when the EXPLAIN already ran (e.g. in a batch)
+
+        Returns:
+            Verdict with 'status' ('accepted', 'downgraded', 'rejected', 'invalid' or 'skipped'),
+            the 'sql' to run, the plan estimates and a 'reason' for rejections
+        """
+        verdict = {"status": "skipped", "sql": sql_query, "original_sql": sql_query,
+                   "estimated_cost": None, "estimated_rows": None, "reason": None, "hotspots": []}
+        if not _READ_QUERY.match(sql_query):
+            return verdict
+
+        body = sql_query.strip().rstrip(";")
+        try:
+            plan = plan or self._explain(body)
+        except ValueError as e:
+            verdict.update(status="invalid", reason=f"EXPLAIN failed: {str(e)}")
+            return verdict
+
+        verdict.update(estimated_cost=plan["Total Cost"], estimated_rows=plan["Plan Rows"])
+        if self._within_limits(plan):
+            verdict["status"] = "accepted"
+            return verdict
+
+        # Too many rows but no LIMIT: the planner can often stop early once one is added
+        if plan["Plan Rows"] > self.max_rows and not _HAS_LIMIT.search(body):
+            limited = f"SELECT * FROM ({body}) AS gated LIMIT {self.downgrade_limit}"
+            try:
+                limited_plan = self._explain(limited)
+            except ValueError:
+                limited_plan = None
+            if limited_plan and self._within_limits(limited_plan):
+                verdict.update(status="downgraded", sql=limited,
+                               estimated_cost=limited_plan["Total Cost"], estimated_rows=limited_plan["Plan Rows"])
+                return verdict
+
+        hotspots = sorted(_plan_nodes(plan), key=lambda n: -n.get("Total Cost", 0))[:HOTSPOT_COUNT]
+        verdict.update(
+            status="rejected",
+            hotspots=[_describe(node) for node in hotspots],
+            reason=(f"Estimated cost {plan['Total Cost']:,.0f} (limit {self.max_cost:,.0f}) and "
+                    f"{int(plan['Plan Rows']):,} rows (limit {self.max_rows:,})")
+        )
+        return verdict
@@ -0,0 +1,59 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+class RangeTable:
+    """
+    Longest-match lookup of integers in [start, end) ranges that either nest or are disjoint
+
+    Prefix-style ranges (number series, CIDR blocks) are flattened once into sorted,
+    non-overlapping segments, each owned by the innermost range covering it, so a
+    whole column is resolved with a single numpy.searchsorted call.
+    """
+
+    def __init__(self, starts: Sequence[int], ends: Sequence[int]):
+        self.starts, self.ends, self.owners = self._segments(starts, ends)
+
+    @staticmethod
+    def _segments(range_starts: Sequence[int], range_ends: Sequence[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Enclosing ranges sort before the ranges they contain
+        ranges = sorted((start, -end, row) for row, (start, end) in enumerate(zip(range_starts, range_ends)))
+        starts: List[int] = []
+        ends: List[int] = []
+        owners: List[int] = []
+        stack: List[Tuple[int, int]] = []  # (end, row) of the ranges enclosing the current position
+        position = None
+
+        def emit(until: int):
+            if stack and position is not None and until > position:
+                starts.append(position)
+                ends.append(until)
+                owners.append(stack[-1][1])
+
+        for start, negative_end, row in ranges:
+            end = -negative_end
+            # Close enclosing ranges that finish before this one starts
+            while stack and stack[-1][0] <= start:
+                emit(stack[-1][0])
+                position = stack.pop()[0]
+            emit(start)
+            stack.append((end, row))
+            position = start
+        while stack:
+            emit(stack[-1][0])
+            position = stack.pop()[0]
+
+        return (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                np.array(owners, dtype=np.int64))
+
+    def lookup(self, values: np.ndarray) -> np.ndarray:
+        """Row of the innermost range containing each value, -1 where none does"""
+        if not len(self.starts):
+            return np.full(len(values), -1, dtype=np.int64)
+        segment = np.maximum(np.searchsorted(self.starts, values, side="right") - 1, 0)
+        matched = (values >= self.starts[segment]) & (values < self.ends[segment])
+        return np.where(matched, self.owners[segment], -1)
+
+    def __len__(self):
+        return len(self.starts)
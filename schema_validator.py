@@ -0,0 +1,264 @@
+import difflib
+import re
+import time
+from typing import Dict, List, Optional, Set
+
+from cell_dictionary import DIMENSION_ONLY_COLUMNS, dimension_only_hint
+from config import TABLE_SCHEMAS, SCHEMA_CACHE_SECONDS
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+# Prefixes the SQL agent likes to invent in front of real column names (call_duration, session_imei, ...)
+INVENTED_PREFIXES = ["call_", "session_", "cell_", "subscriber_"]
+
+# Schemas whose tables are never checked against the data catalog
+SYSTEM_SCHEMAS = {"information_schema", "pg_catalog"}
+
+# information_schema data_type spellings -> the names used in TABLE_SCHEMAS.column_types
+DATA_TYPE_NAMES = {
+    "character varying": "varchar",
+    "character": "char",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "time without time zone": "time",
+}
+
+
+def _alias_key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+# Upload header aliases, keyed the way they would look as SQL identifiers
+COLUMN_ALIASES: Dict[str, Dict[str, str]] = {
+    table: {_alias_key(alias): column for alias, column in schema.get("column_aliases", {}).items()}
+    for table, schema in TABLE_SCHEMAS.items()
+}
+
+
+class SchemaValidator:
+    """
+    Check generated SQL against the live catalog before it reaches the database
+
+    Tables and columns are resolved per query scope (CTEs and subqueries included).
+    Cell attributes that only the cells dimension holds (DIMENSION_ONLY_COLUMNS) count
+    as unknown on the fact tables, with the join to use instead. Unknown columns are corrected when TABLE_SCHEMAS.column_aliases or a stripped
+    invented prefix names a real column of the same table; anything still unknown
+    is reported so the SQL agent can be re-prompted instead of the query failing
+    in PostgreSQL and falling back to an unfiltered scan.
+    """
+
+    def __init__(self, cache_seconds: int = SCHEMA_CACHE_SECONDS):
+        self.cache_seconds = cache_seconds
+        self.columns: Dict[str, Set[str]] = {}
+        self.lowered: Dict[str, Set[str]] = {}
+        self.types: Dict[str, Dict[str, str]] = {}
+        self.loaded_at: Optional[float] = None
+
+    def refresh(self, supabase_handler) -> bool:
+        """(Re)load table and column names from information_schema"""
+        success, message, rows = supabase_handler.execute_raw_sql(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema()")
+        if not success or not rows:
+            print(f"⚠️ Schema validator could not load the catalog: {message}")
+            return False
+        columns: Dict[str, Set[str]] = {}
+        types: Dict[str, Dict[str, str]] = {}
+        for row in rows:
+            columns.setdefault(row["table_name"], set()).add(row["column_name"])
+            data_type = row.get("data_type") or ""
+            types.setdefault(row["table_name"].lower(), {})[row["column_name"].lower()] = \
+                DATA_TYPE_NAMES.get(data_type, data_type)
+        self.columns = columns
+        self.lowered = {table.lower(): {c.lower() for c in names} for table, names in columns.items()}
+        self.types = types
+        self.loaded_at = time.time()
+        return True
+
+    def _ensure_catalog(self, supabase_handler) -> bool:
+        if self.loaded_at is None or time.time() - self.loaded_at > self.cache_seconds:
+            if not supabase_handler.pg_connection or not self.refresh(supabase_handler):
+                return bool(self.columns)
+        return True
+
+    def catalog_columns(self, supabase_handler) -> Dict[str, Set[str]]:
+        """Lower-cased column names per table from the live catalog; empty when it cannot be read"""
+        if not self._ensure_catalog(supabase_handler):
+            return {}
+        return self.lowered
+
+    def catalog_types(self, supabase_handler) -> Dict[str, Dict[str, str]]:
+        """Column -> data type (short names: text, varchar, bigint, timestamp, ...) per table; empty when unavailable"""
+        if not self._ensure_catalog(supabase_handler):
+            return {}
+        return self.types
+
+    def _table_columns(self, table: str) -> Optional[Dict[str, str]]:
+        """Lower-cased column name -> catalog name, or None for an unknown table"""
+        for name, columns in self.columns.items():
+            if name.lower() == table.lower():
+                retired = DIMENSION_ONLY_COLUMNS.get(name.lower(), set())
+                return {c.lower(): c for c in columns if c.lower() not in retired}
+        return None
+
+    def _correction(self, table: str, column: str, available: Dict[str, str]) -> Optional[str]:
+        candidates = [COLUMN_ALIASES.get(table.lower(), {}).get(_alias_key(column))]
+        for prefix in INVENTED_PREFIXES + [f"{table.lower()}_"]:
+            if column.lower().startswith(prefix):
+                candidates.append(column[len(prefix):])
+        for candidate in candidates:
+            if candidate and candidate.lower() in available:
+                return available[candidate.lower()]
+        return None
+
+    @staticmethod
+    def _rename(column, name: str):
+        column.set("this", exp.to_identifier(name, quoted=name != name.lower()))
+
+    def _check_column(self, column, table: str, available: Dict[str, str],
+                      corrections: List[Dict], errors: List[str]) -> Optional[str]:
+        """Returns the corrected name when the column was renamed"""
+        name = column.name
+        if name.lower() in available:
+            return None
+        if name.lower() in DIMENSION_ONLY_COLUMNS.get(table.lower(), set()):
+            errors.append(dimension_only_hint(table, name))
+            return None
+        fixed = self._correction(table, name, available)
+        if fixed:
+            self._rename(column, fixed)
+            correction = {"table": table, "from": name, "to": fixed}
+            if correction not in corrections:
+                corrections.append(correction)
+            return fixed
+        close = difflib.get_close_matches(name.lower(), list(available), n=3)
+        hint = f" - did you mean {', '.join(available[c] for c in close)}?" if close else ""
+        errors.append(f"Column {name} does not exist on {table}{hint} (columns: {', '.join(sorted(available.values()))})")
+        return None
+
+    def _outer_columns(self, scope) -> Optional[Set[str]]:
+        """Lower-cased columns the enclosing scopes' sources provide; None when any is unknown (SELECT *)"""
+        names: Set[str] = set()
+        parent = scope.parent
+        while parent is not None:
+            for _, source in parent.selected_sources.values():
+                if isinstance(source, exp.Table):
+                    if source.db and source.db.lower() in SYSTEM_SCHEMAS:
+                        return None
+                    # Unknown tables were already reported in their own scope
+                    names.update(self._table_columns(source.name) or {})
+                    continue
+                selects = getattr(getattr(source, "expression", None), "named_selects", None)
+                if selects is None or "*" in selects:
+                    return None
+                names.update(s.lower() for s in selects)
+            parent = parent.parent
+        return names
+
+    def validate(self, sql_query: str, supabase_handler) -> Dict:
+        """
+        Returns:
+            {'valid', 'checked', 'sql', 'corrections': [{'table', 'from', 'to'}], 'errors': [...]}
+            'checked' is False when sqlglot or the catalog is unavailable or the SQL did not parse
+        """
+        result = {"valid": True, "checked": False, "sql": sql_query, "corrections": [], "errors": []}
+        if not SQLGLOT_AVAILABLE or not self._ensure_catalog(supabase_handler):
+            return result
+        try:
+            tree = sqlglot.parse_one(sql_query.strip().rstrip(";"), read="postgres")
+            scopes = traverse_scope(tree)
+        except Exception:
+            return result
+        result["checked"] = True
+
+        corrections, errors = result["corrections"], result["errors"]
+        for scope in scopes:
+            renamed: Dict[str, str] = {}
+            real: Dict[str, Dict[str, str]] = {}
+            derived: List = []
+            for alias, source in scope.selected_sources.items():
+                node, source = source
+                if isinstance(source, exp.Table):
+                    if source.db and source.db.lower() in SYSTEM_SCHEMAS:
+                        derived.append(None)
+                        continue
+                    available = self._table_columns(source.name)
+                    if available is None:
+                        close = difflib.get_close_matches(source.name.lower(), list(self.columns), n=3)
+                        hint = f" - did you mean {', '.join(close)}?" if close else ""
+                        errors.append(f"Table {source.name} does not exist{hint}")
+                        derived.append(None)
+                        continue
+                    real[alias] = (source.name, available)
+                else:
+                    derived.append(source)
+
+            # Names a derived source or this SELECT's own aliases could provide
+            provided = set()
+            for source in derived:
+                selects = getattr(getattr(source, "expression", None), "named_selects", None)
+                if source is None or selects is None or "*" in selects:
+                    provided = None
+                    break
+                provided.update(s.lower() for s in selects)
+            own_aliases = {e.alias.lower() for e in getattr(scope.expression, "expressions", [])
+                           if isinstance(e, exp.Alias)}
+
+            outer: Optional[Set[str]] = None
+            for column in scope.columns:
+                if isinstance(column.this, exp.Star):
+                    continue
+                # sqlglot also lists a correlated subquery's outer references here - those are checked in their own scope
+                if isinstance(scope.expression, exp.Select) and column.find_ancestor(exp.Select) is not scope.expression:
+                    continue
+                if column.table:
+                    if column.table in real:
+                        table, available = real[column.table]
+                        self._check_column(column, table, available, corrections, errors)
+                    continue
+                name = column.name.lower()
+                if any(name in available for _, available in real.values()):
+                    continue
+                if provided is None or name in provided or name in own_aliases:
+                    continue
+                # A correlated subquery may name the enclosing query's columns unqualified
+                if outer is None:
+                    outer = self._outer_columns(scope)
+                if outer is None or name in outer:
+                    continue
+                if len(real) == 1:
+                    table, available = next(iter(real.values()))
+                    fixed = self._check_column(column, table, available, corrections, errors)
+                    if fixed:
+                        renamed[name] = fixed
+                elif real:
+                    errors.append(f"Column {column.name} does not exist on {', '.join(t for t, _ in real.values())}")
+
+            # ORDER BY may name a select output instead of a source column - carry the renames over
+            order = scope.expression.args.get("order")
+            if order is not None and renamed:
+                for column in order.find_all(exp.Column):
+                    if not column.table and column.name.lower() in renamed:
+                        self._rename(column, renamed[column.name.lower()])
+
+        result["valid"] = not errors
+        if corrections and not errors:
+            result["sql"] = tree.sql(dialect="postgres")
+        return result
+
+
+_schema_validator = None
+
+
+def get_schema_validator() -> SchemaValidator:
+    """Process-wide validator so the catalog is read once per cache period, not per request"""
+    global _schema_validator
+    if _schema_validator is None:
+        _schema_validator = SchemaValidator()
+    return _schema_validator
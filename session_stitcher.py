@@ -0,0 +1,165 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from event_time import combine_date_time
+
+SESSIONS_TABLE = "ipdr_sessions"
+
+MSISDN_COLUMN = "landline_msidn_mdn_leased_circuit_id"
+
+# Fragments belong to the same session only if all of these match - sessions never span cases
+SESSION_KEY_COLUMNS = ["case_id", MSISDN_COLUMN, "source_ip_address", "translated_ip_address",
+                       "translated_port", "access_point_name"]
+
+STITCH_SOURCE_COLUMNS = SESSION_KEY_COLUMNS + [
+    "imei", "imsi", "first_cell_id", "last_cell_id",
+    "start_date_of_public_ip_allocation", "ist_start_time_of_public_ip_allocation",
+    "end_date_of_public_ip_allocation", "ist_end_time_of_public_ip_allocation",
+    "session_duration", "data_volume_up_link", "data_volume_down_link"
+]
+
+SESSION_COLUMNS = [
+    "case_id", "msisdn", "source_ip_address", "translated_ip_address", "translated_port", "access_point_name",
+    "imei", "imsi", "first_cell_id", "last_cell_id", "session_start", "session_end",
+    "fragment_count", "session_duration", "data_volume_up_link", "data_volume_down_link"
+]
+
+DEFAULT_GAP_SECONDS = 60
+
+
+class SessionStitcher:
+    """
+    Merge operator-split IPDR fragments into logical data sessions
+
+    Rows are sorted by session key and start time; a new session begins when the
+    key changes or a fragment starts more than gap_seconds after the furthest end
+    seen so far in the current session.
+    """
+
+    def __init__(self, gap_seconds: int = DEFAULT_GAP_SECONDS, verbose=False):
+        self.gap = pd.Timedelta(seconds=gap_seconds)
+        self.verbose = verbose
+
+    def stitch(self, records: List[Dict]) -> pd.DataFrame:
+        """Stitch raw ipdr records into sessions (one row per session)"""
+        df = pd.DataFrame(records)
+        for column in STITCH_SOURCE_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+
+        df["_start"] = combine_date_time(df["start_date_of_public_ip_allocation"], df["ist_start_time_of_public_ip_allocation"])
+        df["_end"] = combine_date_time(df["end_date_of_public_ip_allocation"], df["ist_end_time_of_public_ip_allocation"])
+        df = df[df["_start"].notna() & df[MSISDN_COLUMN].notna()]
+        if df.empty:
+            return pd.DataFrame(columns=SESSION_COLUMNS)
+
+        # Open fragments end where they start; fragments crossing midnight without an end date roll over
+        df["_end"] = df["_end"].fillna(df["_start"])
+        df.loc[df["_end"] < df["_start"], "_end"] += pd.Timedelta(days=1)
+
+        for column in ["session_duration", "data_volume_up_link", "data_volume_down_link"]:
+            df[column] = pd.to_numeric(df[column], errors="coerce").fillna(0).astype(np.int64)
+        for column in SESSION_KEY_COLUMNS:
+            df[column] = df[column].astype(str).where(df[column].notna(), "")
+
+        df["_key"] = df.groupby(SESSION_KEY_COLUMNS, sort=False).ngroup()
+        df = df.sort_values(["_key", "_start"], kind="mergesort").reset_index(drop=True)
+
+        # Furthest end reached so far within each key, shifted to compare against the next fragment
+        reach = df.groupby("_key")["_end"].cummax()
+        previous_reach = reach.groupby(df["_key"]).shift(1)
+        new_session = previous_reach.isna() | (df["_start"] > previous_reach + self.gap)
+        df["_session"] = np.cumsum(new_session.values)
+
+        grouped = df.groupby("_session", sort=False)
+        sessions = grouped.agg(
+            case_id=("case_id", "first"),
+            msisdn=(MSISDN_COLUMN, "first"),
+            source_ip_address=("source_ip_address", "first"),
+            translated_ip_address=("translated_ip_address", "first"),
+            translated_port=("translated_port", "first"),
+            access_point_name=("access_point_name", "first"),
+            imei=("imei", "first"),
+            imsi=("imsi", "first"),
+            first_cell_id=("first_cell_id", "first"),
+            last_cell_id=("last_cell_id", "last"),
+            session_start=("_start", "min"),
+            session_end=("_end", "max"),
+            fragment_count=("_start", "size"),
+            session_duration=("session_duration", "sum"),
+            data_volume_up_link=("data_volume_up_link", "sum"),
+            data_volume_down_link=("data_volume_down_link", "sum"),
+        ).reset_index(drop=True)
+
+        # Key columns were blank-filled for grouping - restore NULLs
+        for column in ["source_ip_address", "translated_ip_address", "translated_port", "access_point_name"]:
+            sessions[column] = sessions[column].replace("", None)
+        sessions["translated_port"] = pd.to_numeric(sessions["translated_port"], errors="coerce").astype("Int64")
+
+        if self.verbose:
+            print(f"🧵 Stitched {len(df):,} IPDR fragments into {len(sessions):,} sessions")
+        return sessions[SESSION_COLUMNS]
+
+    def refresh_sessions(self, supabase_handler, msisdns: List[str], case_id: Optional[str] = None) -> Tuple[bool, str]:
+        """Re-stitch every fragment of the given MSISDNs in one case and replace their rows in ipdr_sessions"""
+        msisdns = sorted({str(m) for m in msisdns if m is not None})
+        if not msisdns:
+            return True, "No MSISDNs to stitch"
+        # Sessions of fragments loaded without a case are stored under ''
+        case_id = case_id or ""
+
+        sql = (f"SELECT {', '.join(STITCH_SOURCE_COLUMNS)} FROM ipdr "
+               f"WHERE {MSISDN_COLUMN} = ANY(%s) AND coalesce(case_id, '') = %s")
+        success, message, rows = supabase_handler.execute_raw_sql(sql, (msisdns, case_id))
+        if not success:
+            return False, message
+
+        sessions = self.stitch(rows)
+        values = [tuple(None if pd.isna(v) else (v.to_pydatetime() if isinstance(v, pd.Timestamp) else v)
+                        for v in row)
+                  for row in sessions.astype(object).itertuples(index=False, name=None)]
+
+        return supabase_handler.bulk_write(
+            f"INSERT INTO {SESSIONS_TABLE} ({', '.join(SESSION_COLUMNS)}) VALUES %s",
+            values,
+            setup=[(f"DELETE FROM {SESSIONS_TABLE} WHERE case_id = %s AND msisdn = ANY(%s)", (case_id, msisdns))]
+        )[:2]
+
+    def refresh_records(self, supabase_handler, records: List[Dict]) -> Tuple[bool, str]:
+        """Re-stitch the (case, MSISDN) pairs a batch of ipdr records touched"""
+        by_case: Dict[str, set] = {}
+        for record in records:
+            by_case.setdefault(record.get("case_id") or "", set()).add(record.get(MSISDN_COLUMN))
+        for case_id, msisdns in by_case.items():
+            success, message = self.refresh_sessions(supabase_handler, list(msisdns), case_id)
+            if not success:
+                return False, message
+        return True, f"Stitched sessions for {sum(len(m) for m in by_case.values())} MSISDNs"
+
+    def rescope_sessions(self, supabase_handler) -> Tuple[bool, str]:
+        """
+        Re-stitch MSISDNs whose case fragments have no sessions of their case yet -
+        sessions stitched before ipdr_sessions carried case_id merged every case under ''
+        """
+        success, message, rows = supabase_handler.execute_raw_sql(
+            f"SELECT DISTINCT {MSISDN_COLUMN} AS msisdn FROM ipdr i WHERE case_id IS NOT NULL "
+            f"AND {MSISDN_COLUMN} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {SESSIONS_TABLE} s "
+            f"WHERE s.case_id = i.case_id AND s.msisdn = i.{MSISDN_COLUMN}::text)")
+        if not success:
+            return False, message
+        msisdns = [str(row["msisdn"]) for row in rows]
+        if not msisdns:
+            return True, "Every case's sessions are stitched"
+
+        success, message, _ = supabase_handler.execute_raw_sql(
+            f"DELETE FROM {SESSIONS_TABLE} WHERE case_id = '' AND msisdn = ANY(%s)", (msisdns,))
+        if not success:
+            return False, message
+        success, message, pairs = supabase_handler.execute_raw_sql(
+            f"SELECT DISTINCT case_id, {MSISDN_COLUMN} FROM ipdr WHERE {MSISDN_COLUMN} = ANY(%s)", (msisdns,))
+        if not success:
+            return False, message
+        success, message = self.refresh_records(supabase_handler, pairs)
+        return success, f"Re-stitched {len(msisdns)} MSISDNs per case" if success else message
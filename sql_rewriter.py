@@ -0,0 +1,218 @@
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import CELL_ATTRIBUTES_IN_DIMENSION_ONLY, QUERY_REWRITE_ROW_LIMIT
+from cell_dictionary import CELL_ATTRIBUTE_COLUMNS, CELL_KEY_COLUMNS, CELLS_TABLE
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+    print("⚠️ sqlglot not available, agent SQL will run unrewritten. Install with: pip install sqlglot")
+
+# What the context consolidator reports on: parties, time, devices, location and volumes.
+# SELECT * on these tables is narrowed to this list; other tables are left alone.
+CONSOLIDATOR_COLUMNS = {
+    "crd": ["a_party", "b_party", "event_ts", "duration", "call_type", "first_cell_id_a", "last_cell_id_a",
+            "imei_a", "imsi_a", "first_cell_id_a_address", "latitude", "longitude"],
+    "tower_dumps": ["a_party", "b_party", "event_ts", "duration", "call_type", "first_cell_id_a", "last_cell_id_a",
+                    "imei_a", "imsi_a", "first_cell_id_a_address", "roaming_a", "latitude", "longitude"],
+    "ipdr": ["landline_msidn_mdn_leased_circuit_id", "event_ts", "source_ip_address", "destination_ip_address",
+             "destination_port", "imei", "imsi", "access_point_name", "first_cell_id", "session_duration",
+             "data_volume_up_link", "data_volume_down_link", "roaming_circle"],
+    "subscriber": ["phone_number", "alternative_mobile_no", "subscriber_name", "guardian_name", "address",
+                   "date_of_activation", "type_of_connection", "service_provider"],
+}
+
+# varchar compares with a string literal exactly like text does
+TEXT_TYPES = {"text", "varchar"}
+INTEGER_TYPES = {"integer", "bigint"}
+TIMESTAMP_TYPES = {"timestamp"}
+
+
+class SQLRewriter:
+    """
+    Parse agent SQL and rewrite it into something cheaper that means the same thing
+
+    Rules, each applied only where it is provably equivalent for the column types in
+    the live catalog (the type-dependent rules are skipped when none is given):
+    - lower_to_plain: LOWER(text_col) compared with a literal that has no letters
+    - cast_to_plain: CAST(col AS text) = 'literal' on text columns, or on integer
+      columns against an all-digit literal (compared as a number instead)
+    - date_to_range: DATE(ts) / ts::date = 'YYYY-MM-DD' (or BETWEEN) becomes a
+      half-open event_ts range the btree and BRIN indexes can use
+    - prune_star: SELECT * from one evidence table lists CONSOLIDATOR_COLUMNS
+    - inject_limit: the outer query gets LIMIT row_limit unless it already has one
+      or is a plain aggregate
+    """
+
+    def __init__(self, row_limit: int = QUERY_REWRITE_ROW_LIMIT, column_types: Optional[Dict[str, Dict[str, str]]] = None):
+        """column_types: lower-cased table -> column -> data type, as SchemaValidator.catalog_types returns"""
+        self.row_limit = row_limit
+        self.column_types = column_types or {}
+
+    def rewrite(self, sql_query: str) -> Tuple[str, List[Dict]]:
+        """
+        Returns:
+            (sql_to_run, rewrites) - rewrites lists {'rule', 'before', 'after'}; the SQL is
+            returned untouched when sqlglot is missing or cannot parse it
+        """
+        if not SQLGLOT_AVAILABLE or not sql_query.strip():
+            return sql_query, []
+        try:
+            tree = sqlglot.parse_one(sql_query.strip().rstrip(";"), read="postgres")
+        except Exception:
+            return sql_query, []
+        if not isinstance(tree, (exp.Select, exp.Union)):
+            return sql_query, []
+
+        rewrites = []
+        for select in list(tree.find_all(exp.Select)):
+            aliases = self._aliases(select)
+            self._normalize_predicates(select, aliases, rewrites)
+        self._prune_star(tree, rewrites)
+        self._inject_limit(tree, rewrites)
+
+        if not rewrites:
+            return sql_query, []
+        return tree.sql(dialect="postgres"), rewrites
+
+    def _aliases(self, select) -> Dict[str, str]:
+        """Alias (or bare name) -> known table for the tables this SELECT reads directly"""
+        aliases = {}
+        sources = [select.args.get("from_") or select.args.get("from")] + list(select.args.get("joins") or [])
+        for source in sources:
+            table = source.this if source is not None else None
+            if isinstance(table, exp.Table) and table.name.lower() in self.column_types:
+                aliases[(table.alias or table.name).lower()] = table.name.lower()
+        return aliases
+
+    def _column_type(self, column, aliases: Dict[str, str]) -> Optional[str]:
+        if not isinstance(column, exp.Column):
+            return None
+        name = column.name.lower()
+        if column.table:
+            table = aliases.get(column.table.lower())
+            return self.column_types[table].get(name) if table else None
+        # Unqualified: only trust it when exactly one table in scope has the column
+        matches = [t for t in set(aliases.values()) if name in self.column_types[t]]
+        return self.column_types[matches[0]][name] if len(matches) == 1 else None
+
+    def _normalize_predicates(self, select, aliases: Dict[str, str], rewrites: List[Dict]):
+        where = select.args.get("where")
+        if where is None or not aliases:
+            return
+
+        for node in list(where.find_all(exp.EQ, exp.NEQ, exp.Like, exp.In, exp.Between)):
+            before = node.sql(dialect="postgres")
+            applied = (self._lower_to_plain(node, aliases) or self._cast_to_plain(node, aliases)
+                       or self._date_to_range(node, aliases))
+            if applied:
+                rule, after = applied
+                rewrites.append({"rule": rule, "before": before, "after": after.sql(dialect="postgres")})
+
+    @staticmethod
+    def _literals(node) -> List:
+        if isinstance(node, exp.In):
+            return list(node.expressions)
+        if isinstance(node, exp.Between):
+            return [node.args.get("low"), node.args.get("high")]
+        return [node.expression]
+
+    def _lower_to_plain(self, node, aliases) -> Optional[Tuple[str, object]]:
+        target = node.this
+        if not isinstance(target, exp.Lower) or self._column_type(target.this, aliases) not in TEXT_TYPES:
+            return None
+        literals = self._literals(node)
+        # LOWER(x) = '123' only matches x = '123' when the literal has no cased characters
+        if not all(isinstance(l, exp.Literal) and l.is_string and l.this == l.this.swapcase() for l in literals):
+            return None
+        target.replace(target.this)
+        return "lower_to_plain", node
+
+    def _cast_to_plain(self, node, aliases) -> Optional[Tuple[str, object]]:
+        target = node.this
+        if not isinstance(target, exp.Cast) or not target.to.is_type("text", "varchar"):
+            return None
+        kind = self._column_type(target.this, aliases)
+        literals = self._literals(node)
+        if not all(isinstance(l, exp.Literal) and l.is_string for l in literals):
+            return None
+
+        if kind in TEXT_TYPES:
+            target.replace(target.this)
+        elif kind in INTEGER_TYPES and not isinstance(node, exp.Like) \
+                and all(l.this.isdigit() and (l.this == "0" or not l.this.startswith("0")) for l in literals):
+            # '0987'::bigint would drop the zero, so only canonical digit strings compare as numbers
+            target.replace(target.this)
+            for literal in literals:
+                literal.replace(exp.Literal.number(literal.this))
+        else:
+            return None
+        return "cast_to_plain", node
+
+    def _date_to_range(self, node, aliases) -> Optional[Tuple[str, object]]:
+        target = node.this
+        if isinstance(target, exp.Cast) and target.to.is_type("date"):
+            column = target.this
+        elif isinstance(target, (exp.Date, exp.TsOrDsToDate)) or (
+                isinstance(target, exp.Anonymous) and target.name.lower() == "date"):
+            column = target.this if not isinstance(target, exp.Anonymous) else (target.expressions or [None])[0]
+        else:
+            return None
+        if self._column_type(column, aliases) not in TIMESTAMP_TYPES or isinstance(node, (exp.Like, exp.In, exp.NEQ)):
+            return None
+
+        try:
+            literals = [date.fromisoformat(l.this) for l in self._literals(node)
+                        if isinstance(l, exp.Literal) and l.is_string]
+        except ValueError:
+            return None
+        if len(literals) != len(self._literals(node)):
+            return None
+
+        low, high = literals[0], literals[-1] + timedelta(days=1)
+        replacement = exp.and_(
+            exp.GTE(this=column.copy(), expression=exp.Literal.string(low.isoformat())),
+            exp.LT(this=column.copy(), expression=exp.Literal.string(high.isoformat())),
+        )
+        replacement = exp.Paren(this=replacement)
+        node.replace(replacement)
+        return "date_to_range", replacement
+
+    @staticmethod
+    def _prune_star(tree, rewrites: List[Dict]):
+        if not isinstance(tree, exp.Select) or tree.args.get("joins") or tree.args.get("distinct") \
+                or len(tree.expressions) != 1 or not isinstance(tree.expressions[0], exp.Star):
+            return
+        source = tree.args.get("from_") or tree.args.get("from")
+        table = source.this if source is not None else None
+        if not isinstance(table, exp.Table) or table.name.lower() not in CONSOLIDATOR_COLUMNS:
+            return
+        columns = CONSOLIDATOR_COLUMNS[table.name.lower()]
+        tree.set("expressions", [SQLRewriter._consolidator_column(table, c) for c in columns])
+        rewrites.append({"rule": "prune_star", "before": "SELECT *", "after": f"SELECT {', '.join(columns)}"})
+
+    @staticmethod
+    def _consolidator_column(table, column: str):
+        """The column itself, or - when cell attributes live only in cells - a lookup through the cell key"""
+        if not CELL_ATTRIBUTES_IN_DIMENSION_ONLY or table.name.lower() not in CELL_KEY_COLUMNS \
+                or column not in CELL_ATTRIBUTE_COLUMNS:
+            return exp.column(column)
+        key = CELL_KEY_COLUMNS[table.name.lower()]["first_cell_id_a"]
+        source = table.alias or table.name
+        return sqlglot.parse_one(
+            f"(SELECT {CELL_ATTRIBUTE_COLUMNS[column]} FROM {CELLS_TABLE} WHERE {CELLS_TABLE}.cell_key = {source}.{key}) "
+            f"AS {column}", read="postgres")
+
+    def _inject_limit(self, tree, rewrites: List[Dict]):
+        if not self.row_limit or tree.args.get("limit") is not None:
+            return
+        # A plain aggregate returns one row already
+        if isinstance(tree, exp.Select) and not tree.args.get("group") \
+                and all(e.find(exp.AggFunc) for e in tree.expressions):
+            return
+        tree.set("limit", exp.Limit(expression=exp.Literal.number(self.row_limit)))
+        rewrites.append({"rule": "inject_limit", "before": "(no LIMIT)", "after": f"LIMIT {self.row_limit}"})
@@ -1,14 +1,56 @@
 import sys
+import time
 import asyncio
 import concurrent.futures
 from typing import List, Dict, Optional, Tuple
-from config import SUPABASE_URL, SUPABASE_ANON_KEY, POSTGRES_URL, POSTGRES_URL_ALTERNATIVES
+from config import SUPABASE_URL, SUPABASE_ANON_KEY, POSTGRES_URL, POSTGRES_URL_ALTERNATIVES, QUERY_STATEMENT_TIMEOUT_MS, QUERY_REWRITE_ENABLED, \
+    QUERY_REWRITE_ROW_LIMIT, POPULATION_STATS_ENABLED, TABLE_SCHEMAS, FALLBACK_PAGE_SIZE, FALLBACK_MAX_ROWS, FALLBACK_WORKERS, \
+    QUERY_CACHE_ENABLED
+from identity_resolver import add_loaded_records
+from ip_index import cidr_predicate
+from session_stitcher import SessionStitcher
+from party_summary import PartySummarizer
+from contact_edges import ContactEdgeBuilder
+from tower_sketches import TowerSketchBuilder
+from dump_filters import DumpFilterIndex
+from partitioning import PartitionManager
+from case_scope import CASE_COLUMN, CASE_SCOPED_TABLES, normalize_case_id, scope_sql_to_case
+from index_advisor import get_index_advisor
+from query_gate import QueryCostGate
+from sql_rewriter import SQLRewriter
+from population_stats import wrap_with_population_stats, unpack_population
+from schema_validator import get_schema_validator
+from batch_executor import BatchExecutor
+from query_cache import VERSIONS_TABLE, get_query_cache, cacheable_tables, written_tables
+from postgrest_translator import UntranslatableQuery, parse_select, source_table, translate_filters, \
+    translate_columns, translate_order, translate_limit
+
+
+def _is_missing(value) -> bool:
+    """None or a float NaN - stored as NULL rather than as the text 'None' / 'nan'"""
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _coordinate(value) -> Optional[float]:
+    """Latitude/longitude as a float; missing or unparseable values stay NULL rather than becoming 0.0"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and not _is_missing(float(value)):
+        return float(value)
+    return None
+
 
 class SupabaseHandler:
     def __init__(self, verbose=False):
         self.client = None
         self.pg_connection = None
         self.verbose = verbose
+        self.partitions = PartitionManager(self, verbose=verbose)
+        self.active_case_id = None
+        self.last_gate_verdict = None
         self._initialize_client()
         self._initialize_postgres_connection()
     
@@ -97,25 +139,31 @@ class SupabaseHandler:
                 print(f"❌ Failed to connect to PostgreSQL: {e}")
             self.pg_connection = None
     
-    def execute_raw_sql(self, sql_query: str) -> Tuple[bool, str, List[Dict]]:
+    def execute_raw_sql(self, sql_query: str, params=None, timeout_ms: Optional[int] = None) -> Tuple[bool, str, List[Dict]]:
         """
         Execute raw SQL query directly against PostgreSQL database
         This bypasses all parsing and executes the SQL as-is
+        Optional params are bound by psycopg2 (%s placeholders)
+        Optional timeout_ms applies a statement_timeout to this statement only
         """
         print(f"\n🔥 [RAW SQL] Executing direct SQL query:")
         print(f"   📝 SQL: {sql_query}")
-        
+
         if not self.pg_connection:
             error_msg = "PostgreSQL connection not available"
             print(f"   ❌ {error_msg}")
             return False, error_msg, []
-        
+
         try:
             cursor = self.pg_connection.cursor()
-            
+
+            # SET LOCAL lasts until the end of this transaction, which is closed below
+            if timeout_ms:
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+
             # Execute the raw SQL
             print(f"   ⚡ Executing query directly...")
-            cursor.execute(sql_query)
+            cursor.execute(sql_query, params)
             
             # Fetch results
             if cursor.description:  # SELECT query
@@ -135,11 +183,14 @@ class SupabaseHandler:
                     print(f"   📋 Columns: {list(results[0].keys())}")
                 
                 cursor.close()
+                if timeout_ms:
+                    self.pg_connection.commit()
                 return True, f"Successfully executed SQL query, retrieved {len(results)} records", results
             else:  # Non-SELECT query (INSERT, UPDATE, DELETE)
                 affected_rows = cursor.rowcount
                 self.pg_connection.commit()
                 cursor.close()
+                self._bump_table_versions(written_tables(sql_query))
                 print(f"   ✅ Query successful! Affected {affected_rows} rows")
                 return True, f"Successfully executed SQL query, affected {affected_rows} rows", []
                 
@@ -152,20 +203,139 @@ class SupabaseHandler:
                 pass
             return False, error_msg, []
     
-    def execute_postgresql_query(self, sql_query: str) -> Tuple[bool, str, List[Dict]]:
+    def bulk_write(self, sql_query: str, rows: List[tuple], setup: Optional[List[Tuple[str, tuple]]] = None,
+                   page_size: int = 1000) -> Tuple[bool, str, int]:
+        """
+        Write many rows in a single transaction using psycopg2's execute_values
+
+        Args:
+            sql_query: INSERT ... VALUES %s statement (may include ON CONFLICT)
+            rows: Row tuples matching the VALUES list
+            setup: (sql, params) statements run first in the same transaction, e.g. a DELETE
+            page_size: Rows per generated VALUES statement
+        """
+        if not self.pg_connection:
+            return False, "PostgreSQL connection not available", 0
+
+        try:
+            from psycopg2.extras import execute_values
+
+            cursor = self.pg_connection.cursor()
+            for statement, params in (setup or []):
+                cursor.execute(statement, params)
+            if rows:
+                execute_values(cursor, sql_query, rows, page_size=page_size)
+            self.pg_connection.commit()
+            cursor.close()
+            self._bump_table_versions(written_tables(sql_query) + [t for statement, _ in (setup or [])
+                                                                   for t in written_tables(statement)])
+            return True, f"Wrote {len(rows)} rows", len(rows)
+
+        except Exception as e:
+            try:
+                self.pg_connection.rollback()
+            except:
+                pass
+            return False, f"Bulk write failed: {str(e)}", 0
+
+    def execute_transaction(self, statements: List[Tuple[str, Optional[tuple]]]) -> Tuple[bool, str]:
+        """Run several statements atomically - all commit or none do"""
+        if not self.pg_connection:
+            return False, "PostgreSQL connection not available"
+
+        try:
+            cursor = self.pg_connection.cursor()
+            for statement, params in statements:
+                cursor.execute(statement, params)
+            self.pg_connection.commit()
+            cursor.close()
+            self._bump_table_versions([t for statement, _ in statements for t in written_tables(statement)])
+            return True, f"Committed {len(statements)} statements"
+
+        except Exception as e:
+            try:
+                self.pg_connection.rollback()
+            except:
+                pass
+            return False, f"Transaction failed: {str(e)}"
+
+    def set_active_case(self, case_id: Optional[str]):
+        """Scope every investigation query to one case (None clears the scope)"""
+        self.active_case_id = normalize_case_id(case_id)
+        if self.verbose:
+            print(f"📁 Active case: {self.active_case_id or 'all cases'}")
+
+    def execute_autocommit(self, sql_query: str) -> Tuple[bool, str]:
+        """Run a statement outside a transaction block (e.g. CREATE INDEX CONCURRENTLY)"""
+        if not self.pg_connection:
+            return False, "PostgreSQL connection not available"
+
+        previous = self.pg_connection.autocommit
+        try:
+            self.pg_connection.rollback()
+            self.pg_connection.autocommit = True
+            cursor = self.pg_connection.cursor()
+            cursor.execute(sql_query)
+            cursor.close()
+            return True, "Statement executed"
+        except Exception as e:
+            return False, f"Statement failed: {str(e)}"
+        finally:
+            self.pg_connection.autocommit = previous
+
+    def execute_postgresql_query(self, sql_query: str, cache_tables: Optional[List[str]] = None) -> Tuple[bool, str, List[Dict]]:
         """
         Execute SQL query using PostgreSQL connection (Primary Method)
         Falls back to Supabase client if PostgreSQL fails
+        
+        Results are cached until a table they read is written to. cache_tables names those
+        tables when the SQL is a wrapper around a query they were derived from.
         """
         print(f"\n🐘 [POSTGRES] Executing query via PostgreSQL:")
         print(f"   📝 SQL: {sql_query[:100]}{'...' if len(sql_query) > 100 else ''}")
+        self.last_gate_verdict = None
+        
+        cache_entry = None
+        tables = cache_tables or (cacheable_tables(sql_query) if QUERY_CACHE_ENABLED else None)
+        if tables:
+            database_versions = self._database_versions(tables)
+            if database_versions is not None:
+                cache_entry = self._cache_entry(sql_query, tables, database_versions)
+                cached = get_query_cache().get(*cache_entry)
+                if cached is not None:
+                    self.last_gate_verdict = cached["verdict"]
+                    print(f"   ⚡ Served from result cache: {len(cached['data'])} records")
+                    return True, f"Served from result cache: {len(cached['data'])} records", cached["data"]
         
         if self.pg_connection:
+            # Restrict to the active case before executing
+            scoped_sql = sql_query
+            if self.active_case_id:
+                scoped_sql, scoped_tables = scope_sql_to_case(sql_query, self.active_case_id)
+                if scoped_tables:
+                    print(f"   📁 Scoped {', '.join(scoped_tables)} to case {self.active_case_id}")
+
+            # Pre-flight: EXPLAIN the query and refuse or downgrade anything too expensive
+            verdict = QueryCostGate(self).review(scoped_sql)
+            self.last_gate_verdict = verdict
+            if verdict["status"] == "rejected":
+                print(f"   🚫 Rejected by cost gate: {verdict['reason']}")
+                return False, f"Rejected by cost gate: {verdict['reason']}", []
+            if verdict["status"] == "downgraded":
+                print(f"   ⬇️ Downgraded by cost gate: wrapped in LIMIT (est. {verdict['estimated_rows']:,.0f} rows)")
+
             # Try PostgreSQL first
-            success, message, data = self.execute_raw_sql(sql_query)
+            success, message, data = self.execute_raw_sql(verdict["sql"], timeout_ms=QUERY_STATEMENT_TIMEOUT_MS)
             if success:
                 print(f"   ✅ PostgreSQL execution successful!")
+                if cache_entry:
+                    get_query_cache().put(cache_entry[0], {"data": data, "verdict": verdict}, cache_entry[1])
                 return success, message, data
+            elif "statement timeout" in message:
+                # A query that outlived its budget is reported like a rejection, not retried elsewhere
+                verdict.update(status="timed_out", reason=f"Exceeded statement_timeout of {QUERY_STATEMENT_TIMEOUT_MS} ms")
+                print(f"   ⏱️ {verdict['reason']}")
+                return False, f"Rejected by cost gate: {verdict['reason']}", []
             else:
                 print(f"   ⚠️ PostgreSQL failed: {message}")
                 print(f"   🔄 Trying Supabase fallback...")
@@ -175,40 +345,104 @@ class SupabaseHandler:
         # Fallback to Supabase client if PostgreSQL fails
         return self._execute_via_supabase_fallback(sql_query)
     
+    def _database_versions(self, tables: List[str]) -> Optional[Dict[str, int]]:
+        """Current table_versions counters for the given tables, or None if they cannot be read"""
+        if not QUERY_CACHE_ENABLED or not self.pg_connection:
+            return None
+        cache = get_query_cache()
+        if cache.versions_table_ready is None:
+            success, _, rows = self.execute_raw_sql("SELECT to_regclass(%s) IS NOT NULL AS ready", (VERSIONS_TABLE,))
+            cache.versions_table_ready = success and bool(rows) and bool(rows[0]["ready"])
+        if not cache.versions_table_ready:
+            return None
+        success, _, rows = self.execute_raw_sql(
+            f"SELECT table_name, version FROM {VERSIONS_TABLE} WHERE table_name = ANY(%s)", (list(tables),))
+        if not success:
+            return None
+        return {row["table_name"]: row["version"] for row in rows}
+
+    def table_versions(self, tables: List[str]) -> Optional[Dict[str, tuple]]:
+        """Versions of these tables for caching results derived from them, or None if writes cannot be tracked"""
+        database_versions = self._database_versions(tables)
+        if database_versions is None:
+            return None
+        return get_query_cache().versions(tables, database_versions)
+
+    def _cache_entry(self, sql_query: str, tables: List[str], database_versions: Dict[str, int]) -> Tuple[str, Dict]:
+        """(key, versions) for the result cache; the active case is part of the key"""
+        cache = get_query_cache()
+        return cache.key(sql_query, None, self.active_case_id), cache.versions(tables, database_versions)
+
+    def _bump_table_versions(self, tables: List[str]):
+        """Invalidate cached results that read these tables (the database triggers cover other processes)"""
+        cache = get_query_cache()
+        for table in set(tables):
+            cache.bump(table)
+
     def _execute_via_supabase_fallback(self, sql_query: str) -> Tuple[bool, str, List[Dict]]:
         """
-        Fallback method using Supabase client for simple queries
+        Fallback method using the Supabase client (PostgREST)
+        
+        Projection, filters, ordering, LIMIT/OFFSET and the active case are pushed into
+        PostgREST; rows are fetched in range-paginated requests, several at a time.
+        Queries PostgREST cannot express faithfully fail instead of returning other rows.
         """
         print(f"   🔄 [FALLBACK] Using Supabase client...")
         
+        if not self.client:
+            return False, "Supabase client not available", []
+        
+        try:
+            table_name = self._parse_sql_table(sql_query)
+            columns = self._parse_sql_columns(sql_query)
+            filters = self._parse_sql_filters(sql_query)
+            order = self._parse_sql_order(sql_query)
+            limit, offset = self._parse_sql_limit(sql_query)
+        except UntranslatableQuery as e:
+            error_msg = f"Supabase fallback cannot run this query without changing its result: {str(e)}"
+            print(f"   ❌ {error_msg}")
+            return False, error_msg, []
+        
+        # Concurrent pages need a total order, or rows could repeat or go missing between pages
+        if table_name in TABLE_SCHEMAS and all(column != "id" for column, _ in order):
+            order = order + [("id", False)]
+        wanted = min(limit, FALLBACK_MAX_ROWS) if limit is not None else FALLBACK_MAX_ROWS
+        print(f"   📋 {table_name}: select={columns} filters={len(filters)} order={order} rows<={wanted}")
+        
+        def fetch_page(start: int, size: int) -> List[Dict]:
+            request = self.client.table(table_name).select(columns)
+            if self.active_case_id and table_name in CASE_SCOPED_TABLES:
+                request = request.eq(CASE_COLUMN, self.active_case_id)
+            for column, operator, criteria in filters:
+                request = request.or_(criteria) if operator == "or" else request.filter(column, operator, criteria)
+            for column, descending in order:
+                request = request.order(column, desc=descending)
+            result = request.range(start, start + size - 1).execute()
+            return result.data or []
+        
         try:
-            # Parse the SQL to extract table name and basic operations
-            sql_lower = sql_query.lower().strip()
+            rows = fetch_page(offset, min(FALLBACK_PAGE_SIZE, wanted))
+            exhausted = len(rows) < min(FALLBACK_PAGE_SIZE, wanted)
             
-            if sql_lower.startswith('select'):
-                # Extract table name using regex
-                import re
-                table_match = re.search(r'from\s+(\w+)', sql_lower)
-                if table_match:
-                    table_name = table_match.group(1)
-                    print(f"   📋 Extracted table: {table_name}")
-                    
-                    # Use existing Supabase methods for simple SELECT
-                    if self.client:
-                        result = self.client.table(table_name).select("*").limit(1000).execute()
-                        
-                        if hasattr(result, 'data') and result.data:
-                            print(f"   ✅ Supabase fallback successful: {len(result.data)} records")
-                            return True, f"Supabase fallback successful: {len(result.data)} records", result.data
-                        else:
-                            print(f"   ✅ Supabase fallback successful: 0 records")
-                            return True, "Supabase fallback successful: 0 records", []
-                    else:
-                        return False, "Supabase client not available", []
-                else:
-                    return False, "Could not parse table name from SQL", []
-            else:
-                return False, "Supabase fallback only supports SELECT queries", []
+            # Later pages go out in waves of FALLBACK_WORKERS until one comes back short
+            with concurrent.futures.ThreadPoolExecutor(max_workers=FALLBACK_WORKERS) as executor:
+                while not exhausted and len(rows) < wanted:
+                    starts = [offset + len(rows) + i * FALLBACK_PAGE_SIZE for i in range(FALLBACK_WORKERS)]
+                    starts = [start for start in starts if start - offset < wanted]
+                    sizes = [min(FALLBACK_PAGE_SIZE, offset + wanted - start) for start in starts]
+                    pages = list(executor.map(fetch_page, starts, sizes))
+                    for page, size in zip(pages, sizes):
+                        rows.extend(page)
+                        if len(page) < size:
+                            exhausted = True
+                            break
+            
+            truncated = not exhausted and limit is None
+            message = f"Supabase fallback successful: {len(rows)} records"
+            if truncated:
+                message += f" (stopped at FALLBACK_MAX_ROWS={FALLBACK_MAX_ROWS})"
+            print(f"   ✅ {message}")
+            return True, message, rows
                 
         except Exception as e:
             error_msg = f"Supabase fallback failed: {str(e)}"
@@ -354,10 +588,27 @@ class SupabaseHandler:
                             continue
             return inserted
     
-    def insert_data(self, table_name: str, data: List[Dict]) -> Tuple[bool, str, Optional[int]]:
-        """Smart insertion method - automatically chooses optimal strategy based on data size"""
+    def insert_data(self, table_name: str, data: List[Dict], case_id: Optional[str] = None,
+                    source_name: Optional[str] = None) -> Tuple[bool, str, Optional[int]]:
+        """
+        Smart insertion method - automatically chooses optimal strategy based on data size
+        source_name (the file or sheet loaded) is recorded with tower dump loads
+        """
         if not data:
             return False, "No data to insert", None
+
+        # Tag every row with the case it was loaded for
+        case_id = normalize_case_id(case_id)
+        if case_id:
+            for record in data:
+                record[CASE_COLUMN] = case_id
+
+        # Each tower dump load gets an id (and, once loaded, a Bloom filter of its numbers)
+        if table_name == 'tower_dumps' and self.pg_connection:
+            load_id = DumpFilterIndex(verbose=self.verbose).register_load(self, case_id, source_name)
+            if load_id:
+                for record in data:
+                    record['load_id'] = load_id
         
         # DEBUG: Print insertion details
         print(f"\n🔍 DEBUG - Attempting to insert {len(data)} records into '{table_name}'")
@@ -371,23 +622,15 @@ class SupabaseHandler:
         # Pre-process CRD data to ensure proper types
         if table_name == 'crd':
             for record in data:
-                # Convert phone numbers, IMEI and IMSI to strings
+                # Convert phone numbers, IMEI and IMSI to strings (missing values stay NULL, not 'None')
                 for field in ['a_party', 'b_party', 'imei_a', 'imsi_a']:
                     if field in record and not isinstance(record[field], str):
-                        record[field] = str(record[field])
+                        record[field] = None if _is_missing(record[field]) else str(record[field])
                         
                 # Ensure latitude and longitude are proper double precision values
                 for field in ['latitude', 'longitude']:
                     if field in record:
-                        if isinstance(record[field], (int, float)):
-                            record[field] = float(record[field])
-                        elif isinstance(record[field], str):
-                            try:
-                                record[field] = float(record[field])
-                            except ValueError:
-                                record[field] = 0.0
-                        else:
-                            record[field] = 0.0
+                        record[field] = _coordinate(record[field])
         
         # Pre-process bank_details data to ensure proper types
         if table_name == 'bank_details':
@@ -448,7 +691,7 @@ class SupabaseHandler:
                 for field in ['a_party', 'b_party', 'date', 'time', 'duration', 'imei_a', 'imsi_a', 
                              'first_cell_id_a', 'last_cell_id_a', 'first_cell_id_a_address', 'roaming_a']:
                     if field in record and not isinstance(record[field], str):
-                        record[field] = str(record[field])
+                        record[field] = None if _is_missing(record[field]) else str(record[field])
                 
                 # Ensure call_type is one of the allowed values
                 if 'call_type' in record:
@@ -464,15 +707,7 @@ class SupabaseHandler:
                 # Ensure latitude and longitude are proper double precision values
                 for field in ['latitude', 'longitude']:
                     if field in record:
-                        if isinstance(record[field], (int, float)):
-                            record[field] = float(record[field])
-                        elif isinstance(record[field], str):
-                            try:
-                                record[field] = float(record[field])
-                            except ValueError:
-                                record[field] = 0.0
-                        else:
-                            record[field] = 0.0
+                        record[field] = _coordinate(record[field])
         
         # Pre-process IPDR data to ensure proper types
         if table_name == 'ipdr':
@@ -480,31 +715,99 @@ class SupabaseHandler:
                 # Convert text fields that were previously bigint
                 for field in ['landline_msidn_mdn_leased_circuit_id', 'user_id']:
                     if field in record and not isinstance(record[field], str):
-                        record[field] = str(record[field])
+                        record[field] = None if _is_missing(record[field]) else str(record[field])
                 
                 # Convert IP address fields to text
                 for field in ['source_ip_address', 'translated_ip_address', 'destination_ip_address']:
                     if field in record and not isinstance(record[field], str):
-                        record[field] = str(record[field])
+                        record[field] = None if _is_missing(record[field]) else str(record[field])
         
+        self._before_insert(table_name, data)
+
         data_size = len(data)
-        
+
         if data_size > 10000:
             # Use parallel processing for very large datasets
             if self.verbose:
                 print(f"📊 Large dataset ({data_size:,} records) - Using PARALLEL processing")
-            return self.insert_data_parallel(table_name, data, max_workers=6)
+            result = self.insert_data_parallel(table_name, data, max_workers=6)
         elif data_size > 1000:
             # Use ultra-fast mode for medium-large datasets
             if self.verbose:
                 print(f"📊 Medium dataset ({data_size:,} records) - Using ULTRA-FAST processing")
-            return self.insert_data_ultra_fast(table_name, data)
+            result = self.insert_data_ultra_fast(table_name, data)
         else:
             # Use original method for small datasets (with debugging)
             if self.verbose:
                 print(f"📊 Small dataset ({data_size:,} records) - Using STANDARD processing")
-            return self._insert_data_original(table_name, data)
-    
+            result = self._insert_data_original(table_name, data)
+
+        # Even a partly failed load may have written rows, so cached reads of the table are dropped either way
+        self._bump_table_versions([table_name])
+        if result[0]:
+            self._after_insert(table_name, data)
+
+        return result
+
+    def _before_insert(self, table_name: str, data: List[Dict]):
+        """Prepare storage for a batch (e.g. create the monthly partitions it will route into)"""
+        if not self.pg_connection:
+            return
+
+        try:
+            success, message = self.partitions.ensure_for_records(table_name, data)
+            if not success:
+                print(f"⚠️ Partition maintenance failed, rows will land in {table_name}_default: {message}")
+        except Exception as e:
+            print(f"⚠️ Partition maintenance failed: {str(e)}")
+
+    def _after_insert(self, table_name: str, data: List[Dict]):
+        """Update derived indexes after a successful load"""
+        try:
+            merges = add_loaded_records(table_name, data, data[0].get(CASE_COLUMN) if data else None)
+            if self.verbose and merges:
+                print(f"🔗 Identity index: {merges} new number/IMEI/IMSI links")
+        except Exception as e:
+            print(f"⚠️ Identity index update failed: {str(e)}")
+
+        # Derived tables below are maintained over the direct PostgreSQL connection
+        if not self.pg_connection:
+            return
+
+        if table_name == 'ipdr':
+            try:
+                success, message = SessionStitcher(verbose=self.verbose).refresh_records(self, data)
+                if not success:
+                    print(f"⚠️ IPDR session stitching failed: {message}")
+            except Exception as e:
+                print(f"⚠️ IPDR session stitching failed: {str(e)}")
+
+        if table_name == 'crd':
+            for name, builder in (("Party summary", PartySummarizer), ("Contact edge", ContactEdgeBuilder)):
+                try:
+                    success, message = builder(verbose=self.verbose).merge(self, data)
+                    if not success:
+                        print(f"⚠️ {name} update failed: {message}")
+                except Exception as e:
+                    print(f"⚠️ {name} update failed: {str(e)}")
+
+        if table_name == 'tower_dumps':
+            try:
+                success, message = TowerSketchBuilder(verbose=self.verbose).merge(self, data)
+                if not success:
+                    print(f"⚠️ Tower sketch update failed: {message}")
+            except Exception as e:
+                print(f"⚠️ Tower sketch update failed: {str(e)}")
+
+            load_id = data[0].get('load_id')
+            if load_id:
+                try:
+                    success, message = DumpFilterIndex(verbose=self.verbose).complete_load(self, load_id, data)
+                    if not success:
+                        print(f"⚠️ Tower dump filter not stored, the load will always be searched: {message}")
+                except Exception as e:
+                    print(f"⚠️ Tower dump filter not stored, the load will always be searched: {str(e)}")
+
     def _insert_data_original(self, table_name: str, data: List[Dict]) -> Tuple[bool, str, Optional[int]]:
         """Original insertion method with full debugging (for small datasets)"""
         try:
@@ -532,7 +835,7 @@ class SupabaseHandler:
                                 if key in ['a_party', 'b_party', 'date', 'time', 'duration', 'imei_a', 'imsi_a', 
                                           'first_cell_id_a', 'last_cell_id_a', 'first_cell_id_a_address', 'roaming_a']:
                                     # Convert all text fields to strings
-                                    fixed_record[key] = str(value) if value is not None else ""
+                                    fixed_record[key] = None if _is_missing(value) else str(value)
                                 elif key == 'call_type':
                                     # Ensure call_type is one of the allowed values
                                     if isinstance(value, str):
@@ -545,15 +848,7 @@ class SupabaseHandler:
                                         fixed_record[key] = 'CALL-IN'  # Default value
                                 elif key in ['latitude', 'longitude']:
                                     # Ensure proper double precision format
-                                    if isinstance(value, (int, float)):
-                                        fixed_record[key] = float(value)
-                                    elif isinstance(value, str):
-                                        try:
-                                            fixed_record[key] = float(value)
-                                        except ValueError:
-                                            fixed_record[key] = 0.0
-                                    else:
-                                        fixed_record[key] = 0.0
+                                    fixed_record[key] = _coordinate(value)
                                 else:
                                     fixed_record[key] = value
                             elif table_name == 'crd':
@@ -565,15 +860,7 @@ class SupabaseHandler:
                                     fixed_record[key] = str(int(value))
                                 elif key in ['latitude', 'longitude']:
                                     # Ensure proper double precision format
-                                    if isinstance(value, (int, float)):
-                                        fixed_record[key] = float(value)
-                                    elif isinstance(value, str):
-                                        try:
-                                            fixed_record[key] = float(value)
-                                        except ValueError:
-                                            fixed_record[key] = 0.0
-                                    else:
-                                        fixed_record[key] = 0.0
+                                    fixed_record[key] = _coordinate(value)
                                 else:
                                     fixed_record[key] = value
                             elif table_name == 'bank_details':
@@ -823,6 +1110,31 @@ class SupabaseHandler:
             print(f"   ❌ {error_msg}")
             return False, error_msg, []
     
+    def find_sessions_in_cidr(self, cidr: str, direction: str = "destination", limit: int = 1000) -> Tuple[bool, str, List[Dict]]:
+        """
+        Fetch IPDR sessions of the active case whose address falls inside a CIDR block
+        Uses the integer-encoded IP columns so the lookup is a btree range scan
+
+        Args:
+            cidr: Block such as '157.240.0.0/16' or '2a03:2880::/32'
+            direction: 'source', 'translated' or 'destination'
+            limit: Maximum number of sessions to return
+        """
+        if direction not in ('source', 'translated', 'destination'):
+            return False, f"Unknown address direction: {direction}", []
+
+        try:
+            predicate, params = cidr_predicate(cidr, f"{direction}_ip")
+        except ValueError as e:
+            return False, f"Invalid CIDR block: {str(e)}", []
+
+        sql = f"SELECT * FROM ipdr WHERE {predicate}"
+        # Raw SQL is not case-scoped automatically
+        if self.active_case_id:
+            sql += " AND case_id = %s"
+            params += (self.active_case_id,)
+        return self.execute_raw_sql(sql + " ORDER BY event_ts LIMIT %s", params + (limit,))
+
     def execute_investigation_query(self, query_info: Dict) -> Dict:
         """
         Execute an investigation query using PostgreSQL-first approach
@@ -834,15 +1146,30 @@ class SupabaseHandler:
         Returns:
             Dictionary with execution results and metadata
         """
+        prepared = self._prepare_investigation_query(query_info)
+        if prepared["result"]:
+            return prepared["result"]
+        return self._execute_prepared_query(prepared)
+    
+    def _prepare_investigation_query(self, query_info: Dict) -> Dict:
+        """
+        Validate, rewrite and decide how to wrap one agent query
+        
+        Returns:
+            Context for _execute_prepared_query / _finish_investigation_query; 'result' is
+            already filled in when the query must not reach the database
+        """
         purpose = query_info.get("purpose", "Unknown purpose")
         table = query_info.get("table", "unknown_table")
         sql_query = query_info.get("sql", "")
+        prepared = {"purpose": purpose, "table": table, "original_sql": sql_query, "sql": sql_query,
+                    "rewrites": [], "corrections": [], "use_population": False, "result": None}
         
         print(f"\n🕵️ [INVESTIGATION] Executing query: {purpose}")
         print(f"   🎯 Target table: {table}")
         
         if not sql_query:
-            return {
+            prepared["result"] = {
                 "purpose": purpose,
                 "table": table,
                 "success": False,
@@ -854,128 +1181,261 @@ class SupabaseHandler:
                     "execution_method": "failed_no_sql"
                 }
             }
+            return prepared
+        
+        # Catch hallucinated tables/columns locally: fix known aliases, send the rest back to the agent
+        validation = get_schema_validator().validate(sql_query, self)
+        prepared["corrections"] = validation["corrections"]
+        if validation["corrections"]:
+            fixes = ", ".join(f"{c['from']} -> {c['to']}" for c in validation["corrections"])
+            print(f"   🩹 Corrected columns: {fixes}")
+            sql_query = validation["sql"]
+        if not validation["valid"]:
+            for error in validation["errors"]:
+                print(f"   ❌ {error}")
+            prepared["result"] = {
+                "purpose": purpose,
+                "table": table,
+                "success": False,
+                "message": f"Schema validation failed: {'; '.join(validation['errors'])}",
+                "row_count": 0,
+                "actual_data": [],
+                "rejected": True,
+                "validation": {"errors": validation["errors"], "corrections": validation["corrections"]},
+                "query_metadata": {
+                    "original_sql": prepared["original_sql"],
+                    "execution_method": "failed_schema_validation"
+                }
+            }
+            return prepared
+        
+        # Statistics are computed over the whole result server-side, so only a sample is transferred
+        use_population = POPULATION_STATS_ENABLED and bool(self.pg_connection) \
+            and wrap_with_population_stats(sql_query) is not None
+        
+        # Make the agent's SQL index-friendly and bounded before it reaches the database
+        rewrites = []
+        if QUERY_REWRITE_ENABLED:
+            original_sql = sql_query
+            # No injected LIMIT when the wrapper samples rows - the statistics need the full population
+            row_limit = 0 if use_population else QUERY_REWRITE_ROW_LIMIT
+            # Casts are only dropped where the column's real type is known
+            column_types = get_schema_validator().catalog_types(self)
+            sql_query, rewrites = SQLRewriter(row_limit=row_limit, column_types=column_types).rewrite(sql_query)
+            if rewrites:
+                print(f"   ✏️ Rewrote query ({', '.join(r['rule'] for r in rewrites)})")
+                print(f"      Original:  {original_sql}")
+                for r in rewrites:
+                    print(f"      {r['rule']}: {r['before']} -> {r['after']}")
+                print(f"      Rewritten: {sql_query}")
+        
+        prepared.update(sql=sql_query, rewrites=rewrites, use_population=use_population)
+        return prepared
+    
+    def _execute_prepared_query(self, prepared: Dict) -> Dict:
+        """Run one prepared query on its own: PostgreSQL first, Supabase fallback"""
+        sql_query = prepared["sql"]
+        started = time.perf_counter()
+        population = None
+        if prepared["use_population"]:
+            success, message, data = self.execute_postgresql_query(wrap_with_population_stats(sql_query),
+                                                                   cache_tables=cacheable_tables(sql_query))
+            population = unpack_population(data) if success else None
+            gated_out = self.last_gate_verdict and self.last_gate_verdict["status"] in ("rejected", "timed_out")
+            if population is None and not gated_out:
+                # The wrapper only runs on PostgreSQL - anything else gets the plain query
+                print(f"   ⚠️ Population statistics unavailable, running the query directly")
+                success, message, data = self.execute_postgresql_query(sql_query)
+        else:
+            success, message, data = self.execute_postgresql_query(sql_query)
+        elapsed = time.perf_counter() - started
         
-        # Use PostgreSQL-first approach with Supabase fallback
-        success, message, data = self.execute_postgresql_query(sql_query)
+        method = "postgresql_primary" if self.pg_connection else "supabase_fallback"
+        return self._finish_investigation_query(prepared, success, message, data, elapsed,
+                                                population, self.last_gate_verdict, method)
+    
+    def _finish_investigation_query(self, prepared: Dict, success: bool, message: str, data: List[Dict],
+                                    elapsed: float, population: Optional[Dict], verdict: Optional[Dict],
+                                    execution_method: str) -> Dict:
+        """Build the result dict for an executed query and feed the index advisor"""
+        sql_query = prepared["sql"]
+        if population:
+            row_count = population["total_count"]
+            preview = population["sample"]
+        else:
+            row_count = len(data) if data else 0
+            preview = data[:10] if data else []  # First 10 records for preview
+
+        # Feed the index advisor with the workload the agents actually generate
+        if success:
+            try:
+                get_index_advisor().record(sql_query, elapsed, row_count,
+                                           case_scoped=bool(self.active_case_id), supabase_handler=self)
+            except Exception as e:
+                print(f"⚠️ Index advisor could not record query: {str(e)}")
         
         # Prepare result
         result = {
-            "purpose": purpose,
-            "table": table,
+            "purpose": prepared["purpose"],
+            "table": prepared["table"],
             "success": success,
             "message": message,
-            "row_count": len(data) if data else 0,
-            "actual_data": data[:10] if data else [],  # First 10 records for preview
-            "total_records_available": len(data) if data else 0,
+            "row_count": row_count,
+            "actual_data": preview,
+            "total_records_available": row_count,
             "query_metadata": {
-                "original_sql": sql_query,
-                "execution_method": "postgresql_primary" if self.pg_connection else "supabase_fallback",
+                "original_sql": prepared["original_sql"],
+                "rewritten_sql": sql_query if prepared["rewrites"] else None,
+                "rewrites": prepared["rewrites"],
+                "execution_method": execution_method,
+                "elapsed_ms": round(elapsed * 1000, 2),
                 "note": "PostgreSQL-first execution with Supabase fallback"
             }
         }
+
+        if prepared["corrections"]:
+            result["validation"] = {"errors": [], "corrections": prepared["corrections"]}
+
+        if population:
+            result["population"] = {key: population[key] for key in ("total_count", "column_stats", "time_range")}
+            if execution_method == "postgresql_primary":
+                result["query_metadata"]["execution_method"] = "postgresql_population_stats"
+
+        if verdict:
+            result["cost_gate"] = {key: verdict[key] for key in
+                                   ("status", "estimated_cost", "estimated_rows", "reason", "hotspots")}
+            result["rejected"] = verdict["status"] in ("rejected", "timed_out")
+            if verdict["status"] == "downgraded":
+                result["query_metadata"]["executed_sql"] = verdict["sql"]
         
         if success:
-            print(f"   ✅ Investigation query completed: {len(data)} records retrieved")
+            print(f"   ✅ Investigation query completed: {row_count} records matched, {len(preview)} transferred")
         else:
             print(f"   ❌ Investigation query failed: {message}")
         
         return result
     
-    def _parse_sql_filters(self, sql_query: str) -> Dict:
+    def _execute_batch_round_trip(self, query_list: List[Dict]) -> Optional[List[Dict]]:
         """
-        Parse SQL WHERE conditions into a filters dictionary
-        This is a simplified parser for basic conditions
-        """
-        filters = {}
-        
-        if not sql_query:
-            return filters
-        
-        sql_lower = sql_query.lower()
+        Run all queries of an investigation with one EXPLAIN round trip (for the cost gate)
+        and one execution round trip, via run_investigation_batch
         
-        # Check for OR conditions first
-        if ' or ' in sql_lower:
-            print(f"   ⚠️ OR condition detected - PostgREST requires special handling")
-            # For OR conditions, we'll extract the first condition only
-            # PostgREST OR queries need different syntax: ?column=eq.value1&column=eq.value2
-            # For now, we'll use the first condition as primary filter
-            or_parts = sql_lower.split(' or ')
-            if or_parts:
-                # Use the first part for basic filtering
-                sql_lower = or_parts[0]
-        
-        # Look for basic WHERE conditions like "column = 'value'"
-        import re
-        
-        # Pattern for simple equality conditions
-        patterns = [
-            r"(\w+)\s*=\s*'([^']+)'",  # column = 'value'
-            r"(\w+)\s*=\s*(\d+)",      # column = number
-        ]
+        Queries that fail inside the batch are re-run on their own so they still get the
+        usual error handling and fallback. Returns None when batching is unavailable.
+        """
+        batch = BatchExecutor(self)
+        if not self.pg_connection or not batch.available():
+            return None
         
-        for pattern in patterns:
-            matches = re.findall(pattern, sql_lower)
-            for column, value in matches:
-                # Try to convert numeric values
-                try:
-                    if isinstance(value, str) and value.isdigit():
-                        filters[column] = int(value)
-                    else:
-                        filters[column] = value
-                except:
-                    filters[column] = value
+        prepared_list = [self._prepare_investigation_query(query_info) for query_info in query_list]
+        results: List[Optional[Dict]] = [p["result"] for p in prepared_list]
+        pending = [i for i, p in enumerate(prepared_list) if not p["result"]]
+        
+        # The statement each query actually sends: population wrapper, then case scoping
+        statements, unscoped = {}, {}
+        for i in pending:
+            prepared = prepared_list[i]
+            statement = wrap_with_population_stats(prepared["sql"]) if prepared["use_population"] else prepared["sql"]
+            unscoped[i] = statement
+            if self.active_case_id:
+                statement, _ = scope_sql_to_case(statement, self.active_case_id)
+            statements[i] = statement
+        
+        # Cached results need one versions lookup for the whole batch; keys match execute_postgresql_query's
+        cache_entries = {}
+        dependencies = {i: cacheable_tables(prepared_list[i]["sql"]) if QUERY_CACHE_ENABLED else None for i in pending}
+        all_tables = sorted({t for tables in dependencies.values() if tables for t in tables})
+        database_versions = self._database_versions(all_tables) if all_tables else None
+        if database_versions is not None:
+            for i in list(pending):
+                if not dependencies[i]:
+                    continue
+                cache_entries[i] = self._cache_entry(unscoped[i], dependencies[i], database_versions)
+                cached = get_query_cache().get(*cache_entries[i])
+                if cached is not None:
+                    data = cached["data"]
+                    population = unpack_population(data) if prepared_list[i]["use_population"] else None
+                    print(f"   ⚡ Query {i + 1} served from result cache")
+                    results[i] = self._finish_investigation_query(
+                        prepared_list[i], True, "Served from result cache", data, 0.0,
+                        population, cached["verdict"], "result_cache")
+                    pending.remove(i)
+        
+        if not pending:
+            return results
+        
+        print(f"\n📦 [BATCH] Planning {len(pending)} queries in one round trip...")
+        explained = batch.run([statements[i] for i in pending], explain_only=True) or [None] * len(pending)
+        gate = QueryCostGate(self)
+        verdicts, run_alone, to_run = {}, [], []
+        for i, plan in zip(pending, explained):
+            if not plan or plan["error"]:
+                run_alone.append(i)
+                continue
+            verdict = gate.review(statements[i], plan=QueryCostGate.plan_from_explain(plan["result"]))
+            verdicts[i] = verdict
+            if verdict["status"] == "rejected":
+                print(f"   🚫 Query {i + 1} rejected by cost gate: {verdict['reason']}")
+                results[i] = self._finish_investigation_query(
+                    prepared_list[i], False, f"Rejected by cost gate: {verdict['reason']}", [], 0.0,
+                    None, verdict, "postgresql_batch")
+            else:
+                to_run.append(i)
         
-        return filters
+        if to_run:
+            print(f"📦 [BATCH] Executing {len(to_run)} queries in one round trip...")
+            executed = batch.run([verdicts[i]["sql"] for i in to_run])
+            if executed is None:
+                run_alone.extend(to_run)
+            else:
+                for i, outcome in zip(to_run, executed):
+                    # Re-running a query that overran its timeout would only overrun again
+                    if outcome["timed_out"]:
+                        print(f"   ⏱️ Query {i + 1} timed out in batch: {outcome['error']}")
+                        results[i] = self._finish_investigation_query(
+                            prepared_list[i], False, f"Query timed out: {outcome['error']}", [],
+                            (outcome["elapsed_ms"] or 0) / 1000, None, verdicts[i], "postgresql_batch")
+                        continue
+                    if outcome["error"]:
+                        print(f"   ⚠️ Query {i + 1} failed in batch: {outcome['error']}")
+                        run_alone.append(i)
+                        continue
+                    data = outcome["result"] or []
+                    if i in cache_entries:
+                        get_query_cache().put(cache_entries[i][0], {"data": data, "verdict": verdicts[i]},
+                                              cache_entries[i][1])
+                    population = unpack_population(data) if prepared_list[i]["use_population"] else None
+                    message = f"Executed in batch, retrieved {population['total_count'] if population else len(data)} records"
+                    results[i] = self._finish_investigation_query(
+                        prepared_list[i], True, message, data, (outcome["elapsed_ms"] or 0) / 1000,
+                        population, verdicts[i], "postgresql_batch")
+        
+        for i in sorted(run_alone):
+            results[i] = self._execute_prepared_query(prepared_list[i])
+        return results
+    
+    def _parse_sql_table(self, sql_query: str) -> str:
+        """Parse the single FROM table of a SELECT"""
+        return source_table(parse_select(sql_query))
+    
+    def _parse_sql_filters(self, sql_query: str) -> List[Tuple[Optional[str], str, str]]:
+        """
+        Parse SQL WHERE conditions into PostgREST filters
+        Each ANDed condition is a (column, operator, criteria) triple; OR groups are (None, 'or', tree)
+        """
+        return translate_filters(parse_select(sql_query))
     
     def _parse_sql_columns(self, sql_query: str) -> str:
-        """Parse SELECT columns from SQL query"""
-        if not sql_query:
-            return "*"
-        
-        # Simple pattern to extract columns between SELECT and FROM
-        import re
-        match = re.search(r'select\s+(.*?)\s+from', sql_query.lower())
-        if match:
-            columns = match.group(1).strip()
-            
-            # Handle aggregate functions and aliases for PostgREST
-            if 'sum(' in columns.lower() or 'count(' in columns.lower() or 'avg(' in columns.lower():
-                # For aggregate functions, PostgREST has special requirements
-                # We'll need to use basic columns and handle aggregation differently
-                print(f"   ⚠️ Aggregate function detected, using simple column selection")
-                return "*"  # Fallback to all columns for aggregate queries
-            
-            # Fix spacing issues with aliases
-            columns = re.sub(r'\s+as\s+', ' as ', columns)  # Normalize AS spacing
-            columns = re.sub(r'(\w+)\s*as\s*(\w+)', r'\1 as \2', columns)  # Fix alias spacing
-            
-            return columns if columns else "*"
-        
-        return "*"
+        """Parse SELECT columns into a PostgREST select string"""
+        return translate_columns(parse_select(sql_query))
     
-    def _parse_sql_limit(self, sql_query: str) -> int:
-        """Parse LIMIT from SQL query"""
-        if not sql_query:
-            return 1000
-        
-        import re
-        match = re.search(r'limit\s+(\d+)', sql_query.lower())
-        if match:
-            return int(match.group(1))
-        
-        return 1000  # Default limit
+    def _parse_sql_limit(self, sql_query: str) -> Tuple[Optional[int], int]:
+        """Parse LIMIT and OFFSET from SQL query (limit is None when absent)"""
+        return translate_limit(parse_select(sql_query))
     
-    def _parse_sql_order(self, sql_query: str) -> Optional[str]:
-        """Parse ORDER BY from SQL query"""
-        if not sql_query:
-            return None
-        
-        import re
-        match = re.search(r'order\s+by\s+(\w+)', sql_query.lower())
-        if match:
-            return match.group(1)
-        
-        return None
+    def _parse_sql_order(self, sql_query: str) -> List[Tuple[str, bool]]:
+        """Parse ORDER BY from SQL query as (column, descending) pairs"""
+        return translate_order(parse_select(sql_query))
     
     def _is_aggregate_query(self, sql_query: str) -> bool:
         """Check if SQL query contains aggregate functions"""
@@ -1162,14 +1622,22 @@ class SupabaseHandler:
         successful_queries = 0
         failed_queries = 0
         total_records = 0
+        rejected_queries = []
+        
+        # One EXPLAIN and one execution round trip for the whole investigation when possible
+        try:
+            batched = self._execute_batch_round_trip(query_list)
+        except Exception as e:
+            print(f"   ⚠️ Batch execution unavailable, running queries one by one: {str(e)}")
+            batched = None
         
         for i, query_info in enumerate(query_list, 1):
             print(f"\n   📋 [{i}/{len(query_list)}] Processing query...")
             
             try:
-                result = self.execute_investigation_query(query_info)
-                table_name = result.get("table", f"query_{i}")
-                results[table_name] = result
+                result = batched[i - 1] if batched else self.execute_investigation_query(query_info)
+                # Keyed per query - several queries often target the same table
+                results[f"query_{i}"] = result
                 
                 if result.get("success", False):
                     successful_queries += 1
@@ -1178,6 +1646,15 @@ class SupabaseHandler:
                 else:
                     failed_queries += 1
                     print(f"      ❌ Query {i} failed: {result.get('message', 'Unknown error')}")
+                    if result.get("rejected"):
+                        gate = result.get("cost_gate") or {}
+                        rejected_queries.append({
+                            "purpose": result.get("purpose"),
+                            "table": result.get("table"),
+                            "sql": query_info.get("sql", ""),
+                            "reason": gate.get("reason") or "; ".join(result.get("validation", {}).get("errors", [])),
+                            "hotspots": gate.get("hotspots", [])
+                        })
                     
             except Exception as e:
                 failed_queries += 1
@@ -1199,7 +1676,10 @@ class SupabaseHandler:
             "successful_queries": successful_queries,
             "failed_queries": failed_queries,
             "total_records_retrieved": total_records,
-            "success_rate": (successful_queries / len(query_list)) * 100 if query_list else 0
+            "success_rate": (successful_queries / len(query_list)) * 100 if query_list else 0,
+            "rejected_queries": rejected_queries,
+            "batched": bool(batched),
+            "timings_ms": {key: result.get("query_metadata", {}).get("elapsed_ms") for key, result in results.items()}
         }
         
         print(f"\n📈 [BATCH SUMMARY]")
@@ -0,0 +1,341 @@
+import json
+import math
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import SKETCH_HLL_PRECISION, SKETCH_CMS_WIDTH, SKETCH_CMS_DEPTH, SKETCH_HEAVY_HITTERS
+from event_time import record_times
+from party_summary import identifier_text
+
+TOWER_SKETCHES_TABLE = "tower_sketches"
+
+SKETCH_COLUMNS = ["case_id", "cell_id", "hour", "row_count", "hll", "cms", "heavy"]
+
+# Registers and counters live in arrays so sketches merge server-side in the upsert
+# (elementwise max for HyperLogLog, elementwise sum for Count-Min); TOAST compresses them
+TOWER_SKETCHES_DDL = [
+    """CREATE OR REPLACE FUNCTION sketch_merge_max(a smallint[], b smallint[]) RETURNS smallint[]
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN a IS NULL THEN b WHEN b IS NULL THEN a
+                ELSE (SELECT array_agg(greatest(x, y) ORDER BY i) FROM unnest(a, b) WITH ORDINALITY AS r(x, y, i)) END
+$$""",
+    """CREATE OR REPLACE FUNCTION sketch_merge_sum(a integer[], b integer[]) RETURNS integer[]
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN a IS NULL THEN b WHEN b IS NULL THEN a
+                ELSE (SELECT array_agg(x + y ORDER BY i) FROM unnest(a, b) WITH ORDINALITY AS r(x, y, i)) END
+$$""",
+    """CREATE OR REPLACE FUNCTION sketch_merge_heavy(a jsonb, b jsonb, k integer) RETURNS jsonb
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(jsonb_object_agg(key, total), '{}'::jsonb) FROM (
+        SELECT key, sum(value::bigint) AS total FROM (
+            SELECT * FROM jsonb_each_text(coalesce(a, '{}'::jsonb))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(coalesce(b, '{}'::jsonb))
+        ) counts GROUP BY key ORDER BY total DESC, key LIMIT k
+    ) top
+$$""",
+    f"""CREATE TABLE IF NOT EXISTS {TOWER_SKETCHES_TABLE} (
+        case_id text NOT NULL DEFAULT '',
+        cell_id text NOT NULL,
+        hour timestamp NOT NULL,
+        row_count bigint NOT NULL DEFAULT 0,
+        hll smallint[] NOT NULL,
+        cms integer[] NOT NULL,
+        heavy jsonb NOT NULL DEFAULT '{{}}',
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (case_id, cell_id, hour)
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_{TOWER_SKETCHES_TABLE}_cell_hour ON {TOWER_SKETCHES_TABLE} (cell_id, hour)",
+]
+
+TOWER_SKETCHES_UPSERT = f"""INSERT INTO {TOWER_SKETCHES_TABLE} ({', '.join(SKETCH_COLUMNS)})
+SELECT case_id, cell_id, hour::timestamp, row_count, hll::smallint[], cms::integer[], heavy::jsonb
+FROM (VALUES %s) AS batch ({', '.join(SKETCH_COLUMNS)})
+ON CONFLICT (case_id, cell_id, hour) DO UPDATE SET
+    row_count = {TOWER_SKETCHES_TABLE}.row_count + EXCLUDED.row_count,
+    hll = sketch_merge_max({TOWER_SKETCHES_TABLE}.hll, EXCLUDED.hll),
+    cms = sketch_merge_sum({TOWER_SKETCHES_TABLE}.cms, EXCLUDED.cms),
+    heavy = sketch_merge_heavy({TOWER_SKETCHES_TABLE}.heavy, EXCLUDED.heavy, {SKETCH_HEAVY_HITTERS}),
+    updated_at = now()"""
+
+SOURCE_COLUMNS = ["case_id", "a_party", "first_cell_id_a"]
+
+BACKFILL_PAGE_SIZE = 50000
+
+_MASK_32 = np.uint64(0xFFFFFFFF)
+
+
+def hash_numbers(values: pd.Series) -> np.ndarray:
+    """Stable 64-bit hashes (the same in every process, so persisted sketches stay comparable)"""
+    return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Bit length of uint64 values, exact (each 32-bit half fits a float64 mantissa)"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & _MASK_32).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1]).astype(np.int64)
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter over 2^precision registers"""
+
+    def __init__(self, precision: int = SKETCH_HLL_PRECISION, registers: Optional[np.ndarray] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.int16) if registers is None else np.asarray(registers, dtype=np.int16)
+
+    @staticmethod
+    def positions(hashes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(register index, rank) for each hash: top bits pick the register, leading zeros of the rest give the rank"""
+        index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = hashes << np.uint64(precision)
+        rank = np.minimum(64 - _bit_length(rest) + 1, 64 - precision + 1)
+        return index, rank.astype(np.int16)
+
+    def add(self, hashes: np.ndarray):
+        index, rank = self.positions(hashes, self.precision)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    @property
+    def relative_error(self) -> float:
+        """Standard error of the estimate, as a fraction of it"""
+        return 1.04 / math.sqrt(self.m)
+
+    def estimate(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Linear counting is more accurate while many registers are still empty
+        if raw <= 2.5 * self.m and zeros:
+            return self.m * math.log(self.m / zeros)
+        return float(raw)
+
+
+class CountMinSketch:
+    """Count-Min frequency sketch: estimates never undercount, and overcount by at most e/width * total with probability 1 - e^-depth"""
+
+    def __init__(self, width: int = SKETCH_CMS_WIDTH, depth: int = SKETCH_CMS_DEPTH, counters: Optional[np.ndarray] = None):
+        self.width = width
+        self.depth = depth
+        self.counters = np.zeros(width * depth, dtype=np.int64) if counters is None \
+            else np.asarray(counters, dtype=np.int64)
+
+    @staticmethod
+    def cells(hashes: np.ndarray, width: int, depth: int) -> np.ndarray:
+        """Flat counter index per (row, hash), shape (depth, n); rows use double hashing of the two hash halves"""
+        first = (hashes & _MASK_32).astype(np.int64)
+        second = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        rows = np.arange(depth, dtype=np.int64)[:, None]
+        return rows * width + (first[None, :] + rows * second[None, :]) % width
+
+    def add(self, hashes: np.ndarray, counts: Optional[np.ndarray] = None):
+        counts = np.ones(len(hashes), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        for row in self.cells(hashes, self.width, self.depth):
+            np.add.at(self.counters, row, counts)
+
+    def merge(self, other: "CountMinSketch"):
+        self.counters += other.counters
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        return self.counters[self.cells(hashes, self.width, self.depth)].min(axis=0)
+
+    @property
+    def epsilon(self) -> float:
+        return math.e / self.width
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+
+class TowerSketchBuilder:
+    """
+    Maintain per-(cell, hour) sketches of tower_dumps at ingest time
+
+    For each batch the numbers seen on every cell in every hour go into a HyperLogLog
+    (distinct numbers), a Count-Min sketch (per-number frequency) and a short list of
+    heavy-hitter candidates. All groups are built at once with numpy scatter operations
+    and merged into tower_sketches by the upsert, so a load never re-reads old rows.
+    """
+
+    def __init__(self, precision: int = SKETCH_HLL_PRECISION, width: int = SKETCH_CMS_WIDTH,
+                 depth: int = SKETCH_CMS_DEPTH, heavy_hitters: int = SKETCH_HEAVY_HITTERS, verbose=False):
+        self.precision = precision
+        self.width = width
+        self.depth = depth
+        self.heavy_hitters = heavy_hitters
+        self.verbose = verbose
+
+    def summarize(self, records: List[Dict]) -> pd.DataFrame:
+        """Sketches (SKETCH_COLUMNS) for one batch of tower_dumps records"""
+        df = pd.DataFrame(records)
+        for column in SOURCE_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+
+        batch = pd.DataFrame({
+            "case_id": df["case_id"].where(df["case_id"].notna(), "").astype(str),
+            "cell_id": df["first_cell_id_a"].astype(str).str.strip().where(df["first_cell_id_a"].notna()),
+            "hour": record_times(df, "tower_dumps").dt.floor("h"),
+            "number": identifier_text(df["a_party"]),
+        })
+        batch = batch.dropna(subset=["cell_id", "hour", "number"])
+        if batch.empty:
+            return pd.DataFrame(columns=SKETCH_COLUMNS)
+
+        keys = ["case_id", "cell_id", "hour"]
+        group = batch.groupby(keys, sort=False).ngroup().to_numpy()
+        groups = batch.groupby(keys, sort=False).size().rename("row_count").reset_index()
+        hashes = hash_numbers(batch["number"])
+
+        registers = np.zeros((len(groups), 1 << self.precision), dtype=np.int16)
+        index, rank = HyperLogLog.positions(hashes, self.precision)
+        np.maximum.at(registers, (group, index), rank)
+
+        counters = np.zeros((len(groups), self.width * self.depth), dtype=np.int64)
+        for row in CountMinSketch.cells(hashes, self.width, self.depth):
+            np.add.at(counters, (group, row), 1)
+
+        # Exact counts within the batch; the upsert keeps the top candidates across batches
+        counts = batch.assign(_group=group).groupby(["_group", "number"]).size().rename("n").reset_index()
+        counts = counts.sort_values(["_group", "n"], ascending=[True, False], kind="mergesort")
+        counts = counts.groupby("_group").head(self.heavy_hitters)
+        heavy = {g: dict(zip(part["number"], part["n"].astype(int)))
+                 for g, part in counts.groupby("_group", sort=False)}
+
+        groups["hll"] = list(registers.tolist())
+        groups["cms"] = list(counters.tolist())
+        groups["heavy"] = [json.dumps(heavy.get(g, {})) for g in range(len(groups))]
+        return groups[SKETCH_COLUMNS]
+
+    def merge(self, supabase_handler, records: List[Dict]) -> Tuple[bool, str]:
+        """Fold one batch of tower_dumps records into tower_sketches"""
+        sketches = self.summarize(records)
+        if sketches.empty:
+            return True, "No cell-hours to sketch"
+
+        values = [(row.case_id, row.cell_id, row.hour.to_pydatetime(), int(row.row_count), row.hll, row.cms, row.heavy)
+                  for row in sketches.itertuples(index=False)]
+        # Each row carries a few thousand array elements - keep statements moderate
+        success, message, _ = supabase_handler.bulk_write(TOWER_SKETCHES_UPSERT, values, page_size=100)
+        if success and self.verbose:
+            print(f"📶 Tower sketches: merged {len(values):,} cell-hours from {len(records):,} records")
+        return success, message
+
+    def backfill(self, supabase_handler, page_size: int = BACKFILL_PAGE_SIZE) -> Tuple[bool, str]:
+        """Sketch tower_dumps rows loaded before tower_sketches existed (only while it is still empty)"""
+        success, message, rows = supabase_handler.execute_raw_sql(f"SELECT 1 FROM {TOWER_SKETCHES_TABLE} LIMIT 1")
+        if not success:
+            return False, message
+        if rows:
+            return True, "Tower sketches already populated"
+
+        last_id, total = 0, 0
+        while True:
+            success, message, rows = supabase_handler.execute_raw_sql(
+                f"SELECT id, {', '.join(SOURCE_COLUMNS)}, event_ts FROM tower_dumps WHERE id > %s ORDER BY id LIMIT %s",
+                (last_id, page_size))
+            if not success:
+                return False, message
+            if not rows:
+                return True, f"Sketched {total:,} tower_dumps rows"
+            success, message = self.merge(supabase_handler, rows)
+            if not success:
+                return False, message
+            last_id = rows[-1]["id"]
+            total += len(rows)
+
+
+class TowerSketchQuery:
+    """Approximate answers over tower_sketches, with error bounds"""
+
+    def __init__(self, supabase_handler):
+        self.handler = supabase_handler
+
+    def _load(self, cell_ids: List[str], start: datetime, end: datetime) -> Tuple[bool, str, List[Dict]]:
+        sql = (f"SELECT cell_id, hour, row_count, hll, cms, heavy FROM {TOWER_SKETCHES_TABLE} "
+               f"WHERE cell_id = ANY(%s) AND hour >= date_trunc('hour', %s::timestamp) AND hour < %s")
+        params = [list(cell_ids), start, end]
+        # Raw SQL is not case-scoped automatically
+        if self.handler.active_case_id:
+            sql += " AND case_id = %s"
+            params.append(self.handler.active_case_id)
+        return self.handler.execute_raw_sql(sql + " ORDER BY hour, cell_id", tuple(params))
+
+    def distinct_numbers(self, cell_ids: List[str], start: datetime, end: datetime,
+                         per_hour: bool = False) -> Tuple[bool, str, Dict]:
+        """
+        Roughly how many distinct numbers hit the cells in [start, end)
+
+        Returns:
+            {'estimate', 'relative_error', 'bounds_95', 'rows', 'hours'} and, with per_hour,
+            'by_hour': the same per hour (cells combined)
+        """
+        success, message, rows = self._load(cell_ids, start, end)
+        if not success:
+            return False, message, {}
+
+        total = HyperLogLog()
+        hours: Dict[datetime, HyperLogLog] = {}
+        row_counts: Dict[datetime, int] = {}
+        for row in rows:
+            sketch = HyperLogLog(registers=row["hll"])
+            total.merge(sketch)
+            if per_hour:
+                hours.setdefault(row["hour"], HyperLogLog()).merge(sketch)
+                row_counts[row["hour"]] = row_counts.get(row["hour"], 0) + row["row_count"]
+
+        result = self._distinct(total, sum(row["row_count"] for row in rows))
+        result["hours"] = len({row["hour"] for row in rows})
+        if per_hour:
+            result["by_hour"] = [dict(hour=hour.isoformat(), **self._distinct(sketch, row_counts[hour]))
+                                 for hour, sketch in sorted(hours.items())]
+        return True, f"Merged {len(rows)} cell-hour sketches", result
+
+    @staticmethod
+    def _distinct(sketch: HyperLogLog, row_count: int) -> Dict:
+        # Never more distinct numbers than records
+        estimate = min(sketch.estimate(), row_count)
+        margin = 2 * sketch.relative_error * estimate
+        return {
+            "estimate": round(estimate),
+            "relative_error": round(sketch.relative_error, 4),
+            "bounds_95": [max(0, round(estimate - margin)), min(row_count, round(estimate + margin))],
+            "rows": row_count,
+        }
+
+    def top_talkers(self, cell_ids: List[str], start: datetime, end: datetime, k: int = 10) -> Tuple[bool, str, Dict]:
+        """
+        The numbers seen most often on the cells in [start, end)
+
+        Candidates come from each cell-hour's heavy-hitter list; their counts are Count-Min
+        estimates over the merged sketch, which overcount by at most 'max_overcount'
+        with probability 'confidence'.
+        """
+        success, message, rows = self._load(cell_ids, start, end)
+        if not success:
+            return False, message, {}
+
+        sketch = CountMinSketch()
+        candidates = set()
+        for row in rows:
+            sketch.merge(CountMinSketch(counters=row["cms"]))
+            candidates.update(row["heavy"])
+
+        total = int(sum(row["row_count"] for row in rows))
+        numbers = sorted(candidates)
+        estimates = sketch.estimate(hash_numbers(pd.Series(numbers, dtype=object))) if numbers else np.array([])
+        ranked = sorted(zip(numbers, estimates.tolist()), key=lambda item: (-item[1], item[0]))[:k]
+        return True, f"Merged {len(rows)} cell-hour sketches", {
+            "top": [{"number": number, "estimated_count": int(count)} for number, count in ranked],
+            "rows": total,
+            "max_overcount": math.ceil(sketch.epsilon * total),
+            "confidence": round(sketch.confidence, 4),
+        }